@@ -0,0 +1,383 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import blind_watermark as bwm
+from blind_watermark import WaterMark
+import events
+import logger
+import metrics
+import payload
+import registry
+import utils
+from utils import WatermarkEngine
+
+# Close the welcome message
+bwm.bw_notes.close()
+
+# Watermark payload as written by utils.prepare_watermark
+SAMPLE_PAYLOAD = payload.encode_payload(uuid.UUID("12345678-1234-1234-1234-123456789abc"), 1704103200, "originals")
+
+# Resolutions of the benchmark suite in megapixels, with the 4:3 sizes used for them
+SUITE_RESOLUTIONS = {0.5: (816, 612), 12: (4000, 3000), 50: (8192, 6144)}
+SUITE_FORMATS = ("jpg", "png")
+
+# Stages reported by the suite and the metrics stages they are made of
+EMBED_STAGES = {
+    "read": ("embed.read",),
+    "decode": ("embed.decode",),
+    "hash": ("embed.hash",),
+    "transform": ("embed.transform",),
+    "encode": ("embed.encode",),
+    "log": ("log.write",),
+}
+EXTRACT_STAGES = {
+    "decode": ("extract.decode",),
+    "transform": ("extract.transform",),
+    "log": ("log.write", "log.validate"),
+}
+
+def make_synthetic_image(width, height, seed=0, strip_rows=512):
+    """
+    Generate a photo-like BGR test image: smooth gradients plus noise, so it compresses like a real photo.
+    The image is generated in strips so that even 50 MP images need little memory beyond the result.
+    :param width: Image width in pixels.
+    :param height: Image height in pixels.
+    :param seed: Seed for the noise.
+    :param strip_rows: Rows generated at a time.
+    :return: uint8 array of shape (height, width, 3).
+    """
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    x = np.arange(width, dtype=np.float32)
+    for top in range(0, height, strip_rows):
+        y = np.arange(top, min(top + strip_rows, height), dtype=np.float32)[:, None]
+        channels = [
+            127 + 100 * np.sin(x / (width / 3) + phase) * np.cos(y / (height / 2) - phase)
+            for phase in (0.0, 1.0, 2.0)
+        ]
+        strip = np.stack(channels, axis=-1) + rng.normal(0, 12, size=(len(y), width, 3))
+        img[top:top + len(y)] = np.clip(strip, 0, 255)
+    return img
+
+def benchmark_batch_embed(count=16, width=1024, height=768, batch_size=16, library_count=2):
+    """
+    Compare the per-image blind_watermark loop, the per-image engine and the batched engine on
+    same-size images, and check that the batched output is bit-identical to the per-image output.
+    :return: Dictionary of results (seconds per image and speedups).
+    """
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    imgs = [make_synthetic_image(width, height, seed) for seed in range(count)]
+    wm_bits = [engine.encode_payload(SAMPLE_PAYLOAD) for _ in imgs]
+
+    # blind_watermark's Python-level block loop; slow, so only a few images
+    start = time.perf_counter()
+    for img in imgs[:library_count]:
+        bwm1 = WaterMark(password_img=1, password_wm=1)
+        bwm1.read_img(img=img)
+        bwm1.read_wm(payload.encode_payload_bits(SAMPLE_PAYLOAD), mode='bit')
+        bwm1.embed()
+    library_time = (time.perf_counter() - start) / library_count
+
+    engine.embed(imgs[0], wm_bits[0])  # Warm the shuffler cache so both engine runs start equal
+    start = time.perf_counter()
+    single = [engine.embed(img, wm_bit) for img, wm_bit in zip(imgs, wm_bits)]
+    single_time = (time.perf_counter() - start) / count
+
+    start = time.perf_counter()
+    batched = []
+    for i in range(0, count, batch_size):
+        batched.extend(engine.embed_batch(np.stack(imgs[i:i + batch_size]), wm_bits[i:i + batch_size]))
+    batch_time = (time.perf_counter() - start) / count
+
+    return {
+        "images": count,
+        "resolution": f"{width}x{height}",
+        "batch_size": batch_size,
+        "library_seconds_per_image": library_time,
+        "engine_seconds_per_image": single_time,
+        "batch_seconds_per_image": batch_time,
+        "speedup_vs_library": library_time / batch_time,
+        "speedup_vs_engine": single_time / batch_time,
+        "bit_identical": all(np.array_equal(a, b) for a, b in zip(single, batched)),
+    }
+
+def use_scratch_logs(log_dir):
+    """Point the registry, the event store and the text logs at a scratch directory, so benchmark
+    records never reach the real logs. Only used inside the benchmark worker processes."""
+    os.makedirs(log_dir, exist_ok=True)
+    registry.REGISTRY_DIR = events.REGISTRY_DIR = logger.LOG_DIR = log_dir
+    registry.REGISTRY_PATH = os.path.join(log_dir, 'watermark_registry.db')
+    registry.WATERMARK_LOG_PATH = events.WATERMARK_LOG_PATH = os.path.join(log_dir, 'watermark_log.log')
+    events.EVENTS_PATH = logger.EVENTS_PATH = os.path.join(log_dir, 'watermark_events.jsonl')
+    registry._registry = events._store = None
+    logger.configure_logging(debug_records=False)
+
+def summarize_run(latencies, stages, wall_seconds):
+    """Summarize per-image latencies and the per-stage times collected by metrics (seconds per image) of one run."""
+    count = len(latencies)
+    collected = metrics.summary()
+    stage_seconds = {stage: sum(collected[name]["sum"] for name in names if name in collected)
+                     for stage, names in stages.items()}
+    return {
+        "latency_seconds": {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "max": float(np.max(latencies)),
+        },
+        "images_per_second": count / wall_seconds,
+        "stage_seconds_per_image": {stage: seconds / count for stage, seconds in stage_seconds.items()},
+        "metrics_seconds_per_image": {name: histogram["sum"] / count for name, histogram in collected.items()},
+    }
+
+def run_suite_configuration(work_dir, image_names):
+    """
+    Embed and then extract the originals in work_dir/originals with the real utils entry points.
+    Runs in a fresh worker process, so the peak RSS belongs to this configuration alone.
+    :return: Dictionary with embed and extract results and memory figures.
+    """
+    use_scratch_logs(os.path.join(work_dir, "logs"))
+    originals_dir = os.path.join(work_dir, "originals")
+    watermarked_dir = os.path.join(work_dir, "watermarked")
+    os.makedirs(watermarked_dir, exist_ok=True)
+    metrics.enable()
+    baseline_rss = utils.peak_rss_bytes()
+
+    lengths, latencies = {}, []
+    metrics.reset()
+    run_start = time.perf_counter()
+    for image_name in image_names:
+        start = time.perf_counter()
+        lengths[image_name] = utils.embed_watermark(image_name, originals_dir, watermarked_dir)
+        latencies.append(time.perf_counter() - start)
+    embed = summarize_run(latencies, EMBED_STAGES, time.perf_counter() - run_start)
+
+    validated, latencies = 0, []
+    metrics.reset()
+    run_start = time.perf_counter()
+    for image_name in image_names:
+        start = time.perf_counter()
+        _, status = utils.extract_watermark(image_name, lengths[image_name], watermarked_dir)
+        latencies.append(time.perf_counter() - start)
+        validated += bool(status)
+    extract = summarize_run(latencies, EXTRACT_STAGES, time.perf_counter() - run_start)
+    extract["validated"] = validated
+
+    return {
+        "embed": embed,
+        "extract": extract,
+        "baseline_rss_bytes": baseline_rss,
+        "peak_rss_bytes": utils.peak_rss_bytes(),
+    }
+
+def benchmark_suite(resolutions=tuple(SUITE_RESOLUTIONS), formats=SUITE_FORMATS, count=3):
+    """
+    Run embed_watermark and extract_watermark on synthetic images of every resolution and format.
+    Each configuration runs in its own forked process (blind_watermark requires the fork start method).
+    :param resolutions: Megapixel values, keys of SUITE_RESOLUTIONS.
+    :param formats: Original file formats ('jpg' and/or 'png').
+    :param count: Images per configuration.
+    :return: Dictionary with run metadata and one result per configuration.
+    """
+    results = []
+    for megapixels in resolutions:
+        width, height = SUITE_RESOLUTIONS[megapixels]
+        for image_format in formats:
+            with tempfile.TemporaryDirectory(prefix="watermark_bench_") as work_dir:
+                originals_dir = os.path.join(work_dir, "originals")
+                os.makedirs(originals_dir)
+                image_names = [f"bench_{seed}.{image_format}" for seed in range(count)]
+                for seed, image_name in enumerate(image_names):
+                    cv2.imwrite(os.path.join(originals_dir, image_name), make_synthetic_image(width, height, seed))
+
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+                    result = executor.submit(run_suite_configuration, work_dir, image_names).result()
+            results.append({"megapixels": megapixels, "resolution": f"{width}x{height}",
+                            "format": image_format, "images": count, **result})
+    return {"metadata": run_metadata(), "startup": benchmark_startup(), "results": results}
+
+# Output encoder settings compared by the encode benchmark: (format, utils.encode_image settings)
+ENCODE_SETTINGS = (
+    [("png", {"compression": level}) for level in (0, 1, 3, 6, 9)]
+    + [("jpg", {"quality": quality}) for quality in (95, 90, 80, 70, 50)]
+    + [("webp", {})]  # Lossless
+    + [("webp", {"quality": quality}) for quality in (95, 90, 80, 50)]
+)
+
+def benchmark_encode(width=1024, height=768, runs=5):
+    """
+    Encode one watermarked image with every setting of ENCODE_SETTINGS and extract the watermark
+    from the result, to pick the fastest setting that still extracts reliably.
+    :param width: Image width in pixels.
+    :param height: Image height in pixels.
+    :param runs: Encodes timed per setting.
+    :return: Dictionary with run metadata and one result per setting: encode seconds (mean and min),
+             output bytes, bits per pixel, and whether the payload was extracted, with its confidence.
+    """
+    engine = utils.get_default_engine()
+    watermarked = engine.embed(make_synthetic_image(width, height), engine.encode_payload(SAMPLE_PAYLOAD))
+    expected = payload.decode_payload(SAMPLE_PAYLOAD)["uuid"]
+
+    results = []
+    for image_format, settings in ENCODE_SETTINGS:
+        encode_times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            encoded = utils.encode_image(watermarked, f".{image_format}", **settings)
+            encode_times.append(time.perf_counter() - start)
+        decoded = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+        try:
+            extracted = engine.extract_payload(decoded)
+            extracts, confidence = extracted["uuid"] == expected, extracted["confidence"]
+        except payload.PayloadError:
+            extracts, confidence = False, None
+        results.append({
+            "format": image_format,
+            "settings": settings or {"quality": "lossless" if image_format == "webp" else "default"},
+            "encode_seconds": {"mean": float(np.mean(encode_times)), "min": float(np.min(encode_times))},
+            "bytes": len(encoded),
+            "bits_per_pixel": 8 * len(encoded) / (width * height),
+            "extracts": extracts,
+            "confidence": confidence,
+        })
+    return {"metadata": run_metadata(), "resolution": f"{width}x{height}", "encode": results}
+
+# Commands timed by the start-up benchmark, as arguments to the Python interpreter
+STARTUP_COMMANDS = {
+    "cli_help": ["main.py", "--help"],
+    "cli_import": ["-c", "import main"],
+    "gui_import": ["-c", "import gui"],
+    "engine_import": ["-c", "import utils"],
+}
+
+def parse_importtime(stderr):
+    """
+    Parse the output of python -X importtime.
+    :return: Tuple of the total import time in seconds and {module: cumulative seconds} of the top-level imports.
+    """
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not name[1:].startswith(" "):  # Nested imports are indented below their parent
+            top_level[name.strip()] = int(cumulative) / 1e6
+    return sum(top_level.values()), top_level
+
+def benchmark_startup(runs=5, top=10):
+    """
+    Time the interpreter start-up of the CLI and GUI entry points in fresh processes, and break
+    the import time down with python -X importtime.
+    :param runs: Runs per command; the wall times of all runs are summarized.
+    :param top: Number of slowest top-level imports reported per command.
+    :return: Dictionary with one result per command of STARTUP_COMMANDS.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, arguments in STARTUP_COMMANDS.items():
+        wall_times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=base_dir,
+                                       capture_output=True, text=True)
+            wall_times.append(time.perf_counter() - start)
+        if completed.returncode != 0:  # e.g. PyQt5 is not installed
+            results[name] = {"error": completed.stderr.strip().splitlines()[-1]}
+            continue
+        import_seconds, modules = parse_importtime(completed.stderr)
+        results[name] = {
+            "command": " ".join(["python", *arguments]),
+            "wall_seconds": {"mean": float(np.mean(wall_times)), "min": float(np.min(wall_times))},
+            "import_seconds": import_seconds,
+            "slowest_imports": dict(sorted(modules.items(), key=lambda item: -item[1])[:top]),
+        }
+    return results
+
+def run_metadata():
+    """Describe the commit and environment a result was measured on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare_results(baseline, current):
+    """
+    Compare two suite results configuration by configuration.
+    :return: List of rows with the baseline and current mean latencies and their ratio (current / baseline).
+    """
+    rows = []
+    baseline_by_key = {(r["megapixels"], r["format"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = baseline_by_key.get((result["megapixels"], result["format"]))
+        if old is None:
+            continue
+        for mode in ("embed", "extract"):
+            old_latency = old[mode]["latency_seconds"]["mean"]
+            new_latency = result[mode]["latency_seconds"]["mean"]
+            rows.append({"megapixels": result["megapixels"], "format": result["format"], "mode": mode,
+                         "baseline_seconds": old_latency, "current_seconds": new_latency,
+                         "ratio": new_latency / old_latency})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Watermark performance benchmarks")
+    parser.add_argument("benchmark", choices=["batch", "suite", "startup", "encode", "compare"], help="Benchmark to run")
+    parser.add_argument("files", nargs="*", help="compare: baseline and current suite result files")
+    parser.add_argument("--images", type=int, default=None,
+                        help="Number of synthetic images (default: 16 for batch, 3 per configuration for suite)")
+    parser.add_argument("--width", type=int, default=1024, help="Image width (default: 1024)")
+    parser.add_argument("--height", type=int, default=768, help="Image height (default: 768)")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per batch (default: 16)")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=list(SUITE_RESOLUTIONS),
+                        choices=list(SUITE_RESOLUTIONS), help="Suite resolutions in megapixels (default: all)")
+    parser.add_argument("--formats", nargs="+", default=list(SUITE_FORMATS), choices=SUITE_FORMATS,
+                        help="Suite original formats (default: jpg png)")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="startup: runs per command; encode: encodes per setting (default: 5)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.benchmark == "batch":
+        results = benchmark_batch_embed(args.images or 16, args.width, args.height, args.batch_size)
+    elif args.benchmark == "suite":
+        resolutions = [int(mp) if mp == int(mp) else mp for mp in args.resolutions]
+        results = benchmark_suite(resolutions, args.formats, args.images or 3)
+    elif args.benchmark == "startup":
+        results = {"metadata": run_metadata(), "startup": benchmark_startup(args.runs)}
+    elif args.benchmark == "encode":
+        results = benchmark_encode(args.width, args.height, args.runs)
+    else:
+        if len(args.files) != 2:
+            parser.error("compare needs a baseline and a current result file")
+        with open(args.files[0]) as baseline_file, open(args.files[1]) as current_file:
+            results = compare_results(json.load(baseline_file), json.load(current_file))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
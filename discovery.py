@@ -0,0 +1,58 @@
+import fnmatch
+import os
+from logger import debug_logger
+
+# File extensions treated as images (compared case-insensitively)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+# Function to check a relative path against glob patterns
+def matches_any(relative_path, patterns):
+    """
+    Checks a relative path against glob patterns. Paths are matched with '/' separators on
+    every platform, and '*' also matches across directories, so '*.png' matches 'a/b.png'.
+    :param relative_path: Path relative to the scanned root.
+    :param patterns: Iterable of glob patterns.
+    :return: True if any pattern matches.
+    """
+    path = relative_path.replace(os.sep, '/')
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+# Generator that streams the images below a directory
+def iter_images(root, include=(), exclude=(), extensions=IMAGE_EXTENSIONS):
+    """
+    Lazily walks a directory tree with os.scandir and yields the images in it as paths relative
+    to root, so processing can start before the scan finishes and huge trees are never listed
+    up front. Directories are read one at a time, depth first; symlinked directories are not followed.
+    :param root: Directory to scan.
+    :param include: Glob patterns; when given, only matching files are yielded.
+    :param exclude: Glob patterns for files to skip. A directory that matches (as 'dir' or
+                    'dir/') is not entered at all.
+    :param extensions: File extensions to accept, compared case-insensitively.
+    :return: Generator of relative image paths.
+    """
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not (matches_any(relative_path, exclude) or matches_any(relative_path + os.sep, exclude)):
+                                subdirs.append(relative_path)
+                            continue
+                        if not entry.is_file() or not entry.name.lower().endswith(extensions):
+                            continue
+                    except OSError:  # Entry vanished or is unreadable
+                        continue
+                    if include and not matches_any(relative_path, include):
+                        continue
+                    if exclude and matches_any(relative_path, exclude):
+                        continue
+                    yield relative_path
+        except OSError as e:
+            debug_logger.warning(f"Skipping unreadable directory {os.path.join(root, relative_dir)}: {e}")
+        pending.extend(reversed(subdirs))  # Visit subdirectories in scan order
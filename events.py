@@ -0,0 +1,266 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within this process
+    fcntl = None
+from registry import LOG_RECORD_PATTERN, REGISTRY_DIR, WATERMARK_LOG_PATH
+
+# Define the event store location (kept next to the text logs)
+EVENTS_PATH = os.path.join(REGISTRY_DIR, 'watermark_events.jsonl')
+
+# Each entry of the offset index is the little-endian byte offset of one record
+OFFSET_FORMAT = struct.Struct('<Q')
+
+
+# Function to serialize one event the same way for writing and for byte-level lookups
+def encode_event(event):
+    """
+    Serializes an event as one compact JSON line.
+    :param event: Dictionary of event fields.
+    :return: UTF-8 encoded line including the trailing newline.
+    """
+    return (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class WatermarkEventStore:
+    """
+    Append-only store of watermark events: one JSON line per event in the data file, plus an
+    offset index (<path>.idx) holding the byte offset of every record for random access. Appends
+    hold an exclusive lock on the data file, so several processes (e.g. 'watch' next to a CLI run)
+    can share one store.
+    """
+
+    def __init__(self, path=EVENTS_PATH):
+        """
+        Opens (and if needed creates) the event store.
+        :param path: Path to the JSONL data file.
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = threading.Lock()
+        self._data = open(path, 'ab')
+        self._index = open(self.index_path, 'ab')
+        with self._locked():
+            self._end = self._data.seek(0, os.SEEK_END)
+            consistent = self._index_is_consistent()
+        if not consistent:
+            self.rebuild_index()  # A previous writer stopped between the two writes of an append
+
+    @contextmanager
+    def _locked(self):
+        """Holds the thread lock and an exclusive lock on the data file shared with other processes."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._data.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._data.fileno(), fcntl.LOCK_UN)
+
+    def _index_is_consistent(self):
+        """Checks that the last indexed record is exactly the last complete line of the data file."""
+        index_size = self._index.seek(0, os.SEEK_END)
+        if index_size % OFFSET_FORMAT.size:
+            return False
+        if index_size == 0:
+            return self._end == 0
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(index_size - OFFSET_FORMAT.size)
+            last_offset = OFFSET_FORMAT.unpack(index_file.read(OFFSET_FORMAT.size))[0]
+        if last_offset >= self._end:
+            return False
+        with open(self.path, 'rb') as data_file:
+            data_file.seek(last_offset)
+            tail = data_file.read(self._end - last_offset)
+        return tail.find(b'\n') == len(tail) - 1
+
+    def append(self, event_type, **fields):
+        """
+        Appends one event.
+        :param event_type: Event type, e.g. 'embed' or 'extract'.
+        :param fields: Event fields; values must be JSON serializable.
+        :return: Byte offset of the record in the data file.
+        """
+        return self.append_many([(event_type, fields)])[0]
+
+    def append_many(self, events):
+        """
+        Appends several events with one write to each file.
+        :param events: Iterable of (event_type, fields) tuples.
+        :return: List of the byte offsets of the records.
+        """
+        lines = [encode_event({"event": event_type, **fields}) for event_type, fields in events]
+        with self._locked():
+            # Another process may have appended since our last write; the file end is the truth
+            self._end = os.fstat(self._data.fileno()).st_size
+            offsets = []
+            for line in lines:
+                offsets.append(self._end)
+                self._end += len(line)
+            self._data.write(b''.join(lines))
+            self._data.flush()
+            self._index.write(b''.join(OFFSET_FORMAT.pack(offset) for offset in offsets))
+            self._index.flush()
+        return offsets
+
+    def rebuild_index(self):
+        """Rewrites the offset index from the data file, dropping a trailing partial record."""
+        with self._locked():
+            offsets = []
+            with open(self.path, 'rb') as data_file:
+                offset = 0
+                for line in data_file:
+                    if not line.endswith(b'\n'):
+                        break
+                    offsets.append(offset)
+                    offset += len(line)
+            self._data.truncate(offset)
+            self._end = offset
+            self._index.truncate(0)
+            self._index.write(b''.join(OFFSET_FORMAT.pack(offset) for offset in offsets))
+            self._index.flush()
+
+    def import_log(self, log_file_path):
+        """
+        Backfills embed events from a text watermark log.
+        :param log_file_path: Path to a watermark_log.log file.
+        :return: Number of records imported.
+        """
+        imported = 0
+        with open(log_file_path, 'r') as log_file:
+            for line in log_file:
+                match = LOG_RECORD_PATTERN.search(line)
+                if match:
+                    record = match.groupdict()
+                    record["len_wm"] = int(record["len_wm"])
+                    self.append("embed", **record)
+                    imported += 1
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+
+class WatermarkEventReader:
+    """
+    Read-only view of an event store. The data file and the offset index are memory-mapped,
+    records are decoded only when accessed, and lookups search the raw bytes for the
+    serialized field instead of parsing every record.
+    """
+
+    def __init__(self, path=EVENTS_PATH):
+        """
+        :param path: Path to the JSONL data file.
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self._data = self._offsets = b''
+        self._count = 0
+        self.refresh()
+
+    def refresh(self):
+        """(Re)maps the files so records appended since the last mapping become visible."""
+        self.close()
+        # Map the index first: every offset in it then points at a record already in the data file
+        self._offsets = _map_file(self.index_path)
+        self._data = _map_file(self.path)
+        self._count = len(self._offsets) // OFFSET_FORMAT.size
+
+    def __len__(self):
+        return self._count
+
+    def offset(self, number):
+        """Returns the byte offset of record number `number` (0-based)."""
+        if not 0 <= number < self._count:
+            raise IndexError(f"Event {number} out of range")
+        return OFFSET_FORMAT.unpack_from(self._offsets, number * OFFSET_FORMAT.size)[0]
+
+    def read_at(self, offset):
+        """
+        Decodes the record starting at a byte offset.
+        :param offset: Byte offset of the record, as returned by WatermarkEventStore.append.
+        :return: Event dictionary.
+        """
+        end = self._data.find(b'\n', offset)
+        return json.loads(self._data[offset:end])
+
+    def __getitem__(self, number):
+        return self.read_at(self.offset(number))
+
+    def __iter__(self):
+        for number in range(self._count):
+            yield self[number]
+
+    def find(self, field, value, event_type="embed", latest=True):
+        """
+        Looks up a record by the exact value of one field.
+        :param field: Field name, e.g. 'uuid' or 'image_name'.
+        :param value: Field value.
+        :param event_type: Only return records of this event type.
+        :param latest: Return the most recent matching record instead of the oldest.
+        :return: Event dictionary, or None if not found.
+        """
+        needle = encode_event({field: value})[1:-2]  # '"field":value' exactly as it was serialized
+        search = self._data.rfind if latest else self._data.find
+        start, end = 0, self._data.rfind(b'\n') + 1  # Ignore a record that is still being written
+        while True:
+            position = search(needle, start, end)
+            if position < 0:
+                return None
+            line_start = self._data.rfind(b'\n', 0, position) + 1
+            event = self.read_at(line_start)
+            if event.get(field) == value and event.get("event") == event_type:
+                return event
+            if latest:
+                end = line_start
+            else:
+                start = self._data.find(b'\n', position) + 1
+
+    def close(self):
+        for mapping in (self._data, self._offsets):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+
+
+# Function to memory-map a whole file read-only (empty or missing files map to b'')
+def _map_file(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return b''
+    with open(path, 'rb') as handle:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_store = None
+_store_pid = None
+
+# Function to get the shared event store of the current process
+def get_event_store():
+    """
+    Returns the process-wide event store, creating it on first use. A freshly created
+    store is backfilled once from the existing text watermark log.
+    """
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():  # Never share file positions across a fork
+        os.makedirs(REGISTRY_DIR, exist_ok=True)
+        is_new = not os.path.exists(EVENTS_PATH)
+        _store = WatermarkEventStore(EVENTS_PATH)
+        _store_pid = os.getpid()
+        if is_new and os.path.exists(WATERMARK_LOG_PATH):
+            _store.import_log(WATERMARK_LOG_PATH)
+    return _store
+
+
+# Dump the event store as JSON lines: python events.py [watermark_events.jsonl]
+if __name__ == "__main__":
+    reader = WatermarkEventReader(sys.argv[1] if len(sys.argv) > 1 else EVENTS_PATH)
+    for event in reader:
+        print(json.dumps(event))
@@ -0,0 +1,88 @@
+import numpy as np
+
+# Rate 1/2 convolutional code with constraint length 7 and the standard generators 171/133 (octal)
+CONSTRAINT_LENGTH = 7
+GENERATORS = (0o171, 0o133)
+MEMORY = CONSTRAINT_LENGTH - 1
+STATES = 1 << MEMORY
+
+
+def _build_tables():
+    """
+    Returns, for every state and input bit, the coded output bits and the next state. The shift
+    register holds the input bit in its highest position and the state (the previous MEMORY input
+    bits, newest first) below it.
+    """
+    outputs = np.zeros((STATES, 2, len(GENERATORS)), dtype=np.int8)
+    next_states = np.zeros((STATES, 2), dtype=np.intp)
+    for state in range(STATES):
+        for bit in (0, 1):
+            register = (bit << MEMORY) | state
+            outputs[state, bit] = [bin(register & generator).count('1') % 2 for generator in GENERATORS]
+            next_states[state, bit] = register >> 1
+    return outputs, next_states
+
+OUTPUTS, NEXT_STATES = _build_tables()
+
+# The two states that lead to every state, and the input bit of that transition (the top bit of the state)
+PREDECESSORS = np.stack([(np.arange(STATES) & (STATES // 2 - 1)) << 1,
+                         ((np.arange(STATES) & (STATES // 2 - 1)) << 1) | 1], axis=1)
+TRANSITION_BITS = np.arange(STATES) >> (MEMORY - 1)
+
+# Weighted share of the soft values that disagrees with the decoded codeword for random input; the
+# decoder always finds a path this close to noise, so the confidence is measured against it
+NOISE_DISAGREEMENT = 0.1
+
+
+# Function to compute the number of coded bits for a message
+def coded_length(message_bits):
+    """Returns the number of coded bits for a message of message_bits bits (tail bits included)."""
+    return (message_bits + MEMORY) * len(GENERATORS)
+
+# Function to encode a message
+def encode(bits):
+    """
+    Encodes message bits. MEMORY zero tail bits are appended, so the encoder ends in state 0.
+    :param bits: Sequence of 0/1 message bits.
+    :return: uint8 array of coded_length(len(bits)) bits.
+    """
+    state = 0
+    coded = np.empty((len(bits) + MEMORY, len(GENERATORS)), dtype=np.uint8)
+    for step, bit in enumerate(np.concatenate([np.asarray(bits, dtype=np.uint8), np.zeros(MEMORY, np.uint8)])):
+        coded[step] = OUTPUTS[state, bit]
+        state = NEXT_STATES[state, bit]
+    return coded.ravel()
+
+# Function to decode soft values with the Viterbi algorithm
+def decode(soft):
+    """
+    Soft-decision Viterbi decoding. Every path is scored by the correlation of its codeword with
+    the soft values, so unreliable bits (values near 0) weigh less than confident ones.
+    :param soft: Coded bit estimates in [-1, 1]: +1 for a certain 1, -1 for a certain 0, 0 for unknown.
+    :return: Tuple of the decoded message bits (uint8 array) and a confidence in [0, 1]: 1 when all
+             soft values agree with the decoded codeword, falling to 0 as their weighted disagreement
+             approaches that of random input.
+    """
+    soft = np.asarray(soft, dtype=np.float64).reshape(-1, len(GENERATORS))
+    signs = 2.0 * OUTPUTS - 1  # (state, bit, output) in {-1, +1}
+
+    metrics = np.full(STATES, -np.inf)
+    metrics[0] = 0.0
+    decisions = np.empty((len(soft), STATES), dtype=np.uint8)
+    for step, received in enumerate(soft):
+        branch = signs @ received  # (state, bit) correlation of every transition
+        candidates = metrics[PREDECESSORS] + branch[PREDECESSORS, TRANSITION_BITS[:, None]]
+        decisions[step] = candidates.argmax(axis=1)
+        metrics = candidates.max(axis=1)
+
+    # Trace back from state 0, where the tail bits leave the encoder
+    state, bits = 0, np.empty(len(soft), dtype=np.uint8)
+    for step in range(len(soft) - 1, -1, -1):
+        bits[step] = TRANSITION_BITS[state]
+        state = PREDECESSORS[state, decisions[step, state]]
+    message = bits[:len(soft) - MEMORY]
+
+    # metrics[0] is the correlation of the decoded codeword: agreeing minus disagreeing soft weight
+    weight = np.abs(soft).sum()
+    disagreement = (1 - metrics[0] / weight) / 2 if weight > 0 else 0.5
+    return message, float(np.clip(1 - disagreement / NOISE_DISAGREEMENT, 0.0, 1.0))
@@ -1,48 +1,151 @@
 import sys
 import os
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QTextEdit, QProgressBar, QRadioButton, QButtonGroup
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+import threading
+import time
+from collections import deque
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QProgressBar,
+                             QRadioButton, QButtonGroup, QSpinBox, QPushButton, QComboBox)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QColor, QPixmap
-from utils import embed_watermark, extract_watermark  # Assuming these functions exist in your utils.py
+
+# Interval of the batched log and progress refresh in milliseconds
+REFRESH_INTERVAL_MS = 250
+
+# Lines kept in the log display; older lines are dropped so big folders do not slow the UI down
+MAX_LOG_LINES = 5000
+
+# Output formats offered for watermarked images; None keeps the format of each original
+OUTPUT_FORMATS = (("Same as original", None), ("JPEG", ".jpg"), ("PNG", ".png"), ("WebP", ".webp"))
 
 # Worker Thread for processing images without freezing the UI
 class WatermarkWorker(QThread):
-    log_signal = pyqtSignal(str)
-    progress_signal = pyqtSignal(int)
-    done_signal = pyqtSignal()  # Only emit once all images are processed
+    """
+    Coordinates a run on a background thread. With more than one worker the images are embedded
+    or extracted in a process pool, while the records are logged and validated here. Log messages
+    and counters are collected for the GUI, which reads them on a timer (take_messages/progress)
+    instead of receiving a signal per image.
+    """
+    done_signal = pyqtSignal()  # Only emit once all images are processed or the run was cancelled
 
-    def __init__(self, originals_folder, watermarked_folder, mode="embed", wm_shape=1063):
+    def __init__(self, originals_folder, watermarked_folder, mode="embed", wm_shape=None, workers=1,
+                 output_format=None, quality=None, compression=None):
         super().__init__()
         self.originals_folder = originals_folder
         self.watermarked_folder = watermarked_folder
         self.mode = mode
-        self.wm_shape = wm_shape  # For extraction
+        self.wm_shape = wm_shape  # For extraction; None reads the fixed-length payload
+        self.workers = workers
+        self.encode_settings = (output_format, quality, compression)  # For embedding; see utils.EncodeOptions
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.start_time = None
+        self._messages = deque()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stop submitting images and drop the ones not started yet; images in progress still finish."""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def log(self, message):
+        with self._lock:
+            self._messages.append(message)
+
+    def take_messages(self):
+        """Return and clear the messages collected since the last call."""
+        with self._lock:
+            messages = list(self._messages)
+            self._messages.clear()
+        return messages
+
+    def progress(self):
+        """Return (finished images, total images, images per second, estimated seconds left or None)."""
+        finished = self.completed + self.failed
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0.0
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - finished) / rate if rate > 0 else None
+        return finished, self.total, rate, eta
 
     def run(self):
         try:
-            images = [img for img in os.listdir(self.originals_folder) if img.endswith(('jpg', 'jpeg', 'png'))]
-            total_images = len(images)
-            self.progress_signal.emit(0)  # Initialize progress bar at 0
-            self.progress_signal.emit(total_images)  # Set the progress bar maximum
+            # Imported here, on the worker thread, so the window shows without waiting for OpenCV and NumPy.
+            # utils must be imported before the pool starts (blind_watermark sets the start method on import)
+            from concurrent.futures import ProcessPoolExecutor
+            from utils import EncodeOptions, embed_watermark_record, extract_watermark_text, record_extraction, warm_up
+            from logger import WatermarkLogCache, log_watermark
+            from discovery import iter_images
+
+            images = list(iter_images(self.originals_folder))  # Listed up front for the progress bar
+            self.total = len(images)
+            self.start_time = time.perf_counter()
+            log_cache = WatermarkLogCache()  # Parse the watermark log once for the whole batch
+            encoding = EncodeOptions(*self.encode_settings)
+
+            def task(image_name):
+                if self.mode == "embed":
+                    return embed_watermark_record, (image_name, self.originals_folder, self.watermarked_folder, encoding)
+                # The fixed-length payload needs no len_wm; older text watermarks are extracted with their recorded one
+                wm_shape = self.wm_shape or log_cache.get_len_wm(image_name)
+                return extract_watermark_text, (image_name, wm_shape, self.watermarked_folder)
 
-            # Process each image
-            for i, image_name in enumerate(images):
+            def finish(image_name, result):
                 if self.mode == "embed":
-                    self.log_signal.emit(f"Embedding watermark in: {image_name} ({i+1}/{total_images})")
-                    embed_watermark(image_name, self.originals_folder, self.watermarked_folder)
-                elif self.mode == "extract":
-                    self.log_signal.emit(f"Extracting watermark from: {image_name} ({i+1}/{total_images})")
-                    extracted_log, validation_status = extract_watermark(image_name, self.wm_shape, self.watermarked_folder)
-                    self.log_signal.emit(extracted_log)
-                
-                # Update progress after each image
-                self.progress_signal.emit(i + 1)
+                    log_watermark(**result)
+                    self.log(f"Watermarked: {image_name}")
+                else:
+                    extracted_log, validation_status = record_extraction(image_name, result, log_cache)
+                    self.log(f"{image_name}: {extracted_log} ({'valid' if validation_status else 'not valid'})")
 
+            if self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up) as executor:
+                    self._run_pool(executor, images, task, finish)
+            else:
+                for image_name in images:
+                    if self.cancelled:
+                        break
+                    func, args = task(image_name)
+                    self._complete(image_name, func, args, finish)
+
+            if self.cancelled:
+                self.log(f"Cancelled after {self.completed + self.failed} of {self.total} images.")
+
+        except Exception as e:
+            self.log(f"Error: {str(e)}")
+        finally:
             # Emit the done signal when processing is complete
             self.done_signal.emit()
 
+    def _run_pool(self, executor, images, task, finish):
+        """Keep a bounded window of images in the pool and finish the results in submission order."""
+        pending = deque()
+        images = iter(images)
+        while not self.cancelled:
+            while len(pending) < 2 * self.workers:
+                image_name = next(images, None)
+                if image_name is None:
+                    break
+                func, args = task(image_name)
+                pending.append((image_name, executor.submit(func, *args)))
+            if not pending:
+                break
+            image_name, future = pending.popleft()
+            self._complete(image_name, future.result, (), finish)
+        for _, future in pending:
+            future.cancel()
+
+    def _complete(self, image_name, func, args, finish):
+        """Run func (or collect a result) for one image and count it as completed or failed."""
+        try:
+            finish(image_name, func(*args))
+            self.completed += 1
         except Exception as e:
-            self.log_signal.emit(f"Error: {str(e)}")
+            self.failed += 1
+            self.log(f"Error processing {image_name}: {str(e)}")
 
 # Main GUI class
 class WatermarkApp(QWidget):
@@ -87,6 +190,39 @@ class WatermarkApp(QWidget):
         layout.addWidget(self.radio_embed)
         layout.addWidget(self.radio_extract)
 
+        # Number of worker processes and a button to cancel a running job
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Workers:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, max(1, os.cpu_count() or 1) * 2)
+        self.workers_spin.setValue(os.cpu_count() or 1)
+        controls.addWidget(self.workers_spin)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_processing)
+        controls.addWidget(self.cancel_button)
+        layout.addLayout(controls)
+
+        # Output format and encoder settings of the watermarked images
+        encode_controls = QHBoxLayout()
+        encode_controls.addWidget(QLabel("Format:"))
+        self.format_combo = QComboBox()
+        for label, extension in OUTPUT_FORMATS:
+            self.format_combo.addItem(label, extension)
+        encode_controls.addWidget(self.format_combo)
+        encode_controls.addWidget(QLabel("Quality:"))
+        self.quality_spin = QSpinBox()  # JPEG/WebP; lower is smaller but weakens the watermark
+        self.quality_spin.setRange(-1, 100)  # -1 shows "Default": 95 for JPEG, lossless for WebP, as in the CLI
+        self.quality_spin.setSpecialValueText("Default")
+        self.quality_spin.setValue(-1)
+        encode_controls.addWidget(self.quality_spin)
+        encode_controls.addWidget(QLabel("PNG level:"))
+        self.png_level_spin = QSpinBox()  # 0 is fastest and largest, 9 smallest and slowest
+        self.png_level_spin.setRange(0, 9)
+        self.png_level_spin.setValue(1)
+        encode_controls.addWidget(self.png_level_spin)
+        layout.addLayout(encode_controls)
+
         # Label to show drag-and-drop instruction
         self.drop_label = QLabel("Drag and drop a folder with images to watermark or extract")
         layout.addWidget(self.drop_label)
@@ -94,6 +230,7 @@ class WatermarkApp(QWidget):
         # Text box for real-time log display
         self.log_display = QTextEdit()
         self.log_display.setReadOnly(True)  # Make it read-only
+        self.log_display.document().setMaximumBlockCount(MAX_LOG_LINES)
         layout.addWidget(self.log_display)
 
         # Progress bar for showing progress
@@ -104,6 +241,16 @@ class WatermarkApp(QWidget):
         self.status_label = QLabel("Status: Waiting for action", self)
         layout.addWidget(self.status_label)
 
+        # Live throughput and estimated time left
+        self.throughput_label = QLabel("", self)
+        layout.addWidget(self.throughput_label)
+
+        # Log and progress updates are applied in batches on this timer
+        self.worker = None
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
         # Set the layout to the window
         self.setLayout(layout)
 
@@ -116,10 +263,18 @@ class WatermarkApp(QWidget):
         # Handle folder drop
         for url in event.mimeData().urls():
             folder_path = url.toLocalFile()
+            if self.worker is not None and self.worker.isRunning():
+                self.status_label.setText("Status: Still processing, cancel or wait before dropping another folder")
+                return
             if os.path.isdir(folder_path):  # Only accept directories
                 self.status_label.setText(f"Folder dropped: {folder_path}")
                 self.process_folder(folder_path)
 
+    def encode_quality(self):
+        """JPEG/WebP quality chosen in the quality box, or None while it shows "Default"."""
+        quality = self.quality_spin.value()
+        return None if quality == self.quality_spin.minimum() else quality
+
     def process_folder(self, folder_path):
         # Specify originals and watermarked directories
         originals_folder = folder_path
@@ -132,25 +287,42 @@ class WatermarkApp(QWidget):
         mode = "embed" if self.radio_embed.isChecked() else "extract"
 
         # Start the watermarking or extraction process in a separate thread
-        wm_shape = 1063  # Example watermark shape size, adjust if necessary for extraction
-        self.worker = WatermarkWorker(originals_folder, watermarked_folder, mode=mode, wm_shape=wm_shape)
-        self.worker.log_signal.connect(self.update_log)
-        self.worker.progress_signal.connect(self.update_progress)
+        self.worker = WatermarkWorker(originals_folder, watermarked_folder, mode=mode,
+                                      workers=self.workers_spin.value(), output_format=self.format_combo.currentData(),
+                                      quality=self.encode_quality(), compression=self.png_level_spin.value())
         self.worker.done_signal.connect(self.watermarking_done)
+        self.progress.setValue(0)
+        self.cancel_button.setEnabled(True)
         self.worker.start()
+        self.refresh_timer.start()
 
-    def update_log(self, message):
-        # Append the log message to the display
-        self.log_display.append(message)
+    def cancel_processing(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Status: Cancelling, waiting for the images in progress")
 
-    def update_progress(self, value):
-        # Update the progress bar based on value
-        self.progress.setValue(value)
+    def refresh(self):
+        # Append all messages collected since the last refresh at once and update progress and throughput
+        messages = self.worker.take_messages()
+        if messages:
+            self.log_display.append("\n".join(messages))
+        finished, total, rate, eta = self.worker.progress()
+        self.progress.setMaximum(max(total, 1))
+        self.progress.setValue(finished)
+        eta_text = f"{eta:.0f}s" if eta is not None else "-"
+        self.throughput_label.setText(f"{finished}/{total} images, {rate:.1f} images/s, ETA {eta_text}")
 
     def watermarking_done(self):
         # Update status when done
-        self.status_label.setText("Watermarking/Extraction completed")
-        self.log_display.append("Processing complete.")
+        self.refresh_timer.stop()
+        self.refresh()
+        self.cancel_button.setEnabled(False)
+        if self.worker.cancelled:
+            self.status_label.setText("Watermarking/Extraction cancelled")
+        else:
+            self.status_label.setText("Watermarking/Extraction completed")
+            self.log_display.append("Processing complete.")
 
 # Main application entry
 if __name__ == "__main__":
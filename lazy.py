@@ -0,0 +1,53 @@
+import importlib
+
+
+# Function to resolve a lazily imported attribute; also used to unpickle LazyAttribute objects
+def resolve(module_name, attribute):
+    """Imports a module (if not imported yet) and returns one of its attributes."""
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class LazyAttribute:
+    """
+    Stand-in for a function or class of a module that is only imported when it is first called.
+    Lets the CLI parse its arguments (and answer --help) without loading OpenCV, NumPy and the
+    logging and registry modules. A LazyAttribute pickles as the real object, so it can be
+    submitted to a process pool.
+    """
+
+    __slots__ = ("module_name", "attribute", "_target")
+
+    def __init__(self, module_name, attribute):
+        """
+        :param module_name: Name of the module to import, e.g. 'utils'.
+        :param attribute: Name of the function or class in that module.
+        """
+        self.module_name = module_name
+        self.attribute = attribute
+        self._target = None
+
+    @property
+    def target(self):
+        """The real function or class, imported on first use."""
+        if self._target is None:
+            self._target = resolve(self.module_name, self.attribute)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.target(*args, **kwargs)
+
+    def __reduce__(self):
+        return resolve, (self.module_name, self.attribute)
+
+    def __repr__(self):
+        return f"<lazy {self.module_name}.{self.attribute}>"
+
+
+# Function to declare several lazily imported names of one module at once
+def lazy_import(module_name, *attributes):
+    """
+    Returns a LazyAttribute for every attribute name, in order.
+    Example: log_watermark, shutdown_logging = lazy_import('logger', 'log_watermark', 'shutdown_logging')
+    """
+    lazy_attributes = tuple(LazyAttribute(module_name, attribute) for attribute in attributes)
+    return lazy_attributes[0] if len(lazy_attributes) == 1 else lazy_attributes
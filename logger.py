@@ -1,5 +1,12 @@
+import atexit
+import json
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import metrics
+from events import EVENTS_PATH, get_event_store
+from registry import LOG_RECORD_PATTERN, get_registry
 
 # Define log directory
 LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -8,7 +15,8 @@ os.makedirs(LOG_DIR, exist_ok=True)  # Ensure the logs directory exists
 # Configure the logger for watermark and extraction logs
 def setup_logger(name, log_file, level=logging.INFO):
     """
-    Sets up a logger with the specified name, log file, and logging level.
+    Sets up a logger with the specified name, log file, and logging level. The file is only
+    opened when the first record is written, so importing this module touches no log files.
     :param name: Name of the logger.
     :param log_file: File where logs will be saved.
     :param level: Logging level (default: INFO).
@@ -16,7 +24,7 @@ def setup_logger(name, log_file, level=logging.INFO):
     formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
 
     # Create a file handler to log messages to a file
-    handler = logging.FileHandler(log_file)
+    handler = logging.FileHandler(log_file, delay=True)
     handler.setFormatter(formatter)
 
     logger = logging.getLogger(name)
@@ -30,8 +38,218 @@ watermark_logger = setup_logger('watermark', os.path.join(LOG_DIR, 'watermark_lo
 extraction_logger = setup_logger('extraction', os.path.join(LOG_DIR, 'extraction_log.log'))
 debug_logger = setup_logger('debug', os.path.join(LOG_DIR, 'debug_log.log'), level=logging.DEBUG)
 
+# Carries watermark and extraction events to the registry and the event store in async mode
+records_logger = logging.getLogger('records')
+records_logger.setLevel(logging.INFO)
+records_logger.propagate = False
+
+# Maximum number of records written between two fsyncs while the queue stays busy
+ASYNC_LOG_BATCH_SIZE = 256
+
+# File handler that leaves flushing to flush(), so records can be written in batches
+class SyncingFileHandler(logging.FileHandler):
+    """FileHandler that writes without flushing per record; flush() flushes and fsyncs the file."""
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if self.stream is not None and not self.stream.closed:
+                self.stream.flush()
+                os.fsync(self.stream.fileno())
+
+# Function to write events to the watermark registry and the structured event store
+def store_events(events):
+    """
+    Writes events to the event store, and embed events also to the registry, with one registry
+    transaction and one write to the event store for all of them.
+    :param events: List of (event_type, fields) tuples; the fields of embed events are the arguments of log_watermark.
+    """
+    embeds = [fields for event_type, fields in events if event_type == "embed"]
+    if embeds:
+        get_registry().add_many(embeds)
+    get_event_store().append_many(events)
+
+# Handler that writes the events of records_logger in batches
+class EventStoreHandler(logging.Handler):
+    """
+    Collects the events carried by records_logger records (record.event) and writes them with
+    store_events when flushed, so the async listener commits once per batch instead of per record.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._events = []
+
+    def emit(self, record):
+        # Open the stores before the text handlers write the record: a new store is backfilled from the text log
+        get_registry()
+        get_event_store()
+        self._events.append(record.event)
+
+    def flush(self):
+        with self.lock:
+            events, self._events = self._events, []
+        if events:
+            store_events(events)
+
+# Handler that passes records on to the handlers of the root logger, e.g. the console
+class RootRelayHandler(logging.Handler):
+    """
+    Hands records to the root logger's handlers, as propagation would. In async mode the routed
+    loggers do not propagate, so this handler writes their console output on the listener thread.
+    """
+
+    def emit(self, record):
+        for handler in logging.getLogger().handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self):
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+
+# Queue listener that flushes its handlers once per burst of records instead of once per record
+class BatchingQueueListener(QueueListener):
+    """
+    Writes queued records on a background thread and flushes (and fsyncs) the handlers when
+    the queue runs empty or after batch_size records, whichever comes first.
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size=ASYNC_LOG_BATCH_SIZE):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self._pending = 0
+
+    def handle(self, record):
+        super().handle(record)
+        self._pending += 1
+        if self._pending >= self.batch_size or self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+        self._pending = 0
+
+    def stop(self):
+        super().stop()  # Drains the queue before returning
+        self.flush()
+
+# Queue handler that only enqueues in the process that owns the listener thread
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler for the async logging mode. A forked worker process inherits the queue but not
+    the listener thread, so there records are written straight to the file and event handlers instead.
+    """
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self._handlers = handlers
+        self._pid = os.getpid()
+
+    def emit(self, record):
+        if os.getpid() == self._pid:
+            super().emit(record)
+            return
+        for handler in self._handlers:
+            if handler.filter(record) and record.levelno >= handler.level:
+                handler.handle(record)
+                handler.flush()
+
+_listener = None
+_listener_pid = None
+
+# Function to switch between synchronous and asynchronous logging
+def configure_logging(async_logging=False, debug_records=True, text_log=True):
+    """
+    Reconfigures the watermark, extraction and debug loggers.
+    :param async_logging: Hand records to a background thread through a queue. The thread writes
+                          them in batches and fsyncs once per batch, and commits the registry and
+                          event store records once per batch; pending records are flushed by
+                          shutdown_logging(), which also runs at interpreter exit. Lookups in this
+                          module wait for the queued records first.
+    :param debug_records: Write the per-record lines of debug_log.log and the validation messages
+                          (turn off in production to keep them off the hot path).
+    :param text_log: Mirror the watermark and extraction events to the human-readable text logs
+                     (the structured event store is always written).
+    """
+    global _listener, _listener_pid
+    shutdown_logging()
+
+    loggers = (watermark_logger, extraction_logger, debug_logger, records_logger)
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+    for logger in (watermark_logger, extraction_logger, debug_logger):
+        logger.propagate = not async_logging  # In async mode the listener writes the console output too
+    debug_logger.setLevel(logging.DEBUG if debug_records else logging.INFO)
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    log_files = {debug_logger: 'debug_log.log'}
+    if text_log:
+        log_files.update({watermark_logger: 'watermark_log.log', extraction_logger: 'extraction_log.log'})
+    if not async_logging:
+        for logger, file_name in log_files.items():
+            handler = logging.FileHandler(os.path.join(LOG_DIR, file_name), delay=True)
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+        return
+
+    # One listener thread writes the events, all three files and the console; each handler only accepts its own logger
+    event_handler = EventStoreHandler()
+    event_handler.addFilter(logging.Filter(records_logger.name))
+    file_handlers = [event_handler]
+    for logger, file_name in log_files.items():
+        handler = SyncingFileHandler(os.path.join(LOG_DIR, file_name), delay=True)
+        handler.setFormatter(formatter)
+        handler.addFilter(logging.Filter(logger.name))
+        file_handlers.append(handler)
+    console_handler = RootRelayHandler()
+    console_handler.addFilter(lambda record: record.name != records_logger.name)
+    file_handlers.append(console_handler)
+
+    log_queue = queue.Queue()  # Unlike SimpleQueue, join() tells when every queued record is written
+    queue_handler = AsyncQueueHandler(log_queue, file_handlers)
+    for logger in loggers:
+        logger.addHandler(queue_handler)
+    _listener = BatchingQueueListener(log_queue, *file_handlers)
+    _listener_pid = os.getpid()
+    _listener.start()
+
+# Function to flush and stop the asynchronous logging thread
+def shutdown_logging():
+    """Writes and fsyncs all queued records and stops the listener thread (no-op in synchronous mode)."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+# Function to wait until queued records are visible to lookups
+def wait_for_records():
+    """Blocks until the async listener has written every queued record (no-op in synchronous mode)."""
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.queue.join()
+
+# Function to write one event now or hand it to the async listener
+def _write_event(event_type, fields):
+    if _listener is None:
+        store_events([(event_type, fields)])
+    else:
+        records_logger.info(event_type, extra={"event": (event_type, fields)})
+
+# Flush queued records at interpreter exit, including exits caused by an unhandled exception
+atexit.register(shutdown_logging)
+
 # Log watermarking record
-def log_watermark(image_name, uuid, folder, timestamp, len_wm, image_hash):
+def log_watermark(image_name, uuid, folder, timestamp, len_wm, image_hash, phash=None):
     """
     Logs information about a watermarked image, including watermark bit length (len_wm) and image hash.
     :param image_name: Name of the image that was watermarked.
@@ -40,68 +258,133 @@ def log_watermark(image_name, uuid, folder, timestamp, len_wm, image_hash):
     :param timestamp: Timestamp when the image was watermarked.
     :param len_wm: Length of the watermark bit string (wm_bit).
     :param image_hash: Hash of the original image (MD5/SHA-256).
+    :param phash: Perceptual hash of the original image (phash.perceptual_hash), used to match altered copies.
     """
-    # Store the data in the info log and the debug log for more verbosity
-    watermark_logger.info(
-        f"Image '{image_name}' was watermarked. UUID={uuid}, Folder='{folder}', Time={timestamp}, len_wm={len_wm}, Hash={image_hash}"
-    )
-    debug_logger.debug(
-        f"Watermarked image: {image_name}, UUID={uuid}, Folder={folder}, Timestamp={timestamp}, len_wm={len_wm}, Hash={image_hash}"
-    )
+    with metrics.timer("log.write"):
+        # Store the record in the indexed registry used for lookups and in the structured event store
+        _write_event("embed", {"image_name": image_name, "uuid": str(uuid), "folder": folder, "timestamp": timestamp,
+                               "len_wm": int(len_wm), "image_hash": image_hash, "phash": phash})
+
+        # Mirror the data to the info log and the debug log for more verbosity
+        perceptual = f", pHash={phash}" if phash else ""
+        watermark_logger.info(
+            f"Image '{image_name}' was watermarked. UUID={uuid}, Folder='{folder}', Time={timestamp}, len_wm={len_wm}, Hash={image_hash}{perceptual}"
+        )
+        debug_logger.debug(
+            f"Watermarked image: {image_name}, UUID={uuid}, Folder={folder}, Timestamp={timestamp}, len_wm={len_wm}, Hash={image_hash}{perceptual}"
+        )
     
 # Log extraction record (no changes needed here)
 def log_extraction(image_name, watermark_content, timestamp):
-    extraction_logger.info(f"Watermark extracted from '{image_name}' at {timestamp}. Content: {watermark_content}")
-    debug_logger.debug(f"Extracted watermark from: {image_name}, Content={watermark_content}, Timestamp={timestamp}")
+    with metrics.timer("log.write"):
+        _write_event("extract", {"image_name": image_name, "content": watermark_content, "timestamp": timestamp})
+        extraction_logger.info(f"Watermark extracted from '{image_name}' at {timestamp}. Content: {watermark_content}")
+        debug_logger.debug(f"Extracted watermark from: {image_name}, Content={watermark_content}, Timestamp={timestamp}")
 
-# Function to read the watermark log and retrieve len_wm
+# Function to retrieve len_wm for an image from the watermark registry
 def get_len_wm_from_log(image_name):
     """
-    Reads the watermark log and retrieves the watermark bit length (len_wm) for a given image.
+    Retrieves the watermark bit length (len_wm) for a given image from the indexed watermark
+    registry (backfilled from the watermark log), using the most recent record for the image.
     :param image_name: The name of the image to retrieve len_wm for.
     :return: The len_wm value, or None if not found.
     """
-    log_file_path = os.path.join(LOG_DIR, 'watermark_log.log')
-    
-    if not os.path.exists(log_file_path):
-        return None
-    
-    with open(log_file_path, 'r') as log_file:
-        for line in log_file:
-            if f"Image '{image_name}'" in line:
-                # Look for len_wm in the log line
-                len_wm_index = line.find("len_wm=")
-                if len_wm_index != -1:
-                    len_wm_str = line[len_wm_index + len("len_wm="):].strip()
-                    return int(len_wm_str)
-    
-    return None
+    with metrics.timer("log.lookup_len_wm"):
+        wait_for_records()
+        return get_registry().get_len_wm(image_name)
 
-# Function to validate the extracted watermark data against the log records
-# Function to validate the extracted watermark data against the log records
+# Function to validate the extracted watermark data against the watermark records
 def validate_watermark(uuid):
     """
     Validates extracted watermark based on UUID.
     :param uuid: UUID extracted from the watermark.
     :return: True if validation passes, False otherwise.
     """
-    log_file_path = os.path.join(LOG_DIR, 'watermark_log.log')
-    
-    print(f"[DEBUG] Starting validation for UUID: {uuid}")
-    
-    with open(log_file_path, 'r') as log_file:
-        for line in log_file:
-            if "UUID=" in line:
-                log_uuid_start = line.find("UUID=") + len("UUID=")
-                log_uuid_end = line.find(" ", log_uuid_start)
-                log_uuid = line[log_uuid_start:log_uuid_end].strip(",")  # Strip any trailing commas
-                
-                # Log the UUID found in the log file
-                print(f"[DEBUG] Found UUID in log: {log_uuid}")
-                
-                if log_uuid == uuid:
-                    print(f"[VALIDATION SUCCESS] Extracted UUID matches log UUID: {uuid}")
-                    return True
-    
-    print(f"[VALIDATION FAILURE] No matching UUID found in log for extracted UUID: {uuid}")
-    return False
\ No newline at end of file
+    debug_logger.debug(f"Starting validation for UUID: {uuid}")
+
+    with metrics.timer("log.validate"):
+        wait_for_records()
+        found = bool(uuid) and get_registry().has_uuid(uuid)
+    if found:
+        debug_logger.debug(f"[VALIDATION SUCCESS] Extracted UUID matches log UUID: {uuid}")
+        return True
+
+    debug_logger.debug(f"[VALIDATION FAILURE] No matching UUID found in log for extracted UUID: {uuid}")
+    return False
+
+# In-memory index of the watermark log for batch extraction
+class WatermarkLogCache:
+    """
+    Parses the watermark events once into dictionaries and afterwards only reads the lines
+    appended since the last refresh, so a batch never rescans the whole log per image.
+    Reads both the structured event store and text watermark logs.
+    """
+
+    def __init__(self, log_file_path=None):
+        """
+        :param log_file_path: Path to the event store or a text watermark log
+                              (default: logs/watermark_events.jsonl).
+        """
+        if log_file_path is None:
+            get_event_store()  # Create (and backfill) the event store on first use
+            log_file_path = EVENTS_PATH
+        self.log_file_path = log_file_path
+        self.len_wm_by_image = {}  # image name -> len_wm of its most recent record
+        self.image_by_uuid = {}  # UUID -> image name
+        self._offset = 0  # Byte offset up to which the log has been parsed
+
+    def refresh(self):
+        """Reads any records appended to the log since the last refresh."""
+        wait_for_records()
+        if not os.path.exists(self.log_file_path):
+            return
+
+        size = os.path.getsize(self.log_file_path)
+        if size < self._offset:  # The log was truncated or rotated, start over
+            self.len_wm_by_image.clear()
+            self.image_by_uuid.clear()
+            self._offset = 0
+        if size == self._offset:
+            return
+
+        with open(self.log_file_path, 'rb') as log_file:
+            log_file.seek(self._offset)
+            data = log_file.read(size - self._offset)
+
+        # Only consume complete lines; a partially written record is picked up next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            if line.startswith('{'):
+                record = json.loads(line)
+                if record.get('event') != 'embed':
+                    continue
+            else:
+                match = LOG_RECORD_PATTERN.search(line)
+                if not match:
+                    continue
+                record = match.groupdict()
+            self.len_wm_by_image[record['image_name']] = int(record['len_wm'])
+            self.image_by_uuid[record['uuid']] = record['image_name']
+        self._offset += end
+
+    def get_len_wm(self, image_name):
+        """
+        Retrieves the watermark bit length (len_wm) for a given image.
+        :param image_name: The name of the image to retrieve len_wm for.
+        :return: The len_wm value, or None if not found.
+        """
+        with metrics.timer("log.lookup_len_wm"):
+            if image_name not in self.len_wm_by_image:
+                self.refresh()
+            return self.len_wm_by_image.get(image_name)
+
+    def validate(self, uuid):
+        """
+        Validates an extracted UUID against the cached watermark records.
+        :param uuid: UUID extracted from the watermark.
+        :return: True if validation passes, False otherwise.
+        """
+        with metrics.timer("log.validate"):
+            if uuid not in self.image_by_uuid:
+                self.refresh()
+            return uuid in self.image_by_uuid
@@ -1,12 +1,30 @@
 import os
 import sys
+import argparse
 import logging
-from logger import get_len_wm_from_log
-from utils import embed_watermark, extract_watermark
-import blind_watermark as bwm  # Import blind-watermark to close the welcome message
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+import metrics
+from lazy import lazy_import, resolve
 
-# Close the welcome message
-bwm.bw_notes.close()
+# Heavy modules (OpenCV, NumPy, PyWavelets, asyncio, SQLite) and the log files are only loaded once a
+# mode actually runs, so --help and argument errors return at once
+ProcessPoolExecutor = lazy_import('concurrent.futures', 'ProcessPoolExecutor')
+iter_images = lazy_import('discovery', 'iter_images')
+Debouncer, create_watcher = lazy_import('watcher', 'Debouncer', 'create_watcher')
+WatermarkLogCache, configure_logging, log_watermark, shutdown_logging = lazy_import(
+    'logger', 'WatermarkLogCache', 'configure_logging', 'log_watermark', 'shutdown_logging')
+get_registry = lazy_import('registry', 'get_registry')
+VerificationReport = lazy_import('report', 'VerificationReport')
+run_server = lazy_import('server', 'run_server')
+(EncodeOptions, ScreeningStats, embed_watermark_batch_records, embed_watermark_pipeline, embed_watermark_record,
+ extract_data_from_watermark, extract_watermark, find_original, generate_image_hash, original_image_name,
+ record_extraction, verify_watermark_file, warm_up, watermarked_image_path) = lazy_import(
+    'utils', 'EncodeOptions', 'ScreeningStats', 'embed_watermark_batch_records', 'embed_watermark_pipeline', 'embed_watermark_record',
+    'extract_data_from_watermark', 'extract_watermark', 'find_original', 'generate_image_hash', 'original_image_name',
+    'record_extraction', 'verify_watermark_file', 'warm_up', 'watermarked_image_path')
 
 
 # Set up logging
@@ -23,51 +41,460 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ORIGINALS_DIR = os.path.join(BASE_DIR, 'images', 'originals')  # Path to original images
 WATERMARKED_DIR = os.path.join(BASE_DIR, 'images', 'watermarked')  # Path to watermarked images
 EXTRACTED_DIR = os.path.join(BASE_DIR, 'images', 'extracted')  # Path for extracted images
+REPORT_PATH = os.path.join(BASE_DIR, 'logs', 'verify_report.csv')  # Default report of the verify mode
 
-# Ensure directories exist
-os.makedirs(ORIGINALS_DIR, exist_ok=True)
-os.makedirs(WATERMARKED_DIR, exist_ok=True)
-os.makedirs(EXTRACTED_DIR, exist_ok=True)
+def load_engine():
+    """
+    Import the watermark engine. blind_watermark sets the multiprocessing start method when it is
+    imported, which fails once a process has been started, so this must run before any worker pool.
+    """
+    resolve('utils', 'get_default_engine')
+
+def ensure_directories():
+    """Create the image directories if they do not exist yet."""
+    os.makedirs(ORIGINALS_DIR, exist_ok=True)
+    os.makedirs(WATERMARKED_DIR, exist_ok=True)
+    os.makedirs(EXTRACTED_DIR, exist_ok=True)
 
 # Dictionary to store watermark bit lengths
 watermark_lengths = {}
 
-def embed_workflow():
-    """Embed watermarks into all images in the originals directory."""
-    for image_name in os.listdir(ORIGINALS_DIR):
-        if image_name.endswith(('jpg', 'jpeg', 'png')):  # Process only image files
+def select_images_to_embed(image_names, registry, file_stats, output_ext=None):
+    """
+    Select the originals that still need a watermark in an incremental run. An original is
+    skipped when the registry holds a checkpoint for it, its watermarked output exists in the
+    requested output format, and either its size and modification time are unchanged or its
+    SHA-256 hash still matches.
+    :param image_names: Iterable of original image names.
+    :param registry: WatermarkRegistry holding the embed checkpoints.
+    :param file_stats: Dictionary that receives {name: (mtime, size)} as read before embedding,
+                       for every scanned original.
+    :param output_ext: Output format of this run as a file extension; None keeps the format of the original.
+    :return: Generator of the names to embed. Originals that vanish or cannot be read while they
+             are checked are left out.
+    """
+    for image_name in image_names:
+        try:
+            needs_embed = _needs_embed(image_name, registry, file_stats, output_ext)
+        except OSError as e:  # Deleted or renamed since it was found
+            logging.warning(f"Skipping {image_name}: {e}")
+            file_stats.pop(image_name, None)
+            continue
+        if needs_embed:
+            yield image_name
+
+def _needs_embed(image_name, registry, file_stats, output_ext):
+    """Check one original for select_images_to_embed; returns True if it needs a watermark."""
+    original_image_path = os.path.join(ORIGINALS_DIR, image_name)
+    stat = os.stat(original_image_path)
+    file_stats[image_name] = (stat.st_mtime, stat.st_size)
+
+    state = registry.get_embed_state(original_image_path)
+    output_path = watermarked_image_path(WATERMARKED_DIR, image_name, output_ext)
+    if state is None or state["output_path"] != output_path or not os.path.exists(output_path):
+        return True
+    if (state["mtime"], state["size"]) == file_stats[image_name]:
+        logging.debug(f"Skipping unchanged original: {image_name}")
+        return False
+    if generate_image_hash(original_image_path, 'sha256') == state["image_hash"]:
+        # Touched but not modified; refresh the checkpoint so the next run skips the hash
+        registry.set_embed_state(original_image_path, state["image_hash"], state["output_path"], *file_stats[image_name])
+        logging.debug(f"Skipping original with unchanged content: {image_name}")
+        return False
+    return True
+
+def _embed_records(image_names, workers, pipeline, queue_depth, batch_size=1, encoding=None):
+    """Embed the given originals serially, in a process pool, in pipeline or in batch mode and yield their records in order."""
+    if batch_size > 1:
+        logging.debug(f"Embedding in batches of up to {batch_size} same-size images")
+        yield from embed_watermark_batch_records(image_names, ORIGINALS_DIR, WATERMARKED_DIR, batch_size=batch_size,
+                                                 encoding=encoding)
+    elif pipeline:
+        logging.debug(f"Embedding in pipeline mode (queue depth {queue_depth})")
+        yield from embed_watermark_pipeline(image_names, ORIGINALS_DIR, WATERMARKED_DIR, queue_depth=queue_depth,
+                                            encoding=encoding)
+    elif workers > 1:
+        logging.debug(f"Embedding with {workers} worker processes")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Submit a bounded window of images ahead so the scan is consumed lazily; results keep submission order
+            futures = deque()
+            for image_name in image_names:
+                futures.append(metrics.submit(executor, embed_watermark_record, image_name, ORIGINALS_DIR,
+                                              WATERMARKED_DIR, encoding))
+                if len(futures) >= 2 * workers:
+                    yield metrics.result(futures.popleft())
+            while futures:
+                yield metrics.result(futures.popleft())
+    else:
+        for image_name in image_names:
             logging.debug(f"Processing original image: {image_name}")
-            len_wm = embed_watermark(image_name, ORIGINALS_DIR, WATERMARKED_DIR)
-            watermark_lengths[image_name] = len_wm  # Store watermark bit length
-            logging.debug(f"Stored watermark length for {image_name}: {len_wm}")
-
-def extract_workflow():
-    """Extract watermarks from all watermarked images."""
-    for watermarked_image_name in os.listdir(WATERMARKED_DIR):
-        if watermarked_image_name.endswith(('jpg', 'jpeg', 'png')):
-            original_image_name = watermarked_image_name.replace("watermarked_", "")
-            logging.debug(f"Processing watermarked image: {watermarked_image_name}")
-            
-            # Retrieve the watermark bit length from the log
-            len_wm = get_len_wm_from_log(original_image_name)
-            if len_wm:
-                extract_watermark(original_image_name, len_wm, WATERMARKED_DIR)
+            yield embed_watermark_record(image_name, ORIGINALS_DIR, WATERMARKED_DIR, encoding)
+
+def embed_workflow(workers=1, pipeline=False, queue_depth=4, incremental=False, batch_size=1, include=(), exclude=(),
+                   encoding=None):
+    """
+    Embed watermarks into all images in the originals directory.
+    :param workers: Number of worker processes. With more than one worker the embedding runs in a
+                    process pool and the watermark records are logged here, in the parent, in the
+                    same order as a serial run.
+    :param pipeline: Overlap decoding, embedding and encoding on separate threads.
+    :param queue_depth: Number of images buffered between pipeline stages.
+    :param incremental: Skip originals that already have an up-to-date watermarked output and
+                        checkpoint every finished image, so an interrupted run resumes where it stopped.
+    :param batch_size: Transform up to this many same-size images together in one vectorized pass.
+    :param include: Glob patterns; only matching originals are embedded.
+    :param exclude: Glob patterns of originals (or directories) to skip.
+    :param encoding: Optional EncodeOptions (format, quality, PNG compression) of the watermarked images;
+                     in pipeline mode the encode runs on the writer thread.
+    """
+    load_engine()
+    output_ext = encoding.format if encoding is not None else None
+
+    # Originals are discovered lazily, so embedding starts while the tree is still being scanned
+    image_names = iter_images(ORIGINALS_DIR, include, exclude)
+
+    if incremental:
+        registry = get_registry()
+        file_stats = {}
+        image_names = select_images_to_embed(image_names, registry, file_stats, output_ext)
+
+    embedded = 0
+    for record in _embed_records(image_names, workers, pipeline, queue_depth, batch_size, encoding):
+        image_name = record["image_name"]
+        log_watermark(**record)
+        watermark_lengths[image_name] = record["len_wm"]  # Store watermark bit length
+        logging.debug(f"Stored watermark length for {image_name}: {record['len_wm']}")
+
+        embedded += 1
+
+        if incremental:  # Checkpoint after every image so a crashed run can resume
+            registry.set_embed_state(os.path.join(ORIGINALS_DIR, image_name), record["image_hash"],
+                                     watermarked_image_path(WATERMARKED_DIR, image_name, output_ext),
+                                     *file_stats[image_name])
+
+    if incremental:
+        logging.info(f"Incremental run: {len(file_stats) - embedded} of {len(file_stats)} images were up to date")
+
+def extract_workflow(screen=False, include=(), exclude=()):
+    """
+    Extract watermarks from all watermarked images.
+    :param screen: Reject images without detectable watermark energy with a cheap probe before full extraction.
+    :param include: Glob patterns; only matching watermarked images are processed.
+    :param exclude: Glob patterns of watermarked images (or directories) to skip.
+    """
+    log_cache = WatermarkLogCache()  # Parsed on first use (validation, older watermarks) once for the whole batch
+    screening = ScreeningStats() if screen else None
+    for watermarked_image_name in iter_images(WATERMARKED_DIR, include, exclude):
+        image_name = original_image_name(watermarked_image_name)
+        logging.debug(f"Processing watermarked image: {watermarked_image_name}")
+
+        # The fixed-length payload needs no len_wm lookup; older text watermarks are looked up in the log cache
+        extracted_log, _ = extract_watermark(image_name, None, WATERMARKED_DIR, log_cache=log_cache, screening=screening)
+        if extracted_log is None:
+            logging.warning(f"No watermark could be extracted from {watermarked_image_name}")
+            # A damaged watermark may still come from a known original; match it by perceptual hash
+            try:
+                matches = find_original(os.path.join(WATERMARKED_DIR, watermarked_image_name))
+            except (ValueError, OSError) as e:  # Unreadable or corrupt file; go on with the next one
+                logging.getLogger('debug').debug(f"Skipping perceptual match of {watermarked_image_name}: {e}")
+                continue
+            for match in matches:
+                logging.warning(f"  Looks like original '{match['image_name']}' (UUID={match['uuid']}, "
+                                f"Folder='{match['folder']}', distance {match['distance']})")
+
+    if screening is not None:
+        logging.info(screening.summary())
+
+def _verify_results(root, relative_paths, workers, log_cache):
+    """
+    Extract the watermarks of the given files, serially or in a warm process pool, and yield
+    (relative path, result of verify_watermark_file) as soon as each one finishes.
+    """
+    def submit_args(relative_path):
+        # Older watermarks need their recorded len_wm, which only this process can look up
+        return os.path.join(root, relative_path), log_cache.get_len_wm(original_image_name(relative_path))
+
+    if workers == 1:
+        for relative_path in relative_paths:
+            yield relative_path, verify_watermark_file(*submit_args(relative_path))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as executor:
+        # A bounded window of files in flight; results are taken in completion order, not submission order
+        pending = {}
+        for relative_path in relative_paths:
+            pending[metrics.submit(executor, verify_watermark_file, *submit_args(relative_path))] = relative_path
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), metrics.result(future)
+        for future in as_completed(pending):
+            yield pending[future], metrics.result(future)
+
+def verify_workflow(root=None, report_path=None, report_format=None, workers=1, include=(), exclude=()):
+    """
+    Extract and validate the watermarks of all images below a directory and stream one report row
+    per image (file, UUID, valid, confidence, seconds, error) as results finish.
+    :param root: Directory tree to verify (default: the watermarked images directory).
+    :param report_path: CSV or JSON Lines report file (default: logs/verify_report.csv).
+    :param report_format: 'csv' or 'json'; by default taken from the report file extension.
+    :param workers: Number of warm worker processes; 1 extracts in this process.
+    :param include: Glob patterns; only matching images are verified.
+    :param exclude: Glob patterns of images (or directories) to skip.
+    :return: The VerificationReport, closed, with the counts of valid, invalid and unreadable images.
+    """
+    load_engine()
+    root = root or WATERMARKED_DIR
+    report_path = report_path or REPORT_PATH
+    log_cache = WatermarkLogCache()  # Validation and older watermarks without rescanning the log per image
+    start = time.perf_counter()
+    with VerificationReport(report_path, report_format) as report:
+        for relative_path, result in _verify_results(root, iter_images(root, include, exclude), workers, log_cache):
+            row = {"file": relative_path.replace(os.sep, '/'), "seconds": round(result["seconds"], 4),
+                   "error": result["error"]}
+            if result["text"] is not None:
+                _, row["valid"] = record_extraction(original_image_name(relative_path), result["text"], log_cache)
+                row["uuid"] = extract_data_from_watermark(result["text"], "UUID")
+                confidence = extract_data_from_watermark(result["text"], "Confidence")
+                row["confidence"] = float(confidence) if confidence else None
+            report.write(row)
+
+    elapsed = time.perf_counter() - start
+    logging.info(f"{report.summary()} in {elapsed:.1f}s ({report.total / max(elapsed, 1e-9):.1f} images/s); "
+                 f"report written to {report_path}")
+    return report
+
+def watch_workflow(workers=1, include=(), exclude=(), debounce=1.0, polling=False, poll_interval=2.0, stop=None,
+                   encoding=None):
+    """
+    Watch the originals directory and embed watermarks into new or modified images as soon as
+    they have been completely written. Originals that changed while nothing was watching are
+    processed first. Every embed is checkpointed as in an incremental run. Runs until
+    interrupted (or until stop is set).
+    :param workers: Number of warm worker processes; 1 embeds in this process.
+    :param include: Glob patterns; only matching originals are embedded.
+    :param exclude: Glob patterns of originals (or directories) to skip.
+    :param debounce: Seconds a file's size and modification time must stay unchanged before it is embedded.
+    :param polling: Rescan the folder instead of using inotify.
+    :param poll_interval: Seconds between two rescans when polling.
+    :param stop: Optional threading.Event that ends the watch.
+    :param encoding: Optional EncodeOptions (format, quality, PNG compression) of the watermarked images.
+    """
+    load_engine()
+    registry = get_registry()
+    watcher = create_watcher(ORIGINALS_DIR, include, exclude, polling=polling, interval=poll_interval)
+    debouncer = Debouncer(ORIGINALS_DIR, quiet_seconds=debounce)
+    debouncer.add(iter_images(ORIGINALS_DIR, include, exclude))  # Backlog; unchanged originals are skipped below
+
+    # Workers are started and warmed up once, so no image pays interpreter or library start-up costs
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up) if workers > 1 else None
+    if executor is None:
+        warm_up()
+    logging.info(f"Watching {ORIGINALS_DIR} ({type(watcher).__name__}, {workers} worker(s))")
+
+    detected_at = {}  # image name -> time its latest change was detected
+    in_flight = {}  # future -> (image name, (mtime, size))
+    waiting, queued = deque(), set()  # Settled originals not yet submitted, in arrival order
+    window = 2 * workers  # Submit a bounded window ahead, so a large backlog is not queued in the pool at once
+
+    def next_ready():
+        while waiting and (executor is None or len(in_flight) < window):
+            image_name = waiting.popleft()
+            queued.discard(image_name)
+            yield image_name
+
+    try:
+        while stop is None or not stop.is_set():
+            if waiting and len(in_flight) >= window:
+                # The window is full: wake up as soon as an embed finishes rather than after the poll timeout
+                wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                changed = watcher.poll(timeout=0)
             else:
-                logging.warning(f"No watermark length found for {original_image_name}, skipping extraction.")
+                changed = watcher.poll(timeout=0.2)
+            now = time.perf_counter()
+            detected_at.update((image_name, now) for image_name in changed)
+            debouncer.add(changed)
+            for image_name in debouncer.ready():
+                if image_name not in queued:
+                    waiting.append(image_name)
+                    queued.add(image_name)
 
-def main():
-    if len(sys.argv) != 2:
-        logging.error("Usage: python main.py <embed|extract>")
-        sys.exit(1)
+            file_stats = {}
+            busy = {image_name for image_name, _ in in_flight.values()}
+            for image_name in select_images_to_embed(next_ready(), registry, file_stats, encoding and encoding.format):
+                if image_name in busy:  # Changed again while being embedded; try once that finishes
+                    debouncer.add([image_name])
+                elif executor is not None:
+                    future = metrics.submit(executor, embed_watermark_record, image_name, ORIGINALS_DIR, WATERMARKED_DIR,
+                                            encoding)
+                    in_flight[future] = (image_name, file_stats[image_name])
+                else:
+                    try:
+                        record = embed_watermark_record(image_name, ORIGINALS_DIR, WATERMARKED_DIR, encoding)
+                    except Exception as e:
+                        logging.error(f"Failed to watermark {image_name}: {e}")
+                        continue
+                    _finish_watched_embed(record, file_stats[image_name], registry, detected_at, encoding)
 
-    mode = sys.argv[1].lower()
-    if mode == "embed":
-        embed_workflow()
-    elif mode == "extract":
-        extract_workflow()
+            for future in [future for future in in_flight if future.done()]:
+                image_name, stats = in_flight.pop(future)
+                try:
+                    record = metrics.result(future)
+                except Exception as e:
+                    logging.error(f"Failed to watermark {image_name}: {e}")
+                    continue
+                _finish_watched_embed(record, stats, registry, detected_at, encoding)
+    finally:
+        watcher.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def _finish_watched_embed(record, stats, registry, detected_at, encoding):
+    """Log and checkpoint one embed of the watch mode and report its latency from detection to output."""
+    image_name = record["image_name"]
+    log_watermark(**record)
+    registry.set_embed_state(os.path.join(ORIGINALS_DIR, image_name), record["image_hash"],
+                             watermarked_image_path(WATERMARKED_DIR, image_name, encoding and encoding.format), *stats)
+    if image_name in detected_at:
+        latency = time.perf_counter() - detected_at.pop(image_name)
+        metrics.observe("watch.latency", latency)
+        logging.info(f"Watermarked {image_name} {latency:.2f}s after it arrived")
     else:
-        logging.error("Invalid mode. Use 'embed' or 'extract'.")
+        logging.info(f"Watermarked {image_name}")
+
+def parse_args(argv):
+    """Parse the command-line options that follow the mode argument."""
+    parser = argparse.ArgumentParser(prog="main.py", usage="python main.py <embed|extract|verify|watch|serve> [options]")
+    parser.add_argument("mode", help="'embed', 'extract', 'verify', 'watch' or 'serve'")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes used for embedding and verification (default: 1)")
+    parser.add_argument("--root", metavar="DIR",
+                        help="Verify mode: directory tree to verify (default: images/watermarked)")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Verify mode: CSV or JSON Lines report file (default: logs/verify_report.csv)")
+    parser.add_argument("--report-format", choices=("csv", "json"),
+                        help="Verify mode: report format (default: json for .json/.jsonl files, else csv)")
+    parser.add_argument("--host",
+                        help="Serve mode: interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int,
+                        help="Serve mode: TCP port to listen on (default: 8750)")
+    parser.add_argument("--max-concurrency", type=int,
+                        help="Serve mode: requests processed at once (default: the number of workers)")
+    parser.add_argument("--max-queue", type=int,
+                        help="Serve mode: requests allowed to wait before new ones get 503 (default: 4x concurrency)")
+    parser.add_argument("--debounce", type=float, default=1.0,
+                        help="Watch mode: seconds a new file must stay unchanged before it is embedded (default: 1.0)")
+    parser.add_argument("--polling", action="store_true",
+                        help="Watch mode: rescan the originals folder instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="Watch mode: seconds between two rescans when polling (default: 2.0)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap image decoding, embedding and encoding on separate threads")
+    parser.add_argument("--queue-depth", type=int, default=4,
+                        help="Images buffered between pipeline stages; bounds peak memory (default: 4)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip originals whose watermarked output is up to date and resume interrupted runs")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Transform up to N same-size images together in one vectorized pass (default: 1)")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB",
+                        help="Only process images whose path (relative to the input folder) matches; repeatable")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="Skip images or directories whose relative path matches; repeatable")
+    parser.add_argument("--format", choices=("jpg", "png", "webp"),
+                        help="Embed/watch mode: output format of the watermarked images (default: that of each original)")
+    parser.add_argument("--quality", type=int,
+                        help="Embed/watch mode: JPEG/WebP quality, 0-100 (default: 95 for JPEG, lossless for WebP)")
+    parser.add_argument("--png-compression", type=int,
+                        help="Embed/watch mode: PNG compression level, 0-9; lower is faster and larger (default: 1)")
+    parser.add_argument("--screen", action="store_true",
+                        help="Extract mode: skip images without detectable watermark energy after a cheap probe")
+    parser.add_argument("--async-log", action="store_true",
+                        help="Write the audit logs on a background thread with batched fsync")
+    parser.add_argument("--no-debug-log", action="store_true",
+                        help="Turn off the per-record debug messages (console and debug_log.log)")
+    parser.add_argument("--no-text-log", action="store_true",
+                        help="Only write the structured event store, not the human-readable text logs")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="Time every processing stage and write the histograms to a JSON file")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="Time every processing stage and write the histograms as a Prometheus text file")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.queue_depth < 1:
+        parser.error("--queue-depth must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if (args.max_concurrency is not None and args.max_concurrency < 1) or (args.max_queue is not None and args.max_queue < 0):
+        parser.error("--max-concurrency must be at least 1 and --max-queue must not be negative")
+    if args.quality is not None and not 0 <= args.quality <= 100:
+        parser.error("--quality must be between 0 and 100")
+    if args.png_compression is not None and not 0 <= args.png_compression <= 9:
+        parser.error("--png-compression must be between 0 and 9")
+    if args.debounce < 0 or args.poll_interval <= 0:
+        parser.error("--debounce must not be negative and --poll-interval must be positive")
+    if sum((args.pipeline, args.workers > 1, args.batch_size > 1)) > 1:
+        parser.error("--pipeline, --workers and --batch-size cannot be combined")
+    return args
+
+def main():
+    if len(sys.argv) < 2:
+        logging.error("Usage: python main.py <embed|extract|verify|watch|serve> [options]")
         sys.exit(1)
 
+    args = parse_args(sys.argv[1:])
+    if args.no_debug_log:
+        logging.getLogger().setLevel(logging.INFO)
+    if args.async_log or args.no_debug_log or args.no_text_log:
+        configure_logging(async_logging=args.async_log, debug_records=not args.no_debug_log,
+                          text_log=not args.no_text_log)
+    mode = args.mode.lower()
+    if args.async_log or mode == "watch":
+        # Turn SIGTERM into a normal exit so queued log records are flushed and workers are shut down
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable()
+        metrics.reset()
+
+    if mode in ("embed", "extract", "verify", "watch"):
+        ensure_directories()
+
+    encoding = None
+    if args.format or args.quality is not None or args.png_compression is not None:
+        encoding = EncodeOptions(args.format, args.quality, args.png_compression)
+
+    start = time.perf_counter()
+    try:
+        if mode == "embed":
+            embed_workflow(workers=args.workers, pipeline=args.pipeline, queue_depth=args.queue_depth,
+                           incremental=args.incremental, batch_size=args.batch_size,
+                           include=args.include, exclude=args.exclude, encoding=encoding)
+        elif mode == "extract":
+            extract_workflow(screen=args.screen, include=args.include, exclude=args.exclude)
+        elif mode == "verify":
+            verify_workflow(root=args.root, report_path=args.report, report_format=args.report_format,
+                            workers=args.workers, include=args.include, exclude=args.exclude)
+        elif mode == "watch":
+            try:
+                watch_workflow(workers=args.workers, include=args.include, exclude=args.exclude,
+                               debounce=args.debounce, polling=args.polling, poll_interval=args.poll_interval,
+                               encoding=encoding)
+            except KeyboardInterrupt:
+                logging.info("Stopped watching")
+        elif mode == "serve":
+            run_server(host=args.host, port=args.port, workers=args.workers,
+                       max_concurrency=args.max_concurrency, max_queue=args.max_queue)
+        else:
+            logging.error("Invalid mode. Use 'embed', 'extract', 'verify', 'watch' or 'serve'.")
+            sys.exit(1)
+    finally:
+        metrics.observe(f"{mode}.run", time.perf_counter() - start)
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+        shutdown_logging()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,205 @@
+import bisect
+import json
+import threading
+import time
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket (+Inf) is implicit
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Name of the Prometheus metric holding all stage histograms
+PROMETHEUS_METRIC = "watermark_stage_seconds"
+
+
+class Histogram:
+    """Distribution of the durations of one stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def merge(self, other):
+        """Adds the durations recorded by another histogram of the same stage, e.g. from a worker process."""
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.bucket_counts = [mine + theirs for mine, theirs in zip(self.bucket_counts, other.bucket_counts)]
+
+    def to_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(BUCKETS + ("+Inf",), self.bucket_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class _StageTimer:
+    """Context manager that records the time spent in its block under a stage name."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    """Shared do-nothing timer returned while metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+_enabled = False
+_histograms = {}
+_lock = threading.Lock()  # Stages also run on the pipeline and hashing threads
+
+
+# Functions to switch the instrumentation on and off
+def enable():
+    """Start collecting stage timings in this process."""
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Drop all collected timings, e.g. at the start of a run."""
+    with _lock:
+        _histograms.clear()
+
+# Function to time a stage: `with metrics.timer("embed.decode"): ...`
+def timer(stage):
+    """
+    Returns a context manager that records the duration of its block under the given stage.
+    While metrics are disabled this is a shared no-op object, so instrumented code costs one
+    function call and one flag check.
+    :param stage: Stage name, e.g. 'embed.decode' or 'transform.svd'.
+    """
+    return _StageTimer(stage) if _enabled else _NULL_TIMER
+
+def observe(stage, seconds):
+    """Adds one duration to the histogram of a stage (ignored while metrics are disabled)."""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+# Functions to collect the timings of worker processes
+def take():
+    """Returns the histograms collected so far as {stage: Histogram} and starts over with empty ones."""
+    global _histograms
+    with _lock:
+        histograms, _histograms = _histograms, {}
+    return histograms
+
+def merge(histograms):
+    """Adds histograms returned by take(), e.g. in another process, to the ones of this process."""
+    if not _enabled:
+        return
+    with _lock:
+        for stage, other in histograms.items():
+            histogram = _histograms.get(stage)
+            if histogram is None:
+                histogram = _histograms[stage] = Histogram()
+            histogram.merge(other)
+
+def measured(function, *args):
+    """
+    Runs a function in a worker process with metrics enabled and returns (result, histograms) with
+    the durations recorded during the call. Whatever the worker inherited from its parent or
+    recorded before is dropped first, so every duration reaches the parent exactly once.
+    """
+    enable()
+    reset()
+    result = function(*args)
+    return result, take()
+
+def submit(executor, function, *args):
+    """
+    Submits a function to a process pool. While metrics are enabled the worker also returns its
+    stage timings; get the result with result(), which merges them into this process.
+    """
+    if _enabled:
+        return executor.submit(measured, function, *args)
+    return executor.submit(function, *args)
+
+def result(future):
+    """Returns the result of a future from submit() and merges the worker's stage timings, if any."""
+    value = future.result()
+    if not _enabled:
+        return value
+    value, histograms = value
+    merge(histograms)
+    return value
+
+# Functions to export the collected timings
+def summary():
+    """
+    Returns the collected timings.
+    :return: Dictionary {stage: {count, sum, mean, min, max, buckets}} with cumulative bucket counts keyed by upper bound.
+    """
+    with _lock:
+        return {stage: histogram.to_dict() for stage, histogram in sorted(_histograms.items())}
+
+def write_json(path):
+    """Writes summary() to a JSON file."""
+    with open(path, 'w') as json_file:
+        json.dump({"stages": summary()}, json_file, indent=2)
+
+def prometheus_text():
+    """Renders the collected timings as Prometheus text exposition format histograms."""
+    lines = [
+        f"# HELP {PROMETHEUS_METRIC} Time spent per watermark processing stage.",
+        f"# TYPE {PROMETHEUS_METRIC} histogram",
+    ]
+    for stage, histogram in summary().items():
+        for bound, count in histogram["buckets"].items():
+            lines.append(f'{PROMETHEUS_METRIC}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'{PROMETHEUS_METRIC}_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{PROMETHEUS_METRIC}_count{{stage="{stage}"}} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    """Writes prometheus_text() to a file, e.g. for the node_exporter textfile collector."""
+    with open(path, 'w') as prometheus_file:
+        prometheus_file.write(prometheus_text())
@@ -0,0 +1,108 @@
+import hashlib
+import struct
+import uuid
+import zlib
+from datetime import datetime
+import numpy as np
+import fec
+
+# Version of the binary watermark payload; version 1 payloads were embedded without error correction
+PAYLOAD_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+# Payload layout: version, UUID, epoch seconds, folder id; followed by a CRC-32 of these fields
+PAYLOAD_FIELDS = struct.Struct('>B16sII')
+PAYLOAD_CRC = struct.Struct('>I')
+
+# Fixed payload length in bytes and in bits (the len_wm of version 1 payloads)
+PAYLOAD_SIZE = PAYLOAD_FIELDS.size + PAYLOAD_CRC.size
+PAYLOAD_BITS = PAYLOAD_SIZE * 8
+
+# Number of embedded watermark bits (len_wm) once the payload is protected by the convolutional code
+WATERMARK_BITS = fec.coded_length(PAYLOAD_BITS)
+
+
+class PayloadError(ValueError):
+    """Raised when extracted bits are not a valid payload (wrong CRC or unknown version)."""
+
+
+# Function to reduce a folder name to the 32-bit id stored in the payload
+def folder_id(folder):
+    """
+    Returns the 32-bit id of a folder name: the first 4 bytes of its SHA-256.
+    :param folder: Folder name.
+    """
+    return int.from_bytes(hashlib.sha256(folder.encode('utf-8')).digest()[:4], 'big')
+
+# Function to build the payload embedded into an image
+def encode_payload(image_uuid, epoch_seconds, folder):
+    """
+    Packs the watermark data into a fixed-length binary payload.
+    :param image_uuid: uuid.UUID of the image.
+    :param epoch_seconds: Time of the embed in seconds since the epoch.
+    :param folder: Name of the folder the original came from.
+    :return: PAYLOAD_SIZE bytes.
+    """
+    fields = PAYLOAD_FIELDS.pack(PAYLOAD_VERSION, image_uuid.bytes, int(epoch_seconds), folder_id(folder))
+    return fields + PAYLOAD_CRC.pack(zlib.crc32(fields))
+
+# Function to unpack and check an extracted payload
+def decode_payload(data):
+    """
+    Unpacks a payload and checks its CRC and version.
+    :param data: PAYLOAD_SIZE bytes recovered from an image.
+    :return: Dictionary with version, uuid (uuid.UUID), epoch_seconds and folder_id.
+    :raises PayloadError: If the data is not a valid payload.
+    """
+    if len(data) != PAYLOAD_SIZE:
+        raise PayloadError(f"Payload must be {PAYLOAD_SIZE} bytes, got {len(data)}")
+    fields, (crc,) = data[:PAYLOAD_FIELDS.size], PAYLOAD_CRC.unpack(data[PAYLOAD_FIELDS.size:])
+    if zlib.crc32(fields) != crc:
+        raise PayloadError("Payload CRC mismatch")
+    version, uuid_bytes, epoch_seconds, folder = PAYLOAD_FIELDS.unpack(fields)
+    if version not in SUPPORTED_VERSIONS:
+        raise PayloadError(f"Unknown payload version {version}")
+    return {"version": version, "uuid": uuid.UUID(bytes=uuid_bytes), "epoch_seconds": epoch_seconds,
+            "folder_id": folder}
+
+# Function to protect a payload with the error-correcting code
+def encode_payload_bits(data):
+    """
+    Encodes a payload into the WATERMARK_BITS bits that are embedded, with the rate 1/2
+    convolutional code of fec.py.
+    :param data: PAYLOAD_SIZE bytes returned by encode_payload.
+    :return: Boolean NumPy array of WATERMARK_BITS bits (not yet encrypted).
+    """
+    return fec.encode(np.unpackbits(np.frombuffer(data, dtype=np.uint8))).astype(bool)
+
+# Function to correct and unpack the soft bits extracted from an image
+def decode_payload_bits(soft_bits):
+    """
+    Corrects the extracted bits in one soft-decision Viterbi pass and unpacks the payload.
+    :param soft_bits: WATERMARK_BITS decrypted bit estimates in [0, 1], as averaged by extract_bits.
+    :return: Dictionary returned by decode_payload, plus "confidence": the agreement in [0, 1] of
+             the soft bits with the corrected codeword (1 for a clean read; the CRC decides validity).
+    :raises PayloadError: If the corrected bits are not a valid payload.
+    """
+    soft_bits = np.asarray(soft_bits, dtype=np.float64)
+    if soft_bits.size != WATERMARK_BITS:
+        raise PayloadError(f"Expected {WATERMARK_BITS} watermark bits, got {soft_bits.size}")
+    bits, confidence = fec.decode(2 * soft_bits - 1)
+    payload = decode_payload(np.packbits(bits).tobytes())
+    payload["confidence"] = confidence
+    return payload
+
+# Function to render a payload in the log-style text of the text watermarks
+def format_payload(payload):
+    """
+    Formats a decoded payload like the log-style watermark text, so extract_data_from_watermark
+    finds the UUID and the folder (shown as '#' and its id) in both formats.
+    :param payload: Dictionary returned by decode_payload or decode_payload_bits; a confidence is
+                    shown with two decimals when present.
+    """
+    timestamp = datetime.fromtimestamp(payload["epoch_seconds"]).strftime("%Y-%m-%d %H:%M:%S")
+    text = (f"[{timestamp}] [WATERMARK EMBED] UUID={payload['uuid']} Folder=#{payload['folder_id']:08x} "
+            f"Version={payload['version']}")
+    if payload.get("confidence") is not None:
+        text += f" Confidence={payload['confidence']:.2f}"
+    return text
@@ -0,0 +1,68 @@
+from itertools import combinations
+import cv2
+import numpy as np
+
+# A pHash is the sign pattern of the 8x8 lowest frequencies of a 32x32 DCT: 64 bits, stored as 16 hex digits
+HASH_SIZE = 8
+SAMPLE_SIZE = 32
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# Images are first shrunk to at most this size in their own dtype (8 source pixels per sample per axis)
+PRESAMPLE_SIZE = 8 * SAMPLE_SIZE
+
+# Multi-index hashing: the hash is split into BANDS bands of BAND_BITS bits, each indexed on its own.
+# Two hashes within distance d agree within d // BANDS bits on at least one band (pigeonhole principle).
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Default Hamming distance up to which two hashes are taken to show the same picture
+MATCH_DISTANCE = 10
+
+
+# Function to compute the perceptual hash of an image
+def perceptual_hash(img):
+    """
+    Computes the DCT-based perceptual hash (pHash) of an image. It survives recompression,
+    resizing and small colour changes, and so the watermark itself, unlike a hash of the file.
+    :param img: Decoded image array (grayscale, BGR or BGRA).
+    :return: The hash as a string of 16 hex digits.
+    """
+    # Shrink in the image's own dtype first, so no full-resolution copy is made even for huge images,
+    # then to SAMPLE_SIZE in float32, which averages out the rounding of the first step
+    img = np.asarray(img)
+    height, width = img.shape[:2]
+    medium = cv2.resize(img, (min(width, PRESAMPLE_SIZE), min(height, PRESAMPLE_SIZE)), interpolation=cv2.INTER_AREA)
+    small = cv2.resize(medium.astype(np.float32), (SAMPLE_SIZE, SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(np.ascontiguousarray(small[..., :3]), cv2.COLOR_BGR2GRAY)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])  # The DC term only reflects the mean brightness
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+# Function to count the differing bits of two hashes
+def hamming_distance(hash_a, hash_b):
+    """Returns the number of differing bits of two hashes given as hex strings."""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+# Function to split a hash into its index bands
+def hash_bands(image_hash):
+    """Returns the BANDS integer bands of a hash given as a hex string, most significant first."""
+    value = int(image_hash, 16)
+    return [(value >> (BAND_BITS * (BANDS - 1 - band))) & BAND_MASK for band in range(BANDS)]
+
+# Function to list the band values to look up for a query
+def band_neighbours(band_value, radius):
+    """
+    Returns all band values within a Hamming distance of radius of band_value, itself included.
+    :param band_value: Integer value of one band.
+    :param radius: Maximum number of flipped bits.
+    """
+    neighbours = [band_value]
+    for flipped in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), flipped):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            neighbours.append(band_value ^ mask)
+    return neighbours
@@ -0,0 +1,245 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+from phash import BANDS, MATCH_DISTANCE, band_neighbours, hamming_distance, hash_bands
+
+# Define the registry location (kept next to the text logs)
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+REGISTRY_PATH = os.path.join(REGISTRY_DIR, 'watermark_registry.db')
+WATERMARK_LOG_PATH = os.path.join(REGISTRY_DIR, 'watermark_log.log')
+
+# Tables for watermark records and embed checkpoints
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_name TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    folder TEXT,
+    timestamp TEXT,
+    len_wm INTEGER NOT NULL,
+    image_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS embed_state (
+    original_path TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+# Perceptual hash of the original and its bands (see phash.py), added to registries created without them
+PHASH_COLUMNS = [("phash", "TEXT")] + [(f"phash_{band}", "INTEGER") for band in range(BANDS)]
+
+# Indexes that keep every lookup at O(log N), created once the perceptual hash columns exist;
+# one per band for the multi-index Hamming lookup
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_watermarks_image_name ON watermarks (image_name);
+CREATE INDEX IF NOT EXISTS idx_watermarks_uuid ON watermarks (uuid);
+CREATE INDEX IF NOT EXISTS idx_watermarks_hash ON watermarks (image_hash);
+""" + "".join(f"CREATE INDEX IF NOT EXISTS idx_watermarks_phash_{band} ON watermarks (phash_{band});\n"
+              for band in range(BANDS))
+
+# Pattern for the records written by logger.log_watermark
+LOG_RECORD_PATTERN = re.compile(
+    r"Image '(?P<image_name>.*)' was watermarked\. UUID=(?P<uuid>[^,\s]+), Folder='(?P<folder>.*)', "
+    r"Time=(?P<timestamp>[^,]+), len_wm=(?P<len_wm>\d+)(?:, Hash=(?P<image_hash>\w+))?(?:, pHash=(?P<phash>[0-9a-f]{16}))?"
+)
+
+# Columns of the records returned by lookups
+RECORD_COLUMNS = "image_name, uuid, folder, timestamp, len_wm, image_hash, phash"
+INSERT_RECORD = (f"INSERT INTO watermarks ({RECORD_COLUMNS}, {', '.join(f'phash_{band}' for band in range(BANDS))}) "
+                 f"VALUES ({', '.join('?' * (7 + BANDS))})")
+
+
+# Function to build the row stored for a record
+def _record_row(image_name, uuid, folder, timestamp, len_wm, image_hash, phash):
+    """Returns the INSERT_RECORD parameters of a record, with the bands of its perceptual hash."""
+    bands = hash_bands(phash) if phash else [None] * BANDS
+    return (image_name, str(uuid), folder, timestamp, int(len_wm), image_hash, phash, *bands)
+
+
+class WatermarkRegistry:
+    """Persistent, indexed store of watermark records backed by SQLite."""
+
+    def __init__(self, db_path=REGISTRY_PATH):
+        """
+        Opens (and if needed creates) the registry database.
+        :param db_path: Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(watermarks)")}
+        for column, column_type in PHASH_COLUMNS:
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE watermarks ADD COLUMN {column} {column_type}")
+        self.connection.executescript(INDEXES)
+        self.connection.commit()
+
+    def add(self, image_name, uuid, folder, timestamp, len_wm, image_hash, phash=None):
+        """Stores one watermark record (same arguments as logger.log_watermark)."""
+        with self._lock:
+            self.connection.execute(INSERT_RECORD,
+                                    _record_row(image_name, uuid, folder, timestamp, len_wm, image_hash, phash))
+            self.connection.commit()
+
+    def add_many(self, records):
+        """
+        Stores several watermark records in one transaction.
+        :param records: Iterable of dictionaries with the arguments of add.
+        """
+        with self._lock:
+            self.connection.executemany(INSERT_RECORD, [_record_row(**record) for record in records])
+            self.connection.commit()
+
+    def get_len_wm(self, image_name):
+        """
+        Retrieves the watermark bit length (len_wm) of the most recent record for an image.
+        :param image_name: The name of the original image.
+        :return: The len_wm value, or None if not found.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT len_wm FROM watermarks WHERE image_name = ? ORDER BY id DESC LIMIT 1", (image_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def has_uuid(self, uuid):
+        """Returns True if a watermark with the given UUID has been recorded."""
+        with self._lock:
+            row = self.connection.execute("SELECT 1 FROM watermarks WHERE uuid = ? LIMIT 1", (str(uuid),)).fetchone()
+        return row is not None
+
+    def find_by_hash(self, image_hash):
+        """
+        Retrieves all records for an original image hash, oldest first.
+        :param image_hash: SHA-256 hash of the original image.
+        :return: List of record dictionaries.
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                f"SELECT {RECORD_COLUMNS} FROM watermarks WHERE image_hash = ? ORDER BY id", (image_hash,)
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def find_similar(self, phash, max_distance=MATCH_DISTANCE, limit=10):
+        """
+        Retrieves the records whose original looks like an image, by the Hamming distance of their
+        perceptual hashes. Only candidates that share a nearly equal band with the query are read,
+        through the band indexes, so a lookup takes milliseconds even with millions of records.
+        :param phash: Perceptual hash of the suspect image (phash.perceptual_hash).
+        :param max_distance: Maximum number of differing hash bits.
+        :param limit: Maximum number of records returned.
+        :return: List of record dictionaries with a "distance" key, closest first.
+        """
+        radius = max_distance // BANDS
+        query = " UNION ".join(
+            f"SELECT id FROM watermarks WHERE phash_{band} IN ({', '.join(map(str, band_neighbours(value, radius)))})"
+            for band, value in enumerate(hash_bands(phash))
+        )
+        with self._lock:
+            cursor = self.connection.execute(
+                f"SELECT {RECORD_COLUMNS} FROM watermarks WHERE id IN ({query}) ORDER BY id")
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        matches = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            record["distance"] = hamming_distance(phash, record["phash"])
+            if record["distance"] <= max_distance:
+                matches.append(record)
+        matches.sort(key=lambda record: record["distance"])  # Stable: equally close records stay oldest first
+        return matches[:limit]
+
+    def import_log(self, log_file_path):
+        """
+        Backfills the registry from a text watermark log. Records whose UUID is already
+        present are skipped, so importing the same log twice is harmless.
+        :param log_file_path: Path to a watermark_log.log file.
+        :return: Number of records imported.
+        """
+        imported = 0
+        with open(log_file_path, 'r') as log_file, self._lock:
+            for line in log_file:
+                match = LOG_RECORD_PATTERN.search(line)
+                if not match:
+                    continue
+                record = match.groupdict()
+                if self.connection.execute("SELECT 1 FROM watermarks WHERE uuid = ? LIMIT 1",
+                                           (record["uuid"],)).fetchone():
+                    continue
+                self.connection.execute(INSERT_RECORD, _record_row(**record))
+                imported += 1
+            self.connection.commit()
+        return imported
+
+    def get_embed_state(self, original_path):
+        """
+        Retrieves the checkpoint of the last successful embed of an original image.
+        :param original_path: Path to the original image.
+        :return: Dictionary with image_hash, output_path, mtime and size, or None if never embedded.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT image_hash, output_path, mtime, size FROM embed_state WHERE original_path = ?",
+                (original_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("image_hash", "output_path", "mtime", "size"), row))
+
+    def set_embed_state(self, original_path, image_hash, output_path, mtime, size):
+        """
+        Stores the checkpoint of a successful embed, replacing any earlier one for the same original.
+        :param original_path: Path to the original image.
+        :param image_hash: SHA-256 hash of the original image.
+        :param output_path: Path of the watermarked image.
+        :param mtime: Modification time of the original when it was read.
+        :param size: Size in bytes of the original when it was read.
+        """
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO embed_state (original_path, image_hash, output_path, mtime, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (original_path, image_hash, output_path, mtime, size),
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+_registry = None
+_registry_pid = None
+
+# Function to get the shared registry of the current process
+def get_registry():
+    """
+    Returns the process-wide registry, creating it on first use. A freshly created
+    database is backfilled once from the existing watermark log.
+    """
+    global _registry, _registry_pid
+    if _registry is None or _registry_pid != os.getpid():  # Never share a connection across a fork
+        os.makedirs(REGISTRY_DIR, exist_ok=True)
+        is_new = not os.path.exists(REGISTRY_PATH)
+        _registry = WatermarkRegistry(REGISTRY_PATH)
+        _registry_pid = os.getpid()
+        if is_new and os.path.exists(WATERMARK_LOG_PATH):
+            _registry.import_log(WATERMARK_LOG_PATH)
+    return _registry
+
+
+# One-shot importer: python registry.py [watermark_log.log ...]
+if __name__ == "__main__":
+    log_paths = sys.argv[1:] or [WATERMARK_LOG_PATH]
+    registry = get_registry()
+    for log_path in log_paths:
+        count = registry.import_log(log_path)
+        print(f"Imported {count} records from {log_path}")
@@ -0,0 +1,73 @@
+import csv
+import json
+import os
+
+# Columns of a verification report, in order
+REPORT_FIELDS = ("file", "uuid", "valid", "confidence", "seconds", "error")
+
+# Report formats; JSON reports are written as JSON Lines (one object per line) so they can be streamed
+REPORT_FORMATS = ("csv", "json")
+
+
+class VerificationReport:
+    """
+    Writes the rows of a bulk verification to a CSV or JSON Lines file as they arrive. Every row
+    is flushed at once, so an interrupted audit keeps the results it produced and the report can
+    be followed while it grows.
+    """
+
+    def __init__(self, path, report_format=None):
+        """
+        Creates (or overwrites) the report file.
+        :param path: Path of the report file.
+        :param report_format: 'csv' or 'json'; by default 'json' for .json/.jsonl files and 'csv' otherwise.
+        """
+        self.path = path
+        self.format = report_format or ("json" if path.lower().endswith((".json", ".jsonl")) else "csv")
+        if self.format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format '{self.format}'; use one of {', '.join(REPORT_FORMATS)}")
+        self.counts = {"valid": 0, "invalid": 0, "unreadable": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w', newline='' if self.format == "csv" else None, encoding='utf-8')
+        self._writer = None
+        if self.format == "csv":
+            self._writer = csv.DictWriter(self._file, REPORT_FIELDS)
+            self._writer.writeheader()
+
+    def write(self, row):
+        """
+        Appends one row and flushes it.
+        :param row: Dictionary with the REPORT_FIELDS; "uuid" and "valid" are None for images
+                    without a readable watermark.
+        """
+        row = {field: row.get(field) for field in REPORT_FIELDS}
+        if row["valid"] is None:
+            self.counts["unreadable"] += 1
+        else:
+            self.counts["valid" if row["valid"] else "invalid"] += 1
+
+        if self._writer is not None:
+            self._writer.writerow({field: "" if value is None else value for field, value in row.items()})
+        else:
+            self._file.write(json.dumps(row, separators=(',', ':')) + "\n")
+        self._file.flush()
+
+    @property
+    def total(self):
+        """Number of rows written."""
+        return sum(self.counts.values())
+
+    def summary(self):
+        """One-line summary of the rows written so far."""
+        return (f"{self.total} image(s) verified: {self.counts['valid']} valid, {self.counts['invalid']} invalid, "
+                f"{self.counts['unreadable']} without a readable watermark")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,308 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+import metrics
+from payload import WATERMARK_BITS
+from logger import get_len_wm_from_log, log_extraction, log_watermark, validate_watermark
+from utils import embed_watermark_buffer_record, extract_data_from_watermark, extract_watermark_text_buffer, warm_up
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+
+# Largest accepted request body; larger uploads are refused before they are read
+MAX_BODY_BYTES = 512 * 1024 * 1024
+
+# Largest accepted request line plus headers
+MAX_HEADER_BYTES = 64 * 1024
+
+# Content types of the output formats
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity', 431: 'Request Header Fields Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    """Ends a request with an HTTP error status and a JSON error message."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+# Function to read an optional integer query parameter
+def _int_param(params, name, low, high):
+    """Returns the parameter as an int, or None when absent; anything outside [low, high] is a 400 error."""
+    if name not in params:
+        return None
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise HTTPError(400, f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise HTTPError(400, f"'{name}' must be between {low} and {high}")
+    return value
+
+
+class WatermarkServer:
+    """
+    Local HTTP service that embeds and extracts watermarks in image bytes sent with the request.
+    Images are processed in a pool of worker processes that are started and warmed up once, and
+    nothing is read from or written to disk apart from the audit logs. At most max_concurrency
+    requests are processed at once and at most max_queue more wait for a slot; further requests
+    are refused with 503 before their body is read.
+
+    Endpoints:
+        POST /embed?name=<image name>[&folder=<folder>][&format=<.png|.jpg|.webp>][&quality=<0-100>]
+             [&compression=<0-9>]  image bytes -> watermarked image bytes
+        POST /extract[?len_wm=<bits> or ?name=<image name> for older text watermarks]  image bytes -> JSON with the
+             watermark and its validation
+        POST /verify  alias of /extract
+        GET /health  JSON with the pool and queue state
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=1, max_concurrency=None, max_queue=None,
+                 max_body=MAX_BODY_BYTES):
+        """
+        :param host: Interface to listen on.
+        :param port: TCP port to listen on (0 picks a free port).
+        :param workers: Number of warm worker processes.
+        :param max_concurrency: Requests processed at once (default: workers).
+        :param max_queue: Requests allowed to wait for a free slot (default: 4 * max_concurrency).
+        :param max_body: Largest accepted request body in bytes.
+        """
+        self.host, self.port = host, port
+        self.workers = workers
+        self.max_concurrency = max_concurrency or workers
+        self.max_queue = 4 * self.max_concurrency if max_queue is None else max_queue
+        self.max_body = max_body
+        self.active = 0  # Requests holding a processing slot
+        self.waiting = 0  # Requests waiting for a processing slot
+        self.rejected = 0  # Requests refused because the queue was full
+        self._slots = None
+        self._executor = None
+        self._server = None
+
+    async def start(self):
+        """Start and warm up the worker processes, then start listening."""
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        # Workers are spawned on demand; one task per worker starts (and warms up) all of them now
+        await asyncio.gather(*(asyncio.wrap_future(self._executor.submit(os.getpid)) for _ in range(self.workers)))
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Serving on http://{self.host}:{self.port} ({self.workers} worker(s), "
+                     f"{self.max_concurrency} concurrent, {self.max_queue} queued)")
+
+    async def serve_forever(self):
+        """Serve until SIGINT or SIGTERM, then shut down cleanly."""
+        await self.start()
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopped.set)
+            except (NotImplementedError, RuntimeError):  # Windows, or not running in the main thread
+                pass
+        try:
+            await stopped.wait()
+        finally:
+            await self.close()
+            logging.info("Stopped serving")
+
+    async def close(self):
+        """Stop listening and shut the worker processes down."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _handle_connection(self, reader, writer):
+        """Serve the requests of one connection until the client or an error closes it."""
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await self._read_head(reader)
+                    if request is None:
+                        break
+                    method, target, headers = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    status, response_headers, body = await self._dispatch(method, target, headers, reader)
+                except HTTPError as e:
+                    # The body of a failed request may not have been read, so the connection cannot be reused
+                    keep_alive = False
+                    status, response_headers, body = e.status, e.headers, json.dumps({"error": e.message}).encode()
+                    response_headers.setdefault('Content-Type', 'application/json')
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    logging.error(f"Request failed: {e}")
+                    keep_alive = False
+                    status, response_headers, body = 500, {'Content-Type': 'application/json'}, json.dumps(
+                        {"error": str(e)}).encode()
+                await self._write_response(writer, status, response_headers, body, keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader):
+        """Read the request line and headers; returns None at the end of the connection."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HTTPError(400, "Incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request headers too large")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    async def _read_body(self, reader, headers):
+        if 'transfer-encoding' in headers:
+            raise HTTPError(411, "Chunked uploads are not supported; send a Content-Length")
+        try:
+            length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            raise HTTPError(411, "Content-Length required")
+        if length > self.max_body:
+            raise HTTPError(413, f"Request body larger than {self.max_body} bytes")
+        if length == 0:
+            raise HTTPError(400, "Empty request body")
+        return await reader.readexactly(length)
+
+    async def _dispatch(self, method, target, headers, reader):
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        routes = {'/embed': ('POST', self._embed), '/extract': ('POST', self._extract),
+                  '/verify': ('POST', self._extract), '/health': ('GET', self._health)}
+        if url.path not in routes:
+            raise HTTPError(404, f"Unknown endpoint {url.path}")
+        allowed, handler = routes[url.path]
+        if method != allowed:
+            raise HTTPError(405, f"{url.path} only accepts {allowed}", headers={'Allow': allowed})
+        if method == 'GET':
+            return await handler(params)
+
+        await self._acquire_slot()
+        start = time.perf_counter()
+        try:
+            body = await self._read_body(reader, headers)
+            return await handler(params, body)
+        finally:
+            self._slots.release()
+            self.active -= 1
+            metrics.observe(f"server{url.path}", time.perf_counter() - start)
+
+    async def _acquire_slot(self):
+        """Wait for a processing slot, or refuse the request when too many are already waiting."""
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPError(503, "Server busy, retry later", headers={'Retry-After': '1'})
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    async def _run(self, func, *args):
+        """Run func in a worker process; errors caused by the input become 422 responses."""
+        try:
+            return await asyncio.wrap_future(self._executor.submit(func, *args))
+        except ValueError as e:
+            raise HTTPError(422, str(e))
+
+    async def _log(self, func, **kwargs):
+        """Write an audit record on a thread, so the event loop keeps serving while it is written."""
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, **kwargs))
+
+    async def _embed(self, params, body):
+        image_name = params.get('name')
+        if not image_name:
+            raise HTTPError(400, "Missing 'name' parameter")
+        ext = params.get('format') or os.path.splitext(image_name)[1] or '.png'
+        ext = ext if ext.startswith('.') else f'.{ext}'
+        if ext.lower() not in CONTENT_TYPES:
+            raise HTTPError(400, f"Unsupported output format '{ext}'")
+        quality = _int_param(params, 'quality', 0, 100)
+        compression = _int_param(params, 'compression', 0, 9)  # PNG: lower levels encode faster, files get larger
+
+        encoded, record = await self._run(embed_watermark_buffer_record, body, image_name,
+                                          params.get('folder', 'http'), ext, quality, compression)
+        await self._log(log_watermark, **record)
+        return 200, {'Content-Type': CONTENT_TYPES[ext.lower()], 'X-Watermark-UUID': str(record['uuid']),
+                     'X-Watermark-Length': str(record['len_wm'])}, encoded
+
+    async def _extract(self, params, body):
+        # The fixed-length payload needs no len_wm; older text watermarks need theirs, given or looked up by name
+        len_wm = None
+        if 'len_wm' in params:
+            try:
+                len_wm = int(params['len_wm'])
+            except ValueError:
+                raise HTTPError(400, "'len_wm' must be an integer")
+        elif 'name' in params:
+            len_wm = await asyncio.get_running_loop().run_in_executor(None, get_len_wm_from_log, params['name'])
+
+        watermark = await self._run(extract_watermark_text_buffer, body, len_wm)
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await self._log(log_extraction, image_name=params.get('name', '<http>'), watermark_content=watermark,
+                        timestamp=timestamp)
+        extracted_uuid = extract_data_from_watermark(watermark, "UUID")
+        valid = await asyncio.get_running_loop().run_in_executor(None, validate_watermark, extracted_uuid)
+        result = {"watermark": watermark, "uuid": extracted_uuid, "valid": valid, "len_wm": len_wm or WATERMARK_BITS}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(result).encode()
+
+    async def _health(self, params):
+        state = {"workers": self.workers, "active": self.active, "waiting": self.waiting, "rejected": self.rejected,
+                 "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(state).encode()
+
+    async def _write_response(self, writer, status, headers, body, keep_alive):
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+
+# Function to run the service until interrupted
+def run_server(host=None, port=None, workers=1, max_concurrency=None, max_queue=None):
+    """
+    Serve the embed and extract endpoints until interrupted (see WatermarkServer).
+    :param host: Interface to listen on (default: DEFAULT_HOST).
+    :param port: TCP port to listen on (default: DEFAULT_PORT).
+    :param workers: Number of warm worker processes.
+    :param max_concurrency: Requests processed at once (default: workers).
+    :param max_queue: Requests allowed to wait for a free slot (default: 4 * max_concurrency).
+    """
+    server = WatermarkServer(host or DEFAULT_HOST, DEFAULT_PORT if port is None else port, workers=workers, max_concurrency=max_concurrency, max_queue=max_queue)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+from unittest.mock import patch
+
+# Ensure the project root is included in sys.path before importing discovery
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from discovery import iter_images
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Create a nested folder of images and other files."""
+    for relative_path in ("a.jpg", "B.JPG", "notes.txt", "shoot/c.Png", "shoot/raw/d.jpeg",
+                          "thumbs/e.jpg", "shoot/thumbs/f.jpg"):
+        path = tmp_path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"data")
+    return tmp_path
+
+
+def as_posix(paths):
+    return sorted(path.replace(os.sep, "/") for path in paths)
+
+
+def test_iter_images_walks_nested_folders(tree):
+    """Test that nested images are found with case-insensitive extensions as relative paths"""
+    assert as_posix(iter_images(str(tree))) == ["B.JPG", "a.jpg", "shoot/c.Png", "shoot/raw/d.jpeg",
+                                                "shoot/thumbs/f.jpg", "thumbs/e.jpg"]
+
+
+def test_iter_images_include_and_exclude(tree):
+    """Test include globs and exclude globs, including pruned directories"""
+    assert as_posix(iter_images(str(tree), include=["shoot/*"])) == ["shoot/c.Png", "shoot/raw/d.jpeg",
+                                                                     "shoot/thumbs/f.jpg"]
+    assert as_posix(iter_images(str(tree), exclude=["thumbs", "*/thumbs", "*.jpeg"])) == ["B.JPG", "a.jpg",
+                                                                                          "shoot/c.Png"]
+
+
+def test_iter_images_is_lazy(tree):
+    """Test that the first image is yielded before the whole tree is scanned"""
+    with patch("discovery.os.scandir", wraps=os.scandir) as mock_scandir:
+        images = iter_images(str(tree))
+        next(images)
+        assert mock_scandir.call_count == 1
+        images.close()
@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import pytest
+
+# Ensure the project root is included in sys.path before importing events
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from events import WatermarkEventReader, WatermarkEventStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Create an event store in a temporary directory."""
+    store = WatermarkEventStore(str(tmp_path / "events.jsonl"))
+    yield store
+    store.close()
+
+
+def add_embed(store, image_name, uuid, len_wm):
+    return store.append("embed", image_name=image_name, uuid=uuid, folder="originals",
+                        timestamp="2024-01-01 10:00:00", len_wm=len_wm, image_hash="hash")
+
+
+def test_reader_random_access_and_lookup(store):
+    """Test offsets, indexed access and byte-level lookups of the latest record"""
+    first = add_embed(store, "a.jpg", "uuid-1", 1063)
+    add_embed(store, "b.jpg", "uuid-2", 1071)
+    store.append("extract", image_name="a.jpg", content="text", timestamp="2024-01-02 10:00:00")
+    add_embed(store, "a.jpg", "uuid-3", 1079)
+
+    reader = WatermarkEventReader(store.path)
+    assert len(reader) == 4
+    assert first == 0 and reader.offset(0) == 0
+    assert reader[1]["uuid"] == "uuid-2"
+    assert reader[2]["event"] == "extract"
+    assert reader.find("image_name", "a.jpg")["len_wm"] == 1079
+    assert reader.find("image_name", "a.jpg", latest=False)["len_wm"] == 1063
+    assert reader.find("uuid", "uuid-2")["image_name"] == "b.jpg"
+    assert reader.find("uuid", "uuid-9") is None
+    assert [event["event"] for event in reader] == ["embed", "embed", "extract", "embed"]
+    reader.close()
+
+
+def test_reader_refresh_sees_appended_records(store):
+    """Test that a reader only sees new records after refresh"""
+    add_embed(store, "a.jpg", "uuid-1", 1063)
+    reader = WatermarkEventReader(store.path)
+    add_embed(store, "b.jpg", "uuid-2", 1071)
+
+    assert len(reader) == 1
+    reader.refresh()
+    assert reader.find("image_name", "b.jpg")["len_wm"] == 1071
+    reader.close()
+
+
+def test_append_many_matches_single_appends(store, tmp_path):
+    """Test that a batch append writes the same records and offsets as one append per event"""
+    events = [("embed", {"image_name": "a.jpg", "uuid": "uuid-1", "len_wm": 476}),
+              ("extract", {"image_name": "a.jpg", "content": "text"})]
+    single = WatermarkEventStore(str(tmp_path / "single.jsonl"))
+    expected = [single.append(event_type, **fields) for event_type, fields in events]
+    single.close()
+
+    assert store.append_many(events) == expected
+    reader = WatermarkEventReader(store.path)
+    assert [event["event"] for event in reader] == ["embed", "extract"]
+    assert reader.offset(1) == expected[1]
+    reader.close()
+
+
+def _append_events(path, writer, count):
+    store = WatermarkEventStore(path)
+    for i in range(count):
+        add_embed(store, f"{writer}-{i}.jpg", f"uuid-{writer}-{i}", 476)
+    store.close()
+
+
+def test_two_writers_share_a_store(tmp_path):
+    """Test that the offsets stay correct when another writer appended in between or at the same time"""
+    import multiprocessing
+
+    path = str(tmp_path / "events.jsonl")
+    first, second = WatermarkEventStore(path), WatermarkEventStore(path)
+    offsets = [add_embed(first, "a.jpg", "uuid-1", 476), add_embed(second, "b.jpg", "uuid-2", 476),
+               add_embed(first, "c.jpg", "uuid-3", 476)]
+    first.close()
+    second.close()
+
+    processes = [multiprocessing.Process(target=_append_events, args=(path, writer, 200)) for writer in ("x", "y")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    reader = WatermarkEventReader(path)
+    assert len(reader) == 403
+    assert [reader.offset(i) for i in range(3)] == offsets and len(set(offsets)) == 3
+    assert [reader[i]["image_name"] for i in range(3)] == ["a.jpg", "b.jpg", "c.jpg"]
+    with open(path, 'rb') as data_file:
+        lines = data_file.read().splitlines(keepends=True)
+    assert [reader[i]["uuid"] for i in range(len(reader))] == [json.loads(line)["uuid"] for line in lines]
+    reader.close()
+
+
+def test_store_repairs_interrupted_append(tmp_path):
+    """Test that reopening drops a partial record and rebuilds a stale offset index"""
+    path = str(tmp_path / "events.jsonl")
+    store = WatermarkEventStore(path)
+    add_embed(store, "a.jpg", "uuid-1", 1063)
+    store.close()
+    with open(path, "ab") as data_file:
+        data_file.write(b'{"event":"embed","image_name":"b.j')  # Crash in the middle of a write
+
+    store = WatermarkEventStore(path)
+    add_embed(store, "c.jpg", "uuid-3", 1071)
+    store.close()
+
+    reader = WatermarkEventReader(path)
+    assert [event["image_name"] for event in reader] == ["a.jpg", "c.jpg"]
+    reader.close()
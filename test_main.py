@@ -1,6 +1,9 @@
 import sys
+import json
 import pytest
+import logging
 import os
+from concurrent.futures import Future
 from unittest.mock import patch
 import main
 
@@ -14,21 +17,26 @@ WATERMARKED_DIR = main.WATERMARKED_DIR
 
 
 # Test for embed_workflow
-@patch("main.embed_watermark")
-@patch("main.os.listdir", return_value=["test_image1.jpg", "test_image2.png"])
+@patch("main.log_watermark")
+@patch("main.embed_watermark_record")
+@patch("main.iter_images", return_value=iter(["test_image1.jpg", "test_image2.png"]))
 @patch("main.os.makedirs")  # Mock os.makedirs to prevent actual directory creation
-def test_embed_workflow(mock_makedirs, mock_listdir, mock_embed_watermark):
+def test_embed_workflow(mock_makedirs, mock_iter_images, mock_embed_record, mock_log_watermark):
     """Test embedding watermarks for images in the originals directory."""
     
-    # Mock the behavior of embed_watermark to return a fake watermark length
-    mock_embed_watermark.side_effect = [1063, 2048]  # Assume lengths for two images
+    # Mock the behavior of embed_watermark_record to return records with fake watermark lengths
+    mock_embed_record.side_effect = [
+        {"image_name": "test_image1.jpg", "len_wm": 1063},
+        {"image_name": "test_image2.png", "len_wm": 2048},
+    ]  # Assume lengths for two images
     
     # Run the embed_workflow function
     main.embed_workflow()
     
-    # Check if embed_watermark was called for both images
-    mock_embed_watermark.assert_any_call("test_image1.jpg", ORIGINALS_DIR, WATERMARKED_DIR)
-    mock_embed_watermark.assert_any_call("test_image2.png", ORIGINALS_DIR, WATERMARKED_DIR)
+    # Check if embed_watermark_record was called for both images and both records were logged
+    mock_embed_record.assert_any_call("test_image1.jpg", ORIGINALS_DIR, WATERMARKED_DIR, None)
+    mock_embed_record.assert_any_call("test_image2.png", ORIGINALS_DIR, WATERMARKED_DIR, None)
+    assert mock_log_watermark.call_count == 2
     
     # Check if the watermark lengths were stored correctly
     assert "test_image1.jpg" in main.watermark_lengths
@@ -36,27 +44,134 @@ def test_embed_workflow(mock_makedirs, mock_listdir, mock_embed_watermark):
     assert main.watermark_lengths["test_image2.png"] == 2048
 
 
+# Test for incremental embed_workflow
+@patch("main.log_watermark")
+@patch("main.embed_watermark_record")
+@patch("main.get_registry")
+def test_embed_workflow_incremental(mock_get_registry, mock_embed_record, mock_log_watermark, tmp_path):
+    """Test that an incremental run skips up-to-date originals and checkpoints new ones."""
+    from registry import WatermarkRegistry
+
+    originals_dir, watermarked_dir = tmp_path / "originals", tmp_path / "watermarked"
+    originals_dir.mkdir()
+    watermarked_dir.mkdir()
+    for name in ("done.jpg", "touched.jpg", "changed.jpg", "new.jpg"):
+        (originals_dir / name).write_bytes(name.encode())
+        (watermarked_dir / f"watermarked_{name}").write_bytes(b"output")
+
+    registry = WatermarkRegistry(str(tmp_path / "registry.db"))
+    mock_get_registry.return_value = registry
+    for name in ("done.jpg", "touched.jpg", "changed.jpg"):
+        path = str(originals_dir / name)
+        stat = os.stat(path)
+        registry.set_embed_state(path, main.generate_image_hash(path), str(watermarked_dir / f"watermarked_{name}"),
+                                 stat.st_mtime, stat.st_size)
+    os.utime(originals_dir / "touched.jpg", (0, 0))  # Same content, new modification time
+    (originals_dir / "changed.jpg").write_bytes(b"new content")
+
+    mock_embed_record.side_effect = lambda name, originals, watermarked, encoding: {
+        "image_name": name, "len_wm": 1063, "image_hash": "new_hash"}
+
+    with patch("main.ORIGINALS_DIR", str(originals_dir)), patch("main.WATERMARKED_DIR", str(watermarked_dir)):
+        main.embed_workflow(incremental=True)
+
+    embedded = sorted(call.args[0] for call in mock_embed_record.call_args_list)
+    assert embedded == ["changed.jpg", "new.jpg"]
+    assert registry.get_embed_state(str(originals_dir / "new.jpg"))["image_hash"] == "new_hash"
+    assert registry.get_embed_state(str(originals_dir / "touched.jpg"))["mtime"] == 0
+
+    # A new output format makes every checkpoint stale, although the outputs of the old format exist
+    from utils import EncodeOptions
+    mock_embed_record.reset_mock()
+    with patch("main.ORIGINALS_DIR", str(originals_dir)), patch("main.WATERMARKED_DIR", str(watermarked_dir)):
+        main.embed_workflow(incremental=True, encoding=EncodeOptions("webp"))
+
+    assert sorted(call.args[0] for call in mock_embed_record.call_args_list) == sorted(
+        ["done.jpg", "touched.jpg", "changed.jpg", "new.jpg"])
+    assert registry.get_embed_state(str(originals_dir / "done.jpg"))["output_path"] == \
+        str(watermarked_dir / "watermarked_done.webp")
+    registry.close()
+
+
 # Test for extract_workflow
 @patch("main.extract_watermark")
-@patch("main.get_len_wm_from_log")
-@patch("main.os.listdir", return_value=["watermarked_test_image1.jpg", "watermarked_test_image2.png"])
+@patch("main.WatermarkLogCache")
+@patch("main.iter_images", return_value=iter(["watermarked_test_image1.jpg", "watermarked_test_image2.png"]))
 @patch("main.os.makedirs")  # Mock os.makedirs to prevent actual directory creation
-def test_extract_workflow(mock_makedirs, mock_listdir, mock_get_len_wm_from_log, mock_extract_watermark):
+def test_extract_workflow(mock_makedirs, mock_iter_images, mock_log_cache_class, mock_extract_watermark):
     """Test extracting watermarks from watermarked images."""
-    
-    # Mock the behavior of get_len_wm_from_log to return lengths for images
-    mock_get_len_wm_from_log.side_effect = [1063, None]  # Return length for the first image, None for the second
-    
+    mock_log_cache = mock_log_cache_class.return_value
+    mock_extract_watermark.return_value = ("extracted", True)
+
     # Run the extract_workflow function
     main.extract_workflow()
     
-    # Check if extract_watermark was called only for the first image (since the second has no length)
-    mock_extract_watermark.assert_called_once_with("test_image1.jpg", 1063, WATERMARKED_DIR)
-    
-    # Ensure warning message for the second image (with no watermark length) was printed
-    assert mock_get_len_wm_from_log.call_count == 2
-    mock_get_len_wm_from_log.assert_any_call("test_image1.jpg")
-    mock_get_len_wm_from_log.assert_any_call("test_image2.png")
+    # The log is parsed once for the whole batch
+    mock_log_cache_class.assert_called_once_with()
+
+    # Every image is extracted from its self-describing payload, without a len_wm lookup
+    mock_extract_watermark.assert_any_call("test_image1.jpg", None, WATERMARKED_DIR, log_cache=mock_log_cache,
+                                           screening=None)
+    mock_extract_watermark.assert_any_call("test_image2.png", None, WATERMARKED_DIR, log_cache=mock_log_cache,
+                                           screening=None)
+    mock_log_cache.get_len_wm.assert_not_called()
+
+# Test for an undecodable file next to a valid one
+@patch("main.WatermarkLogCache")
+@patch("utils.log_extraction")
+@patch("utils.debug_logger")
+def test_extract_workflow_skips_undecodable_files(mock_logger, mock_log_extraction, mock_log_cache_class, tmp_path):
+    """Test that a corrupt file neither stops the extract run nor the perceptual match of the others."""
+    import cv2
+    from benchmark import make_synthetic_image
+
+    cv2.imwrite(str(tmp_path / "watermarked_plain.png"), make_synthetic_image(320, 240))
+    (tmp_path / "watermarked_broken.jpg").write_bytes(b"not an image")
+    mock_log_cache_class.return_value.get_len_wm.return_value = None
+
+    with patch("main.WATERMARKED_DIR", str(tmp_path)), patch("utils.get_registry") as mock_get_registry, \
+            patch.object(logging.getLogger("debug"), "debug") as mock_debug:
+        mock_get_registry.return_value.find_similar.return_value = []
+        main.extract_workflow()
+
+    # The valid file reached the perceptual match, whichever order the files were found in
+    mock_get_registry.return_value.find_similar.assert_called_once()
+    assert "watermarked_broken.jpg" in mock_debug.call_args.args[0]
+
+
+# Test for verify_workflow
+@patch("main.record_extraction", side_effect=lambda name, text, log_cache: ("log", "uuid-bad" not in text))
+@patch("main.verify_watermark_file")
+@patch("main.WatermarkLogCache")
+@patch("main.iter_images", return_value=iter(["watermarked_a.jpg", os.path.join("sub", "watermarked_b.jpg"), "c.jpg"]))
+def test_verify_workflow(mock_iter_images, mock_log_cache_class, mock_verify_file, mock_record_extraction, tmp_path):
+    """Test that verify writes one report row per image, with unreadable images reported instead of failing"""
+    mock_log_cache = mock_log_cache_class.return_value
+    mock_log_cache.get_len_wm.side_effect = lambda name: 1063 if name == "c.jpg" else None
+    mock_verify_file.side_effect = [
+        {"text": "UUID=uuid-a Folder=#00000001 Version=2 Confidence=0.97", "error": None, "seconds": 0.2},
+        {"text": "UUID=uuid-bad Folder=#00000001 Version=2 Confidence=0.50", "error": None, "seconds": 0.3},
+        {"text": None, "error": "Payload CRC mismatch", "seconds": 0.1},
+    ]
+    report_path = str(tmp_path / "report.jsonl")
+
+    report = main.verify_workflow(root=str(tmp_path), report_path=report_path)
+
+    with open(report_path) as report_file:
+        rows = [json.loads(line) for line in report_file]
+    assert [(row["file"], row["uuid"], row["valid"], row["confidence"]) for row in rows] == [
+        ("watermarked_a.jpg", "uuid-a", True, 0.97),
+        ("sub/watermarked_b.jpg", "uuid-bad", False, 0.5),
+        ("c.jpg", None, None, None),
+    ]
+    assert rows[2]["error"] == "Payload CRC mismatch"
+    assert report.counts == {"valid": 1, "invalid": 1, "unreadable": 1}
+
+    # Files are read from the verified tree; older watermarks get their recorded len_wm
+    mock_verify_file.assert_any_call(os.path.join(str(tmp_path), "watermarked_a.jpg"), None)
+    mock_verify_file.assert_any_call(os.path.join(str(tmp_path), "c.jpg"), 1063)
+    mock_record_extraction.assert_any_call(os.path.join("sub", "b.jpg"),
+                                           "UUID=uuid-bad Folder=#00000001 Version=2 Confidence=0.50", mock_log_cache)
 
 # Use caplog to capture log output
 @patch("sys.exit")
@@ -70,7 +185,7 @@ def test_invalid_mode(mock_sys_exit, caplog):
     mock_sys_exit.assert_called_once_with(1)
     
     # Check if the correct error message was logged
-    assert "Invalid mode. Use 'embed' or 'extract'." in caplog.text
+    assert "Invalid mode. Use 'embed', 'extract', 'verify', 'watch' or 'serve'." in caplog.text
 
     
 # Test for valid embed mode
@@ -97,4 +212,168 @@ def test_valid_extract_mode(mock_sys_exit, mock_extract_workflow):
 
         # Ensure that extract_workflow was called
         mock_extract_workflow.assert_called_once()
-        mock_sys_exit.assert_not_called()
\ No newline at end of file
+        mock_sys_exit.assert_not_called()
+
+# Test for the process-pool embed_workflow
+@patch("main.log_watermark")
+@patch("main.embed_watermark_record")
+@patch("main.ProcessPoolExecutor")
+@patch("main.iter_images", return_value=iter(["test_image1.jpg", "test_image2.png", "sub/test_image3.jpg"]))
+def test_embed_workflow_workers(mock_iter_images, mock_executor_class, mock_embed_record, mock_log_watermark):
+    """Test that parallel embedding logs every record in the parent, in discovery order."""
+    def submit(func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    mock_executor_class.return_value.__enter__.return_value.submit.side_effect = submit
+    mock_embed_record.side_effect = lambda name, originals_dir, watermarked_dir, encoding: {"image_name": name, "len_wm": len(name)}
+
+    main.embed_workflow(workers=4)
+
+    mock_executor_class.assert_called_once_with(max_workers=4)
+    logged = [call.kwargs["image_name"] for call in mock_log_watermark.call_args_list]
+    assert logged == ["test_image1.jpg", "test_image2.png", "sub/test_image3.jpg"]
+    assert main.watermark_lengths["test_image2.png"] == len("test_image2.png")
+
+
+# Test for valid embed mode with a worker count
+@patch("main.embed_workflow")
+def test_embed_mode_with_workers(mock_embed_workflow):
+    """Test that --workers is passed through to embed_workflow."""
+    with patch.object(sys, 'argv', ["main.py", "embed", "--workers", "3"]):
+        main.main()
+
+    assert mock_embed_workflow.call_args.kwargs["workers"] == 3
+
+
+
+# Test for the output encoding options
+@patch("main.embed_workflow")
+def test_embed_mode_with_encoding_options(mock_embed_workflow):
+    """Test that --format, --quality and --png-compression reach embed_workflow and are validated."""
+    from utils import EncodeOptions
+
+    with patch.object(sys, 'argv', ["main.py", "embed", "--format", "webp", "--quality", "80"]):
+        main.main()
+    assert mock_embed_workflow.call_args.kwargs["encoding"] == EncodeOptions(".webp", 80)
+
+    with patch.object(sys, 'argv', ["main.py", "embed"]):
+        main.main()
+    assert mock_embed_workflow.call_args.kwargs["encoding"] is None
+
+    for option in (["--quality", "120"], ["--png-compression", "10"], ["--format", "gif"]):
+        with pytest.raises(SystemExit):
+            main.parse_args(["embed"] + option)
+
+
+# Test for the watch mode
+@pytest.mark.parametrize("polling", [True, False])
+@patch("main.warm_up")
+@patch("main.log_watermark")
+@patch("main.embed_watermark_record")
+@patch("main.get_registry")
+def test_watch_workflow_embeds_new_files(mock_get_registry, mock_embed_record, mock_log_watermark, mock_warm_up,
+                                         polling, tmp_path):
+    """Test that the watch mode embeds the backlog and files that arrive later, once they stop changing."""
+    import threading
+    import time
+    from registry import WatermarkRegistry
+
+    originals_dir, watermarked_dir = tmp_path / "originals", tmp_path / "watermarked"
+    originals_dir.mkdir()
+    watermarked_dir.mkdir()
+    (originals_dir / "backlog.jpg").write_bytes(b"old")
+    registry = WatermarkRegistry(str(tmp_path / "registry.db"))
+    mock_get_registry.return_value = registry
+    mock_embed_record.side_effect = lambda name, originals, watermarked, encoding: {
+        "image_name": name, "len_wm": 1063, "image_hash": "hash"}
+
+    stop = threading.Event()
+    with patch("main.ORIGINALS_DIR", str(originals_dir)), patch("main.WATERMARKED_DIR", str(watermarked_dir)):
+        thread = threading.Thread(target=main.watch_workflow,
+                                  kwargs={"debounce": 0.1, "polling": polling, "poll_interval": 0.1, "stop": stop})
+        thread.start()
+        try:
+            time.sleep(0.3)
+            (originals_dir / "sub").mkdir()
+            (originals_dir / "sub" / "new.PNG").write_bytes(b"new")
+            (originals_dir / "notes.txt").write_bytes(b"text")
+            deadline = time.monotonic() + 5
+            while mock_embed_record.call_count < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+
+    embedded = sorted(call.args[0] for call in mock_embed_record.call_args_list)
+    assert embedded == ["backlog.jpg", os.path.join("sub", "new.PNG")]
+    assert registry.get_embed_state(str(originals_dir / "sub" / "new.PNG")) is not None
+    mock_warm_up.assert_called_once_with()
+    registry.close()
+
+
+# Test for the bounded submission window of the watch mode
+@patch("main.log_watermark")
+@patch("main.ProcessPoolExecutor")
+@patch("main.get_registry")
+def test_watch_workflow_bounds_in_flight_embeds(mock_get_registry, mock_executor_class, mock_log_watermark, tmp_path):
+    """Test that a large backlog is submitted a window at a time and that vanished originals are skipped."""
+    import threading
+    import time
+    from concurrent.futures import Future
+    from registry import WatermarkRegistry
+
+    originals_dir = tmp_path / "originals"
+    originals_dir.mkdir()
+    for i in range(10):
+        (originals_dir / f"image{i}.jpg").write_bytes(b"image")
+    registry = WatermarkRegistry(str(tmp_path / "registry.db"))
+    mock_get_registry.return_value = registry
+
+    stop, pending, most_in_flight = threading.Event(), [], []
+
+    def submit(func, image_name, *args):
+        if image_name == "image0.jpg":  # Deleted by the time the next one is submitted
+            (originals_dir / "image1.jpg").unlink()
+        future = Future()
+        pending.append((future, image_name))
+        most_in_flight.append(sum(not future.done() for future, _ in pending))
+        return future
+
+    def finish_embeds():
+        # Complete the submitted embeds one by one, as the pool would, until all are logged (or time runs out)
+        deadline = time.monotonic() + 5
+        while mock_log_watermark.call_count < 9 and time.monotonic() < deadline:
+            for future, image_name in pending:
+                if not future.done():
+                    future.set_result({"image_name": image_name, "len_wm": 476, "image_hash": "hash"})
+                    break
+            time.sleep(0.01)
+        stop.set()
+
+    mock_executor_class.return_value.submit.side_effect = submit
+    finisher = threading.Thread(target=finish_embeds)
+    finisher.start()
+    with patch("main.ORIGINALS_DIR", str(originals_dir)), patch("main.WATERMARKED_DIR", str(tmp_path / "out")):
+        main.watch_workflow(workers=2, debounce=0, polling=True, poll_interval=0.1, stop=stop)
+    finisher.join()
+
+    assert sorted(image_name for _, image_name in pending) == [f"image{i}.jpg" for i in range(10) if i != 1]
+    assert max(most_in_flight) <= 4
+    assert mock_log_watermark.call_count == 9
+    registry.close()
+
+
+# Test for the lazy start-up
+def test_cli_start_up_is_lazy():
+    """Test that importing main loads no heavy modules and that lazy functions pickle as the real ones."""
+    import pickle
+    import subprocess
+    import utils
+
+    probe = "import sys, main; print(sorted(m for m in ('cv2', 'numpy', 'utils', 'logger', 'server') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(main.__file__)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+    assert pickle.loads(pickle.dumps(main.embed_watermark_record)) is utils.embed_watermark_record
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import pytest
+
+# Ensure the project root is included in sys.path before importing metrics
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    """Start every test with metrics disabled and empty."""
+    metrics.disable()
+    metrics.reset()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_timer_is_a_no_op_when_disabled():
+    """Test that nothing is recorded while metrics are disabled"""
+    with metrics.timer("embed.decode"):
+        pass
+    metrics.observe("embed.decode", 1.0)
+
+    assert metrics.summary() == {}
+
+
+def test_histogram_summary_and_exports(tmp_path):
+    """Test the collected histograms and their JSON and Prometheus exports"""
+    metrics.enable()
+    for seconds in (0.002, 0.02, 0.2):
+        metrics.observe("embed.transform", seconds)
+    with metrics.timer("embed.decode"):
+        pass
+
+    summary = metrics.summary()
+    transform = summary["embed.transform"]
+    assert transform["count"] == 3
+    assert transform["sum"] == pytest.approx(0.222)
+    assert transform["min"] == 0.002 and transform["max"] == 0.2
+    assert transform["buckets"]["0.0025"] == 1
+    assert transform["buckets"]["0.25"] == 3
+    assert transform["buckets"]["+Inf"] == 3
+    assert summary["embed.decode"]["count"] == 1
+
+    metrics.write_json(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text())["stages"]["embed.transform"]["count"] == 3
+
+    metrics.write_prometheus(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text()
+    assert "# TYPE watermark_stage_seconds histogram" in text
+    assert 'watermark_stage_seconds_bucket{stage="embed.transform",le="+Inf"} 3' in text
+    assert 'watermark_stage_seconds_count{stage="embed.transform"} 3' in text
+
+
+def time_stage_in_worker(stage, seconds):
+    """Records one duration, as a worker process running an instrumented stage would."""
+    metrics.observe(stage, seconds)
+    return stage
+
+
+def test_worker_timings_are_merged_into_the_parent():
+    """Test that stages timed in a process pool reach the histograms of the parent exactly once"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    metrics.enable()
+    metrics.observe("embed.run", 1.0)  # Inherited by forked workers; must not be counted again
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [metrics.submit(executor, time_stage_in_worker, "embed.decode", seconds) for seconds in (0.002, 0.02, 0.2)]
+        assert [metrics.result(future) for future in futures] == ["embed.decode"] * 3
+
+    summary = metrics.summary()
+    assert summary["embed.run"]["count"] == 1
+    decode = summary["embed.decode"]
+    assert decode["count"] == 3
+    assert decode["sum"] == pytest.approx(0.222)
+    assert decode["min"] == 0.002 and decode["max"] == 0.2
+    assert decode["buckets"]["0.0025"] == 1 and decode["buckets"]["+Inf"] == 3
+
+
+def test_submit_returns_plain_results_when_disabled():
+    """Test that workers return their results unchanged while metrics are disabled"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert metrics.result(metrics.submit(executor, time_stage_in_worker, "embed.decode", 0.1)) == "embed.decode"
+    assert metrics.summary() == {}
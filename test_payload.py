@@ -0,0 +1,67 @@
+import os
+import sys
+import uuid
+import numpy as np
+import pytest
+
+# Ensure the project root is included in sys.path before importing payload
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from payload import (PAYLOAD_BITS, PAYLOAD_SIZE, PAYLOAD_VERSION, WATERMARK_BITS, PayloadError, decode_payload,
+                     decode_payload_bits, encode_payload, encode_payload_bits, folder_id, format_payload)
+from utils import extract_data_from_watermark
+
+
+def test_payload_round_trip():
+    """Test that a payload has a fixed length and decodes to the embedded fields"""
+    image_uuid = uuid.uuid1()
+    data = encode_payload(image_uuid, 1704103200, "a folder with a rather long name")
+
+    assert len(data) == PAYLOAD_SIZE and PAYLOAD_BITS == 8 * PAYLOAD_SIZE
+    assert len(encode_payload(uuid.uuid1(), 0, "")) == PAYLOAD_SIZE
+    assert decode_payload(data) == {"version": PAYLOAD_VERSION, "uuid": image_uuid, "epoch_seconds": 1704103200,
+                                    "folder_id": folder_id("a folder with a rather long name")}
+
+
+def test_payload_errors_are_detected():
+    """Test that flipped bits and wrong lengths are rejected"""
+    data = bytearray(encode_payload(uuid.uuid1(), 1704103200, "originals"))
+    data[5] ^= 0x10
+    with pytest.raises(PayloadError):
+        decode_payload(bytes(data))
+    with pytest.raises(PayloadError):
+        decode_payload(bytes(data[:-1]))
+
+
+def test_payload_bits_are_corrected():
+    """Test that the soft-decision decoder corrects flipped and uncertain bits and reports its confidence"""
+    image_uuid = uuid.uuid1()
+    bits = encode_payload_bits(encode_payload(image_uuid, 1704103200, "originals"))
+    assert bits.size == WATERMARK_BITS
+
+    clean = decode_payload_bits(bits.astype(float))
+    assert clean["uuid"] == image_uuid and clean["confidence"] == 1.0
+
+    # Flip 1 bit in 30 and blur 1 in 10 towards 0.5, as a compressed or resized image would
+    rng = np.random.RandomState(0)
+    soft = bits.astype(float)
+    flipped = rng.choice(bits.size, bits.size // 30, replace=False)
+    soft[flipped] = 1 - soft[flipped]
+    soft[rng.choice(bits.size, bits.size // 10, replace=False)] = rng.uniform(0.4, 0.6, bits.size // 10)
+    noisy = decode_payload_bits(soft)
+    assert noisy["uuid"] == image_uuid and 0 < noisy["confidence"] < 1
+    assert "Confidence=" in format_payload(noisy)
+
+    with pytest.raises(PayloadError):
+        decode_payload_bits(rng.uniform(0, 1, WATERMARK_BITS))
+    with pytest.raises(PayloadError):
+        decode_payload_bits(bits[:PAYLOAD_BITS].astype(float))
+
+
+def test_format_payload_keeps_log_fields():
+    """Test that the formatted payload works with extract_data_from_watermark"""
+    image_uuid = uuid.uuid1()
+    text = format_payload(decode_payload(encode_payload(image_uuid, 1704103200, "originals")))
+
+    assert extract_data_from_watermark(text, "UUID") == str(image_uuid)
+    assert extract_data_from_watermark(text, "Folder") == f"#{folder_id('originals'):08x}"
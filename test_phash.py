@@ -0,0 +1,37 @@
+import os
+import sys
+import cv2
+import numpy as np
+
+# Ensure the project root is included in sys.path before importing phash
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phash import BAND_BITS, band_neighbours, hamming_distance, hash_bands, perceptual_hash
+
+
+def make_image(seed, width=640, height=480):
+    """Smooth random image, closer to a photo than pixel noise."""
+    img = np.random.RandomState(seed).randint(0, 256, (height // 16, width // 16, 3)).astype(np.uint8)
+    return cv2.GaussianBlur(cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC), (9, 9), 0)
+
+
+def test_perceptual_hash_survives_recompression_and_resizing():
+    """Test that altered copies keep a close hash while other pictures do not"""
+    img = make_image(0)
+    original = perceptual_hash(img)
+    jpeg = cv2.imdecode(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 30])[1], cv2.IMREAD_COLOR)
+    resized = cv2.resize(img, (320, 240), interpolation=cv2.INTER_AREA)
+
+    assert len(original) == 16
+    assert hamming_distance(original, perceptual_hash(jpeg)) <= 4
+    assert hamming_distance(original, perceptual_hash(resized)) <= 4
+    assert hamming_distance(original, perceptual_hash(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))) <= 4
+    assert hamming_distance(original, perceptual_hash(make_image(1))) > 16
+
+
+def test_bands_and_neighbours():
+    """Test the split into bands and the band values probed by a lookup"""
+    assert hash_bands("0123456789abcdef") == [0x0123, 0x4567, 0x89ab, 0xcdef]
+    neighbours = band_neighbours(0x00ff, 2)
+    assert len(neighbours) == len(set(neighbours)) == 1 + BAND_BITS + BAND_BITS * (BAND_BITS - 1) // 2
+    assert all(bin(value ^ 0x00ff).count('1') <= 2 for value in neighbours)
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import sys
+import pytest
+
+# Ensure the project root is included in sys.path before importing registry
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from registry import WatermarkRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    """Create a registry in a temporary database."""
+    registry = WatermarkRegistry(str(tmp_path / "registry.db"))
+    yield registry
+    registry.close()
+
+
+def test_get_len_wm_uses_latest_record(registry):
+    """Test that the most recent record for an image wins"""
+    registry.add("test_image.jpg", "uuid-1", "originals", "2024-01-01 10:00:00", 1063, "hash-1")
+    registry.add("test_image.jpg", "uuid-2", "originals", "2024-01-02 10:00:00", 1071, "hash-1")
+
+    assert registry.get_len_wm("test_image.jpg") == 1071
+    assert registry.get_len_wm("missing.jpg") is None
+
+
+def test_has_uuid_and_find_by_hash(registry):
+    """Test UUID validation and lookups by original image hash"""
+    registry.add("test_image.jpg", "uuid-1", "originals", "2024-01-01 10:00:00", 1063, "hash-1")
+
+    assert registry.has_uuid("uuid-1")
+    assert not registry.has_uuid("uuid-2")
+    assert [record["uuid"] for record in registry.find_by_hash("hash-1")] == ["uuid-1"]
+
+
+def test_find_similar_matches_close_perceptual_hashes(registry):
+    """Test the multi-index Hamming lookup of perceptual hashes"""
+    registry.add("a.jpg", "uuid-a", "originals", "2024-01-01 10:00:00", 476, "hash-a", "0123456789abcdef")
+    registry.add("b.jpg", "uuid-b", "originals", "2024-01-01 10:00:01", 476, "hash-b", "0123456789abcdff")
+    registry.add("c.jpg", "uuid-c", "originals", "2024-01-01 10:00:02", 476, "hash-c", "fedcba9876543210")
+    registry.add("d.jpg", "uuid-d", "originals", "2024-01-01 10:00:03", 476, "hash-d")  # No perceptual hash
+
+    # Every band differs from a.jpg by 2 bits, which the band radius of 9 // 4 = 2 still probes
+    matches = registry.find_similar("0120456489a8cdec", max_distance=9)
+    assert [(record["uuid"], record["distance"]) for record in matches] == [("uuid-a", 8), ("uuid-b", 9)]
+    assert [record["uuid"] for record in registry.find_similar("0123456789abcdff", limit=1)] == ["uuid-b"]
+    assert registry.find_similar("0123456789abcdef", max_distance=0)[0]["image_name"] == "a.jpg"
+
+
+def test_older_registry_is_migrated(tmp_path):
+    """Test that a registry created before perceptual hashes gets the new columns"""
+    db_path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE watermarks (id INTEGER PRIMARY KEY AUTOINCREMENT, image_name TEXT NOT NULL, "
+                       "uuid TEXT NOT NULL, folder TEXT, timestamp TEXT, len_wm INTEGER NOT NULL, image_hash TEXT)")
+    connection.execute("INSERT INTO watermarks (image_name, uuid, len_wm) VALUES ('old.jpg', 'uuid-old', 1063)")
+    connection.commit()
+    connection.close()
+
+    registry = WatermarkRegistry(db_path)
+    registry.add("new.jpg", "uuid-new", "originals", "2024-01-01 10:00:00", 476, "hash-new", "0123456789abcdef")
+    assert registry.get_len_wm("old.jpg") == 1063
+    assert [record["uuid"] for record in registry.find_similar("0123456789abcdef")] == ["uuid-new"]
+    registry.close()
+
+
+def test_import_log_is_idempotent(registry, tmp_path):
+    """Test backfilling the registry from an existing watermark log"""
+    log_file = tmp_path / "watermark_log.log"
+    log_file.write_text(
+        "2024-01-01 10:00:00,000 INFO: Image 'a.jpg' was watermarked. UUID=uuid-a, Folder='originals', "
+        "Time=2024-01-01 10:00:00, len_wm=1063, Hash=abc123\n"
+        "2024-01-01 10:00:01,000 INFO: Something unrelated\n"
+        "2024-01-01 10:00:02,000 INFO: Image 'b.png' was watermarked. UUID=uuid-b, Folder='originals', "
+        "Time=2024-01-01 10:00:02, len_wm=1071\n"
+        "2024-01-01 10:00:03,000 INFO: Image 'c.png' was watermarked. UUID=uuid-c, Folder='originals', "
+        "Time=2024-01-01 10:00:03, len_wm=476, Hash=def456, pHash=0123456789abcdef\n"
+    )
+
+    assert registry.import_log(str(log_file)) == 3
+    assert registry.import_log(str(log_file)) == 0
+    assert registry.get_len_wm("a.jpg") == 1063
+    assert registry.get_len_wm("b.png") == 1071
+    assert registry.has_uuid("uuid-b")
+    assert registry.find_similar("0123456789abcdef")[0]["uuid"] == "uuid-c"
@@ -0,0 +1,53 @@
+import csv
+import json
+import os
+import sys
+import pytest
+
+# Ensure the project root is included in sys.path before importing report
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from report import REPORT_FIELDS, VerificationReport
+
+ROWS = [
+    {"file": "a.jpg", "uuid": "uuid-a", "valid": True, "confidence": 0.98, "seconds": 0.12},
+    {"file": "b.jpg", "uuid": "uuid-b", "valid": False, "confidence": 1.0, "seconds": 0.1},
+    {"file": "c.jpg", "seconds": 0.01, "error": "Image data could not be decoded"},
+]
+
+
+def test_csv_report_streams_rows(tmp_path):
+    """Test that CSV rows are on disk as soon as they are written"""
+    path = str(tmp_path / "report.csv")
+    with VerificationReport(path) as report:
+        report.write(ROWS[0])
+        with open(path, newline='') as report_file:
+            assert len(list(csv.DictReader(report_file))) == 1  # Flushed before the report is closed
+        for row in ROWS[1:]:
+            report.write(row)
+
+    with open(path, newline='') as report_file:
+        reader = csv.DictReader(report_file)
+        rows = list(reader)
+    assert tuple(reader.fieldnames) == REPORT_FIELDS
+    assert rows[0]["valid"] == "True" and rows[2]["uuid"] == "" and rows[2]["error"] == ROWS[2]["error"]
+    assert report.counts == {"valid": 1, "invalid": 1, "unreadable": 1}
+    assert report.summary().startswith("3 image(s) verified: 1 valid, 1 invalid, 1 without")
+
+
+def test_json_report_is_json_lines(tmp_path):
+    """Test the JSON Lines format chosen from the file extension"""
+    path = str(tmp_path / "nested" / "report.jsonl")
+    with VerificationReport(path) as report:
+        for row in ROWS:
+            report.write(row)
+
+    with open(path) as report_file:
+        rows = [json.loads(line) for line in report_file]
+    assert report.format == "json"
+    assert rows[0] == {"file": "a.jpg", "uuid": "uuid-a", "valid": True, "confidence": 0.98, "seconds": 0.12,
+                       "error": None}
+    assert rows[2]["valid"] is None
+
+    with pytest.raises(ValueError):
+        VerificationReport(str(tmp_path / "report.txt"), report_format="xml")
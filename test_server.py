@@ -0,0 +1,112 @@
+import asyncio
+import functools
+import json
+import os
+import sys
+import threading
+import http.client
+import cv2
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+# Ensure the project root is included in sys.path before importing server
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server import WatermarkServer
+from utils import warm_up
+
+
+def warm_up_logging_to(log_dir):
+    """Pool initializer: point the worker's log files at log_dir, then warm it up like the server does."""
+    import logger
+    logger.LOG_DIR = log_dir
+    logger.configure_logging()
+    warm_up()
+
+
+@pytest.fixture
+def running_server(tmp_path):
+    """
+    Start a server with one worker on a free port, on an event loop in a background thread. The
+    worker processes write their logs to tmp_path instead of the repository's logs directory.
+    """
+    initializer = patch("server.warm_up", functools.partial(warm_up_logging_to, str(tmp_path)))
+    initializer.start()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def start(**kwargs):
+        server = WatermarkServer(port=0, **kwargs)
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result(timeout=30)
+        servers.append(server)
+        return server, loop
+
+    yield start
+    for server in servers:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(timeout=30)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    initializer.stop()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(server.host, server.port, timeout=30)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+@patch("server.validate_watermark", return_value=True)
+@patch("server.log_extraction")
+@patch("server.log_watermark")
+def test_embed_and_extract_round_trip(mock_log_watermark, mock_log_extraction, mock_validate, running_server):
+    """Test that an image embedded over HTTP can be extracted over HTTP, without files"""
+    server, _ = running_server(workers=1)
+    img = np.random.RandomState(0).randint(0, 256, (512, 512, 3), dtype=np.uint8)
+    original = cv2.imencode('.png', img)[1].tobytes()
+
+    status, headers, watermarked = request(server, "POST", "/embed?name=photo.png&folder=clients", original)
+    assert status == 200
+    assert headers["Content-Type"] == "image/png"
+    record = mock_log_watermark.call_args.kwargs
+    assert record["image_name"] == "photo.png" and record["folder"] == "clients"
+    assert headers["X-Watermark-UUID"] == str(record["uuid"])
+    assert cv2.imdecode(np.frombuffer(watermarked, dtype=np.uint8), cv2.IMREAD_COLOR).shape == img.shape
+
+    status, _, body = request(server, "POST", f"/verify?len_wm={headers['X-Watermark-Length']}", watermarked)
+    result = json.loads(body)
+    assert status == 200
+    assert result["uuid"] == str(record["uuid"])
+    assert result["valid"] is True
+    mock_validate.assert_called_once_with(str(record["uuid"]))
+    mock_log_extraction.assert_called_once()
+
+
+def test_request_errors(running_server):
+    """Test the error statuses for bad requests and undecodable images"""
+    server, _ = running_server(workers=1)
+
+    assert request(server, "GET", "/nothing")[0] == 404
+    assert request(server, "GET", "/embed")[0] == 405
+    assert request(server, "POST", "/embed", b"data")[0] == 400  # No image name
+    assert request(server, "POST", "/embed?name=a.png", b"not an image")[0] == 422
+    assert request(server, "POST", "/embed?name=a.png&compression=10", b"data")[0] == 400
+    assert request(server, "POST", "/embed?name=a.jpg&quality=high", b"data")[0] == 400
+
+
+def test_full_queue_is_refused(running_server):
+    """Test that requests beyond the concurrency and queue limits get 503 instead of waiting"""
+    server, loop = running_server(workers=1, max_concurrency=1, max_queue=0)
+    asyncio.run_coroutine_threadsafe(server._slots.acquire(), loop).result()  # Occupy the only slot
+
+    status, headers, _ = request(server, "POST", "/embed?name=a.png", b"data")
+    assert status == 503
+    assert headers["Retry-After"] == "1"
+    assert json.loads(request(server, "GET", "/health")[2])["rejected"] == 1
+    loop.call_soon_threadsafe(server._slots.release)
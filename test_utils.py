@@ -1,12 +1,14 @@
+import logging
 import os
 import sys
 import pytest
+import numpy as np
 from unittest.mock import patch, MagicMock, mock_open
 
 # Ensure the project root is included in sys.path before importing utils
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils import generate_image_hash, embed_watermark, extract_watermark, extract_data_from_watermark
+from utils import generate_image_hash, hash_image_bytes, embed_watermark, embed_watermark_pipeline, extract_watermark, extract_data_from_watermark
 
 
 # Test for generate_image_hash
@@ -32,45 +34,88 @@ def test_generate_image_hash_md5(mock_file):
     mock_file.assert_called_once_with(fake_image_path, 'rb')
 
 
+# Test for hash_image_bytes
+def test_hash_image_bytes_matches_file_hash():
+    """Test that hashing an in-memory buffer matches hashing the file"""
+    assert hash_image_bytes(b"fake image data", 'sha256') == "5b3397652358a6663a0225ee76466d4e4fd6c58d484d1aa25170bb617d6bb086"
+    assert hash_image_bytes(b"fake image data", 'md5') == "c72d040ee1fdcd8bce09fc8b6e6c4794"
+
+
 # Test for embed_watermark
-@patch("utils.WaterMark")
+@patch("utils.cv2")
+@patch("utils.get_default_engine")
 @patch("utils.log_watermark")
 @patch("utils.debug_logger")
-@patch("utils.generate_image_hash", return_value="fake_image_hash")
-def test_embed_watermark(mock_hash, mock_logger, mock_log_watermark, mock_watermark_class):
+@patch("utils.read_image_bytes", return_value=b"fake image data")
+def test_embed_watermark(mock_read_bytes, mock_logger, mock_log_watermark, mock_get_engine, mock_cv2, tmp_path):
     """Test embedding watermark in an image"""
-    # Mock WaterMark object behavior
-    mock_watermark_instance = mock_watermark_class.return_value
-    mock_watermark_instance.wm_bit = 'fake_watermark_bit_string'
+    # Mock watermark engine behavior
+    mock_engine = mock_get_engine.return_value
+    mock_engine.encode_payload.return_value = 'fake_watermark_bit_string'
+    mock_cv2.imdecode.return_value = np.zeros((64, 64, 3), dtype=np.uint8)
+    mock_cv2.imencode.return_value = (True, np.frombuffer(b"encoded image", dtype=np.uint8))
 
     original_image_name = "test_image.jpg"
     originals_dir = "/path/to/originals"
-    watermarked_dir = "/path/to/watermarked"
+    watermarked_dir = str(tmp_path)
     
     len_wm = embed_watermark(original_image_name, originals_dir, watermarked_dir)
     
+    # Verify the original is read once and the same buffer is decoded and hashed
+    mock_read_bytes.assert_called_once_with(os.path.join(originals_dir, original_image_name))
+    mock_cv2.imdecode.assert_called_once()
+    assert mock_log_watermark.call_args.kwargs["image_hash"] == hash_image_bytes(b"fake image data")
+
     # Verify the watermark is embedded correctly
-    mock_watermark_class.return_value.read_img.assert_called_once_with(
-        os.path.join(originals_dir, original_image_name)
-    )
-    mock_watermark_class.return_value.read_wm.assert_called_once()
-    mock_watermark_class.return_value.embed.assert_called_once()
+    mock_engine.encode_payload.assert_called_once()
+    mock_engine.embed.assert_called_once_with(mock_cv2.imdecode.return_value, 'fake_watermark_bit_string')
+    mock_cv2.imencode.assert_called_once_with(".jpg", mock_engine.embed.return_value, [])
+    with open(os.path.join(watermarked_dir, f"watermarked_{original_image_name}"), 'rb') as output_file:
+        assert output_file.read() == b"encoded image"
     mock_log_watermark.assert_called_once()
     
     # Ensure the length of the watermark bit string is returned
-    assert len_wm == len(mock_watermark_instance.wm_bit)
+    assert len_wm == len('fake_watermark_bit_string')
+
+
+# Test for the staged embedding pipeline
+@patch("utils.save_watermarked_image", side_effect=lambda job: {"image_name": job["image_name"]})
+@patch("utils.apply_watermark", side_effect=lambda job: job)
+@patch("utils.read_original_image", side_effect=lambda name, originals_dir, watermarked_dir, encoding: {"image_name": name})
+def test_embed_watermark_pipeline_preserves_order(mock_read, mock_apply, mock_save):
+    """Test that the pipeline runs every stage and yields records in input order"""
+    image_names = [f"image_{i}.jpg" for i in range(10)]
+
+    records = list(embed_watermark_pipeline(image_names, "/path/to/originals", "/path/to/watermarked", queue_depth=2))
+
+    assert [record["image_name"] for record in records] == image_names
+    assert mock_apply.call_count == 10
+    assert mock_save.call_count == 10
+
+
+@patch("utils.save_watermarked_image")
+@patch("utils.apply_watermark", side_effect=OSError("disk full"))
+@patch("utils.read_original_image", side_effect=lambda name, originals_dir, watermarked_dir, encoding: {"image_name": name})
+def test_embed_watermark_pipeline_propagates_errors(mock_read, mock_apply, mock_save):
+    """Test that an error in a pipeline stage is raised to the caller"""
+    with pytest.raises(OSError, match="disk full"):
+        list(embed_watermark_pipeline(["a.jpg", "b.jpg"], "/path/to/originals", "/path/to/watermarked"))
+
+    mock_save.assert_not_called()
 
 
 # Test for extract_watermark
-@patch("utils.WaterMark")
+@patch("utils.cv2")
+@patch("utils.get_default_engine")
 @patch("utils.log_extraction")
 @patch("utils.debug_logger")
 @patch("utils.validate_watermark", return_value=True)
-def test_extract_watermark_success(mock_validate, mock_logger, mock_log_extraction, mock_watermark_class):
+def test_extract_watermark_success(mock_validate, mock_logger, mock_log_extraction, mock_get_engine, mock_cv2):
     """Test successful extraction of a watermark from an image"""
-    # Mock WaterMark object behavior
-    mock_watermark_instance = mock_watermark_class.return_value
-    mock_watermark_instance.extract.return_value = "UUID=1234 Folder='test_folder'"
+    # Mock watermark engine behavior
+    mock_engine = mock_get_engine.return_value
+    mock_engine.extract_text.return_value = "UUID=1234 Folder='test_folder'"
+    mock_cv2.imread.return_value = np.zeros((64, 64, 3), dtype=np.uint8)
     
     watermarked_image_name = "watermarked_test_image.jpg"
     watermarked_dir = "/path/to/watermarked"
@@ -79,20 +124,22 @@ def test_extract_watermark_success(mock_validate, mock_logger, mock_log_extracti
     extracted_log, validation_status = extract_watermark(watermarked_image_name, wm_shape, watermarked_dir)
     
     # Verify that the extraction process ran correctly
-    mock_watermark_class.return_value.extract.assert_called_once()
+    mock_engine.extract_text.assert_called_once_with(mock_cv2.imread.return_value, wm_shape)
     mock_log_extraction.assert_called_once()
     
     assert "UUID" in extracted_log
     assert validation_status
 
 
-@patch("utils.WaterMark")
+@patch("utils.cv2")
+@patch("utils.get_default_engine")
 @patch("utils.debug_logger")
-def test_extract_watermark_failure(mock_logger, mock_watermark_class):
+def test_extract_watermark_failure(mock_logger, mock_get_engine, mock_cv2):
     """Test failure in extracting a watermark from an image"""
     # Simulate an exception during extraction
-    mock_watermark_instance = mock_watermark_class.return_value
-    mock_watermark_instance.extract.side_effect = Exception("Extraction error")
+    mock_engine = mock_get_engine.return_value
+    mock_engine.extract_text.side_effect = Exception("Extraction error")
+    mock_cv2.imread.return_value = np.zeros((64, 64, 3), dtype=np.uint8)
     
     watermarked_image_name = "watermarked_test_image.jpg"
     watermarked_dir = "/path/to/watermarked"
@@ -106,6 +153,274 @@ def test_extract_watermark_failure(mock_logger, mock_watermark_class):
     mock_logger.error.assert_called_once_with("Error during extraction: Extraction error")
 
 
+# Test for WatermarkEngine
+def test_watermark_engine_matches_blind_watermark():
+    """Test that the cached engine embeds and extracts exactly like a fresh WaterMark object"""
+    from blind_watermark import WaterMark, bw_notes
+    from utils import WatermarkEngine
+
+    bw_notes.close()
+    img = np.random.RandomState(0).randint(0, 256, size=(200, 240, 3)).astype(np.uint8)
+    text = "UUID=1234 Folder='test_folder'"
+
+    bwm = WaterMark(password_img=1, password_wm=1)
+    bwm.read_img(img=img)
+    bwm.read_wm(text, mode='str')
+    expected = bwm.embed()
+
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    wm_bit = engine.encode_text(text)
+    for _ in range(2):  # The second round runs entirely from the caches
+        assert np.array_equal(engine.embed(img, wm_bit), expected)
+    assert engine.extract_text(expected.astype(np.uint8), wm_bit.size) == \
+        bwm.extract(embed_img=expected.astype(np.uint8), wm_shape=wm_bit.size, mode='str')
+
+
+def test_watermark_engine_batch_matches_single_embed():
+    """Test that the vectorized batch embed is bit-identical to embedding every image on its own"""
+    from utils import WatermarkEngine
+
+    imgs = np.random.RandomState(1).randint(0, 256, size=(3, 201, 243, 3)).astype(np.uint8)  # Odd sizes are padded
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    wm_bits = [engine.encode_text(f"UUID={i}{i}{i}{i} Folder='test_folder'") for i in range(3)]
+
+    batched = engine.embed_batch(imgs, wm_bits)
+
+    for img, wm_bit, embed_img in zip(imgs, wm_bits, batched):
+        assert np.array_equal(engine.embed(img, wm_bit), embed_img)
+
+
+def test_watermark_engine_tiled_matches_whole_image():
+    """Test that strip-by-strip embedding and extraction give the same result as the whole-image transform"""
+    from utils import WatermarkEngine
+
+    img = np.random.RandomState(2).randint(0, 256, size=(301, 243, 3)).astype(np.uint8)
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    wm_bit = engine.encode_text("UUID=1234 Folder='test_folder'")
+
+    expected = np.rint(engine.embed(img, wm_bit)).astype(np.uint8)  # cv2.imwrite rounding
+    tiled = engine.embed_tiled(img.copy(), wm_bit, tile_rows=40)
+
+    assert np.array_equal(tiled, expected)
+    assert np.array_equal(engine.extract_bits_tiled(tiled, wm_bit.size, tile_rows=40),
+                          engine.extract_bits(tiled, wm_bit.size))
+
+
+@patch("utils.cv2")
+@patch("utils.get_default_engine")
+@patch("utils.log_extraction")
+@patch("utils.debug_logger")
+def test_extract_watermark_screening_rejects(mock_logger, mock_log_extraction, mock_get_engine, mock_cv2):
+    """Test that screening skips full extraction for images without watermark energy"""
+    from utils import ScreeningStats
+
+    mock_engine = mock_get_engine.return_value
+    mock_engine.watermark_score.side_effect = [0.02, 0.6]
+    mock_engine.extract_text.return_value = "UUID=1234 Folder='test_folder'"
+    mock_cv2.imread.return_value = np.zeros((64, 64, 3), dtype=np.uint8)
+    screening = ScreeningStats()
+
+    rejected = extract_watermark("plain.jpg", 1063, "/path/to/watermarked", log_cache=MagicMock(), screening=screening)
+    extracted_log, _ = extract_watermark("marked.jpg", 1063, "/path/to/watermarked", log_cache=MagicMock(),
+                                         screening=screening)
+
+    assert rejected == (None, False)
+    assert "UUID=1234" in extracted_log
+    mock_engine.extract_text.assert_called_once()
+    assert (screening.screened, screening.passed, screening.rejected) == (2, 1, 1)
+
+
+def test_watermark_score_separates_marked_images():
+    """Test that the screening score is high for watermarked and low for plain images"""
+    from utils import WatermarkEngine
+
+    img = np.random.RandomState(3).randint(0, 256, size=(256, 256, 3)).astype(np.uint8)
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    wm_bit = engine.encode_text("UUID=1234 Folder='test_folder'")
+    marked = np.rint(engine.embed(img, wm_bit)).astype(np.uint8)
+
+    assert engine.watermark_score(marked, wm_bit.size) > 0.5
+    assert engine.watermark_score(img, wm_bit.size) < 0.1
+
+
+# Test for screening recompressed watermarked images
+@patch("utils.log_extraction")
+@patch("utils.debug_logger")
+def test_extract_watermark_screening_passes_recompressed(mock_logger, mock_log_extraction, tmp_path):
+    """Test that screening lets readable recompressed watermarks through and rejects plain images"""
+    import cv2
+    from utils import ScreeningStats, get_default_engine
+    from benchmark import make_synthetic_image, SAMPLE_PAYLOAD
+    from payload import decode_payload
+
+    engine = get_default_engine()
+    img = make_synthetic_image(640, 480, seed=7)
+    marked = np.clip(np.rint(engine.embed(img, engine.encode_payload(SAMPLE_PAYLOAD))), 0, 255).astype(np.uint8)
+    cv2.imwrite(str(tmp_path / "watermarked_q60.jpg"), marked, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    cv2.imwrite(str(tmp_path / "watermarked_plain.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    screening = ScreeningStats()
+
+    extracted_log, _ = extract_watermark("watermarked_q60.jpg", None, str(tmp_path), log_cache=MagicMock(),
+                                         screening=screening)
+    rejected = extract_watermark("watermarked_plain.jpg", None, str(tmp_path),
+                                 log_cache=MagicMock(get_len_wm=MagicMock(return_value=None)), screening=screening)
+
+    assert f"UUID={decode_payload(SAMPLE_PAYLOAD)['uuid']}" in extracted_log
+    assert rejected == (None, False)
+    assert (screening.passed, screening.rejected) == (1, 1)
+
+
+# Test for the in-memory embed and extract API
+@patch("utils.validate_watermark", return_value=True)
+@patch("utils.log_extraction")
+@patch("utils.log_watermark")
+@patch("utils.debug_logger")
+def test_embed_and_extract_buffer_round_trip(mock_logger, mock_log_watermark, mock_log_extraction, mock_validate):
+    """Test that encoded bytes and arrays are watermarked and extracted without touching the disk"""
+    import cv2
+    from utils import embed_watermark_buffer, extract_watermark_buffer
+
+    img = np.random.RandomState(4).randint(0, 256, size=(512, 512, 3)).astype(np.uint8)
+    encoded = cv2.imencode('.png', img)[1].tobytes()
+
+    watermarked, len_wm = embed_watermark_buffer(encoded, "photo.png", folder="uploads")
+    record = mock_log_watermark.call_args.kwargs
+    assert isinstance(watermarked, bytes) and watermarked.startswith(b"\x89PNG")
+    assert record["image_hash"] == hash_image_bytes(encoded)
+    assert record["folder"] == "uploads" and record["len_wm"] == len_wm
+
+    extracted_log, validation_status = extract_watermark_buffer(watermarked, len_wm, image_name="photo.png")
+    assert f"UUID={record['uuid']}" in extracted_log
+    assert validation_status
+    mock_validate.assert_called_once_with(str(record["uuid"]))
+    assert mock_log_extraction.call_args.args[0] == "photo.png"
+
+    # Arrays in, arrays out; the quality option applies when an output format is requested
+    marked_array, len_wm = embed_watermark_buffer(img, "photo.png")
+    assert marked_array.dtype == np.uint8 and marked_array.shape == img.shape
+    assert f"UUID={mock_log_watermark.call_args.kwargs['uuid']}" in extract_watermark_buffer(marked_array, len_wm)[0]
+    low, _ = embed_watermark_buffer(img, "photo.jpg", ext=".jpg", quality=50)
+    high, _ = embed_watermark_buffer(img, "photo.jpg", ext=".jpg", quality=95)
+    assert len(low) < len(high)
+    smooth = np.tile(np.arange(512, dtype=np.uint8)[:, None, None], (1, 512, 3))
+    fast, _ = embed_watermark_buffer(smooth, "photo.png", ext=".png", compression=0)
+    small, _ = embed_watermark_buffer(smooth, "photo.png", ext=".png", compression=9)
+    assert len(small) < len(fast)
+
+    # Grayscale input, decoded or encoded, is watermarked in BGR; other channel counts are refused upfront
+    gray = img[..., 0]
+    marked_gray, _ = embed_watermark_buffer(gray, "gray.png")
+    assert marked_gray.shape == img.shape
+    encoded_gray, len_wm = embed_watermark_buffer(cv2.imencode('.png', gray)[1].tobytes(), "gray.png")
+    assert f"UUID={mock_log_watermark.call_args.kwargs['uuid']}" in extract_watermark_buffer(encoded_gray, len_wm)[0]
+    with pytest.raises(ValueError):
+        embed_watermark_buffer(img[..., :2], "two_channels.png")
+
+
+
+# Test for the output format and encoder settings
+@patch("utils.log_watermark")
+@patch("utils.debug_logger")
+def test_embed_watermark_record_output_encoding(mock_logger, mock_log_watermark, tmp_path):
+    """Test that EncodeOptions change the output format and settings and that the watermark survives them"""
+    import cv2
+    from utils import EncodeOptions, embed_watermark_record, encode_image, extract_watermark_text
+
+    originals, watermarked = tmp_path / "originals", tmp_path / "watermarked"
+    originals.mkdir()
+    # Large enough that WebP's losses leave several copies of every payload bit
+    img = np.random.RandomState(6).randint(0, 256, size=(512, 512, 3)).astype(np.uint8)
+    cv2.imwrite(str(originals / "photo.png"), img)
+
+    record = embed_watermark_record("photo.png", str(originals), str(watermarked), EncodeOptions("WEBP", quality=90))
+    output = watermarked / "watermarked_photo.webp"
+    assert output.read_bytes()[8:12] == b"WEBP" and not (watermarked / "watermarked_photo.png").exists()
+    assert f"UUID={record['uuid']}" in extract_watermark_text("watermarked_photo.webp", None, str(watermarked))
+
+    assert EncodeOptions("jpeg") == EncodeOptions(".jpg")
+    gradient = np.tile(np.arange(256, dtype=np.uint8), (256, 1))
+    assert len(encode_image(gradient, ".png", compression=0)) > len(encode_image(gradient, ".png", compression=9))
+    # Float images are rounded and clipped like cv2.imwrite does
+    floats = np.array([[[-3.2, 0.4, 127.6], [254.5, 255.7, 300.0]]])
+    assert cv2.imdecode(np.frombuffer(encode_image(floats, ".png"), np.uint8), cv2.IMREAD_UNCHANGED).tolist() == \
+        [[[0, 0, 128], [254, 255, 255]]]
+
+    import metrics
+    metrics.enable()
+    try:
+        encode_image(gradient, ".JPEG", quality=80)
+        encode_image(gradient, "jpg")
+        assert metrics.summary()["embed.encode.jpg"]["count"] == 2 and "embed.encode.jpeg" not in metrics.summary()
+    finally:
+        metrics.disable()
+        metrics.reset()
+    for options in ({"format": "gif"}, {"quality": 101}, {"compression": -1}):
+        with pytest.raises(ValueError):
+            EncodeOptions(**options)
+
+
+# Test for the fixed-length payload and the fallback for older text watermarks
+@patch("utils.log_extraction")
+@patch("utils.debug_logger")
+def test_extract_watermark_reads_payload_and_legacy_text(mock_logger, mock_log_extraction, tmp_path):
+    """Test that payloads need no len_wm and that older watermarks fall back to the recorded len_wm"""
+    import cv2
+    import uuid
+    from payload import PAYLOAD_BITS, WATERMARK_BITS, encode_payload
+    from utils import get_default_engine, prepare_watermark
+
+    engine = get_default_engine()
+    img = np.random.RandomState(6).randint(0, 256, size=(256, 256, 3)).astype(np.uint8)
+    job = prepare_watermark({"image_name": "new.png", "folder": "shoot", "img": img})
+    assert job["record"]["len_wm"] == WATERMARK_BITS
+    cv2.imwrite(str(tmp_path / "watermarked_new.png"), engine.embed(img, job["wm_bit"]))
+    legacy_text = "[2024-01-01 10:00:00] [WATERMARK EMBED] UUID=1234 Folder='old'"
+    legacy_bits = engine.encode_text(legacy_text)
+    cv2.imwrite(str(tmp_path / "watermarked_old.png"), engine.embed(np.vstack([img, img]), legacy_bits))
+    v1_uuid = uuid.uuid1()  # Payloads embedded without error correction
+    cv2.imwrite(str(tmp_path / "watermarked_v1.png"),
+                engine.embed(img, engine.encode_bytes(encode_payload(v1_uuid, 1704103200, "shoot"))))
+
+    log_cache = MagicMock()
+    log_cache.get_len_wm.side_effect = {"old.png": legacy_bits.size, "v1.png": PAYLOAD_BITS}.get
+    extracted_log, _ = extract_watermark("new.png", None, str(tmp_path), log_cache=log_cache)
+    assert f"UUID={job['record']['uuid']}" in extracted_log
+    log_cache.get_len_wm.assert_not_called()
+
+    extracted_log, _ = extract_watermark("old.png", None, str(tmp_path), log_cache=log_cache)
+    assert extracted_log.endswith(legacy_text)
+    log_cache.get_len_wm.assert_called_once_with("old.png")
+
+    extracted_log, _ = extract_watermark("v1.png", None, str(tmp_path), log_cache=log_cache)
+    assert f"UUID={v1_uuid}" in extracted_log
+
+
+# Test for worker-side extraction and parent-side logging
+@patch("utils.log_extraction")
+@patch("utils.debug_logger")
+def test_extract_watermark_text_then_record_extraction(mock_logger, mock_log_extraction, tmp_path):
+    """Test that text extracted without side effects is logged and validated by record_extraction"""
+    import cv2
+    from utils import WatermarkEngine, extract_watermark_text, record_extraction
+
+    engine = WatermarkEngine(password_img=1, password_wm=1)
+    text = "UUID=1234 Folder='test_folder'"
+    wm_bit = engine.encode_text(text)
+    img = np.random.RandomState(5).randint(0, 256, size=(256, 256, 3)).astype(np.uint8)
+    cv2.imwrite(str(tmp_path / "watermarked_a.png"), engine.embed(img, wm_bit))
+
+    extracted = extract_watermark_text("a.png", wm_bit.size, str(tmp_path))
+    assert extracted == text
+    mock_log_extraction.assert_not_called()
+
+    log_cache = MagicMock()
+    log_cache.validate.return_value = True
+    extracted_log, validation_status = record_extraction("a.png", extracted, log_cache)
+    assert extracted_log.endswith(text) and validation_status
+    log_cache.validate.assert_called_once_with("1234")
+    mock_log_extraction.assert_called_once()
+
+
 # Test for extract_data_from_watermark
 def test_extract_data_from_watermark_uuid():
     """Test extracting UUID from a watermark text"""
@@ -126,4 +441,83 @@ def test_extract_data_from_watermark_invalid():
     watermark_text = "UUID=1234 Folder='test_folder'"
     extracted_time = extract_data_from_watermark(watermark_text, "Time")
     
-    assert extracted_time is None
\ No newline at end of file
+    assert extracted_time is None
+
+# Test for the in-memory watermark log cache
+def test_watermark_log_cache_tails_new_records(tmp_path):
+    """Test that the log cache parses the log once and then only reads appended records"""
+    from logger import WatermarkLogCache
+
+    log_file = tmp_path / "watermark_log.log"
+    record = ("2024-01-01 10:00:00,000 INFO: Image '{name}' was watermarked. UUID={uuid}, Folder='originals', "
+              "Time=2024-01-01 10:00:00, len_wm={len_wm}, Hash=abc123\n")
+    log_file.write_text(record.format(name="a.jpg", uuid="uuid-a", len_wm=1063))
+
+    log_cache = WatermarkLogCache(str(log_file))
+    assert log_cache.get_len_wm("a.jpg") == 1063
+    assert log_cache.validate("uuid-a")
+    assert not log_cache.validate("uuid-b")
+
+    with open(log_file, "a") as handle:
+        handle.write(record.format(name="b.jpg", uuid="uuid-b", len_wm=1071))
+        handle.write("2024-01-01 10:00:01,000 INFO: Image 'c.jpg' was water")  # Partially written line
+
+    assert log_cache.get_len_wm("b.jpg") == 1071
+    assert log_cache.validate("uuid-b")
+    assert log_cache.get_len_wm("c.jpg") is None
+
+# Test for the asynchronous logging mode
+def test_async_logging_flushes_on_shutdown(tmp_path):
+    """Test that async mode routes each logger to its own file and writes everything, events included, on shutdown"""
+    import threading
+    import logger
+
+    loggers = (logger.watermark_logger, logger.extraction_logger, logger.debug_logger, logger.records_logger)
+    saved = [(log, list(log.handlers), log.level, log.propagate) for log in loggers]
+    stored, console = [], []
+    console_handler = logging.Handler()
+    console_handler.emit = lambda record: console.append((threading.current_thread(), record.getMessage()))
+    logging.getLogger().addHandler(console_handler)
+    try:
+        with patch("logger.LOG_DIR", str(tmp_path)), \
+                patch("logger.store_events", side_effect=lambda events: stored.append((threading.current_thread(), events))):
+            logger.configure_logging()
+            assert list(tmp_path.iterdir()) == []
+            logger.configure_logging(async_logging=True, debug_records=False)
+            assert not logger.debug_logger.propagate
+            for i in range(10):
+                logger.watermark_logger.info(f"record {i}")
+            logger.debug_logger.debug("per-record chatter")
+            for i in range(3):
+                logger.log_watermark(f"image{i}.jpg", f"uuid-{i}", "originals", "2024-01-01 10:00:00", 476, "hash")
+            logger.wait_for_records()  # What lookups do before reading the registry
+            batches = list(stored)
+            logger.shutdown_logging()
+
+        lines = (tmp_path / "watermark_log.log").read_text().splitlines()
+        assert [line.split(": ", 1)[1] for line in lines[:10]] == [f"record {i}" for i in range(10)]
+        assert len(lines) == 13
+        # Files are only created by their first record
+        assert not (tmp_path / "debug_log.log").exists()
+        assert not (tmp_path / "extraction_log.log").exists()
+
+        # Registry and event store writes are committed in batches by the listener thread
+        assert [fields["image_name"] for _, events in batches for _, fields in events] == \
+            ["image0.jpg", "image1.jpg", "image2.jpg"]
+        assert all(thread is not threading.current_thread() for thread, _ in batches)
+
+        # The console output is written by the listener thread too, without the event records
+        assert [message for _, message in console][:10] == [f"record {i}" for i in range(10)]
+        assert len(console) == 13
+        assert all(thread is not threading.current_thread() for thread, _ in console)
+    finally:
+        logger.shutdown_logging()
+        logging.getLogger().removeHandler(console_handler)
+        for log, handlers, level, propagate in saved:
+            for handler in list(log.handlers):
+                log.removeHandler(handler)
+                handler.close()
+            for handler in handlers:
+                log.addHandler(handler)
+            log.setLevel(level)
+            log.propagate = propagate
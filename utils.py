@@ -1,9 +1,43 @@
 import hashlib
 import os
-from blind_watermark import WaterMark
+import queue
+import threading
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from numpy.linalg import svd
+from blind_watermark.bwm_core import one_dim_kmeans, random_strategy1
+from pywt import dwt2, idwt2
 from datetime import datetime
 import uuid
-from logger import log_watermark, log_extraction, debug_logger, validate_watermark
+import metrics
+from phash import MATCH_DISTANCE, perceptual_hash
+from registry import get_registry
+from logger import log_watermark, log_extraction, debug_logger, get_len_wm_from_log, validate_watermark, wait_for_records
+from payload import (PAYLOAD_BITS, WATERMARK_BITS, PayloadError, decode_payload, decode_payload_bits, encode_payload,
+                     encode_payload_bits, folder_id, format_payload)
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# Block size used when hashing files; large reads keep the number of system calls low on network storage
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Images with at least this many pixels are embedded and extracted in strips of TILE_ROWS rows
+TILED_MIN_PIXELS = 40_000_000
+TILE_ROWS = 512
+
+# Formats watermarked images can be written in, as file extensions
+OUTPUT_FORMATS = ('.jpg', '.png', '.webp')
+
+# Images whose WatermarkEngine.watermark_score is below this are rejected by the screening stage.
+# Unwatermarked images score within about 0.05 of 0, watermarked ones above 0.3 even after
+# JPEG/WebP recompression at quality 50
+SCREEN_THRESHOLD = 0.15
 
 def generate_image_hash(image_path, hash_algorithm='sha256'):
     """
@@ -16,95 +50,1050 @@ def generate_image_hash(image_path, hash_algorithm='sha256'):
 
     # Read the image in binary mode and update the hash function with its content
     with open(image_path, 'rb') as img_file:
-        while chunk := img_file.read(8192):  # Read the image in chunks
+        while chunk := img_file.read(HASH_CHUNK_SIZE):  # Read the image in chunks
             hash_func.update(chunk)
     
     # Return the hexadecimal digest of the hash
     return hash_func.hexdigest()
 
-# Utility function to embed a watermark into an image
-def embed_watermark(image_name, originals_dir, watermarked_dir):
+def hash_image_bytes(image_bytes, hash_algorithm='sha256'):
     """
-    Embed a watermark in an image using the original folder name, UUID, and timestamp in a log format.
-    Also generates and logs the hash of the original image.
+    Generate a hash of image data that is already in memory. Gives the same result as
+    generate_image_hash on the file the data was read from.
+    :param image_bytes: Encoded image data (bytes, bytearray or memoryview).
+    :param hash_algorithm: Hashing algorithm to use ('md5' or 'sha256'). Default is 'sha256'.
+    :return: Hexadecimal hash of the image.
+    """
+    with metrics.timer("embed.hash"):
+        hash_func = hashlib.sha256() if hash_algorithm.lower() == 'sha256' else hashlib.md5()
+        hash_func.update(image_bytes)  # hashlib releases the GIL for large buffers
+        return hash_func.hexdigest()
+
+def read_image_bytes(image_path):
+    """
+    Read an image file into memory with a single read.
+    :param image_path: Path to the image file.
+    :return: The file contents as bytes.
+    """
+    with open(image_path, 'rb') as img_file:
+        return img_file.read()
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of the current process in bytes, or None where unsupported.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+def is_large_image(img):
+    """Return True if an image should be processed in strips (see TILED_MIN_PIXELS)."""
+    return img.shape[0] * img.shape[1] >= TILED_MIN_PIXELS
+
+_hash_executor = None
+_hash_executor_pid = None
+
+def _get_hash_executor():
+    """Return the thread pool used to hash originals while they are being watermarked."""
+    global _hash_executor, _hash_executor_pid
+    if _hash_executor is None or _hash_executor_pid != os.getpid():  # Threads do not survive a fork
+        _hash_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hash")
+        _hash_executor_pid = os.getpid()
+    return _hash_executor
+
+# Reusable watermark engine
+class WatermarkEngine:
+    """
+    Long-lived, pre-configured replacement for building a WaterMark object per image.
+    Holds the passwords, block shape and quantization steps, and caches everything that does not depend
+    on the image content: the password-seeded block shufflers (per number of blocks) and the
+    watermark bit permutation (per watermark length). Output is identical to WaterMark.
+    """
+
+    def __init__(self, password_img=1, password_wm=1, block_shape=(4, 4), d1=36, d2=20, cache_size=8):
+        """
+        :param password_img: Password used to shuffle the DCT coefficients of every block.
+        :param password_wm: Password used to shuffle the watermark bits.
+        :param block_shape: Shape of the blocks the watermark is embedded in.
+        :param d1: Quantization step of the first singular value (larger is more robust but more visible).
+        :param d2: Quantization step of the second singular value, or 0 to use only the first.
+        :param cache_size: Number of distinct image sizes / watermark lengths kept in each cache.
+        """
+        self.password_img = password_img
+        self.password_wm = password_wm
+        self.block_shape = tuple(block_shape)
+        self.d1, self.d2 = d1, d2
+        self.cache_size = cache_size
+        self._block_shufflers = {}  # block_num -> (block_num, block size) shuffle indices
+        self._wm_permutations = {}  # wm_size -> permutation applied to the watermark bits
+        self._lock = threading.Lock()
+
+    def _cached(self, cache, key, build):
+        """Return cache[key], building it on a miss and evicting the oldest entry when full."""
+        with self._lock:
+            if key in cache:
+                return cache[key]
+        value = build()
+        with self._lock:
+            if len(cache) >= self.cache_size:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+        return value
+
+    def block_shuffler(self, block_num):
+        """Return the per-block coefficient shuffle indices for an image with block_num blocks."""
+        block_size = self.block_shape[0] * self.block_shape[1]
+        return self._cached(self._block_shufflers, block_num, lambda: random_strategy1(
+            self.password_img, block_num, block_size).astype(np.min_scalar_type(block_size)))
+
+    def wm_permutation(self, wm_size):
+        """Return the permutation that encrypts a watermark of wm_size bits (same as WaterMark.read_wm)."""
+        def build():
+            permutation = np.arange(wm_size)
+            np.random.RandomState(self.password_wm).shuffle(permutation)
+            return permutation
+        return self._cached(self._wm_permutations, wm_size, build)
+
+    def encode_text(self, watermark_text):
+        """
+        Encode a watermark string into encrypted watermark bits.
+        :param watermark_text: Watermark text to embed.
+        :return: Boolean NumPy array of encrypted bits; its size is len_wm.
+        """
+        byte = bin(int(watermark_text.encode('utf-8').hex(), base=16))[2:]
+        wm_bit = np.array(list(byte)) == '1'
+        return wm_bit[self.wm_permutation(wm_bit.size)]
+
+    def decode_text(self, wm_bit):
+        """Decrypt extracted watermark bits and decode them into a string."""
+        wm = np.empty_like(wm_bit)
+        wm[self.wm_permutation(wm_bit.size)] = wm_bit
+        byte = ''.join(str((i >= 0.5) * 1) for i in wm)
+        return bytes.fromhex(hex(int(byte, base=2))[2:]).decode('utf-8', errors='replace')
+
+    def encode_bytes(self, data):
+        """
+        Encode binary data, such as a watermark payload, into encrypted watermark bits.
+        :param data: Bytes to embed; every byte gives 8 bits, most significant first.
+        :return: Boolean NumPy array of encrypted bits; its size is 8 * len(data).
+        """
+        wm_bit = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).astype(bool)
+        return wm_bit[self.wm_permutation(wm_bit.size)]
+
+    def decode_bytes(self, wm_bit):
+        """Decrypt extracted watermark bits and pack them into bytes."""
+        wm = np.empty_like(wm_bit)
+        wm[self.wm_permutation(wm_bit.size)] = wm_bit
+        return np.packbits(np.asarray(wm) >= 0.5).tobytes()
+
+    def encode_payload(self, data):
+        """
+        Encode a watermark payload into encrypted watermark bits, protected by the error-correcting code.
+        :param data: PAYLOAD_SIZE bytes returned by payload.encode_payload.
+        :return: Boolean NumPy array of WATERMARK_BITS encrypted bits.
+        """
+        wm_bit = encode_payload_bits(data)
+        return wm_bit[self.wm_permutation(wm_bit.size)]
+
+    def embed(self, img, wm_bit):
+        """
+        Embed encrypted watermark bits into an image.
+        :param img: Decoded image array (BGR or BGRA).
+        :param wm_bit: Encrypted watermark bits from encode_text.
+        :return: The watermarked image as a float array (or uint8 BGRA for transparent images).
+        """
+        return self.embed_batch(img[np.newaxis], [wm_bit])[0]
+
+    def embed_batch(self, imgs, wm_bits):
+        """
+        Embed watermarks into a stack of same-shape images in one vectorized pass. The colour
+        conversion, DWT, per-block DCT and SVD run as NumPy/OpenCV operations over all blocks
+        of all images at once instead of a Python call per block; the result for every image
+        is bit-identical to WaterMark.embed.
+        :param imgs: Array of shape (N, H, W, C) or a sequence of N same-shape images.
+        :param wm_bits: Sequence of N encrypted watermark bit arrays (from encode_text).
+        :return: List of N watermarked images.
+        """
+        imgs = np.asarray(imgs)
+        alphas = [None] * len(imgs)
+        if imgs.shape[3] == 4:  # Keep the alpha channel of transparent images aside
+            alphas = [img[:, :, 3] if img[:, :, 3].min() < 255 else None for img in imgs]
+            imgs = imgs[..., :3]
+
+        height, width = imgs.shape[1:3]
+        cas, hvds = self._decompose(imgs)
+        block_num = self._block_num(cas[0].shape)
+        for wm_bit in wm_bits:
+            if wm_bit.size >= block_num:
+                raise ValueError(f"Image too small: {wm_bit.size} watermark bits need more than {block_num} blocks")
+
+        # Every block i of an image carries watermark bit i % len_wm
+        block_bits = np.stack([wm_bit[np.arange(block_num) % wm_bit.size] for wm_bit in wm_bits]).ravel()
+
+        shuffler = self.block_shuffler(block_num)
+        channels = []
+        for ca, hvd in zip(cas, hvds):
+            blocks = self._to_blocks(ca)
+            ca = ca.copy()
+            self._from_blocks(self._embed_blocks(blocks, block_bits, shuffler), ca)
+            channels.append(idwt2((ca, hvd), 'haar', axes=(-2, -1)))
+
+        # Merge the channels, drop the padding added for odd sizes and convert back to BGR
+        embed_yuv = np.stack(channels, axis=-1)[:, :height, :width]
+        embed_imgs = _convert_color_stack(embed_yuv, cv2.COLOR_YUV2BGR)
+        embed_imgs = np.clip(embed_imgs, a_min=0, a_max=255)
+
+        return [embed_img if alpha is None else cv2.merge([embed_img.astype(np.uint8), alpha])
+                for embed_img, alpha in zip(embed_imgs, alphas)]
+
+    def extract_bits(self, img, wm_size):
+        """
+        Extract the averaged (soft) watermark bits from a watermarked image, one value in [0, 1] per bit.
+        :param img: Decoded image array (BGR).
+        :param wm_size: Length of the watermark bit string (len_wm).
+        :return: Float array of wm_size encrypted bit estimates.
+        """
+        img = np.asarray(img)[np.newaxis, ..., :3]
+        cas, _ = self._decompose(img)
+        block_num = self._block_num(cas[0].shape)
+        if wm_size >= block_num:
+            raise ValueError(f"Image too small: {wm_size} watermark bits need more than {block_num} blocks")
+
+        shuffler = self.block_shuffler(block_num)
+        block_bits = np.stack([self._extract_blocks(self._to_blocks(ca), shuffler) for ca in cas])
+
+        # Average every bit over its repetitions and the 3 channels
+        bit_index = np.arange(block_num) % wm_size
+        sums = np.bincount(bit_index, weights=block_bits.sum(axis=0), minlength=wm_size)
+        return sums / (3 * np.bincount(bit_index, minlength=wm_size))
+
+    def extract_text(self, img, wm_size):
+        """
+        Extract a watermark string from a watermarked image.
+        :param img: Decoded image array (BGR).
+        :param wm_size: Length of the watermark bit string (len_wm).
+        :return: The extracted watermark text.
+        """
+        return self.decode_text(one_dim_kmeans(self.extract_bits(img, wm_size)))
+
+    def extract_payload(self, img, tiled=False, tile_rows=512, coded=True):
+        """
+        Extract, correct and check the fixed-length watermark payload (see payload.py); no len_wm is needed.
+        The soft bit values are decoded directly, so unreliable bits weigh less in the correction.
+        :param img: Decoded image array (BGR).
+        :param tiled: Extract strip by strip, for very large images.
+        :param tile_rows: Approximate strip height in pixels when tiled.
+        :param coded: False for version 1 payloads, which were embedded without error correction.
+        :return: Dictionary returned by payload.decode_payload; coded payloads also have a "confidence".
+        :raises PayloadError: If the image holds no valid payload.
+        """
+        wm_size = WATERMARK_BITS if coded else PAYLOAD_BITS
+        if tiled:
+            bits = self.extract_bits_tiled(img, wm_size, tile_rows)
+        else:
+            bits = self.extract_bits(img, wm_size)
+        if not coded:
+            return decode_payload(self.decode_bytes(one_dim_kmeans(bits)))
+        wm = np.empty_like(bits)
+        wm[self.wm_permutation(bits.size)] = bits
+        return decode_payload_bits(wm)
+
+    def embed_tiled(self, img, wm_bit, tile_rows=512):
+        """
+        Embed encrypted watermark bits into a very large image strip by strip, with bounded memory.
+        Strips are aligned to the DWT and block grid and the block shuffler is drawn from the
+        password-seeded generator strip by strip, so the result is bit-identical to embed()
+        rounded to uint8, while only one strip is ever held as float data. The image is
+        watermarked in place.
+        :param img: Decoded uint8 image array (BGR or BGRA); it is overwritten.
+        :param wm_bit: Encrypted watermark bits from encode_text.
+        :param tile_rows: Approximate strip height in pixels.
+        :return: The watermarked uint8 image.
+        """
+        height, width = img.shape[:2]
+        transparent = img.shape[2] == 4 and img[:, :, 3].min() < 255
+        self._check_capacity(wm_bit.size, height, width)
+
+        next_shuffler = self._shuffler_source()
+        block_offset = 0
+        for top in range(0, height, self._strip_step(tile_rows)):
+            strip = img[top:top + self._strip_step(tile_rows)]
+            cas, hvds = self._decompose(strip[np.newaxis, ..., :3])
+            block_num = self._block_num(cas[0].shape)
+            shuffler = next_shuffler(block_num)
+            block_bits = wm_bit[(block_offset + np.arange(block_num)) % wm_bit.size]
+
+            channels = []
+            for ca, hvd in zip(cas, hvds):
+                if block_num:
+                    self._from_blocks(self._embed_blocks(self._to_blocks(ca), block_bits, shuffler), ca)
+                channels.append(idwt2((ca, hvd), 'haar', axes=(-2, -1)))
+            embed_yuv = np.stack(channels, axis=-1)[:, :strip.shape[0], :width]
+            embed_strip = np.clip(_convert_color_stack(embed_yuv, cv2.COLOR_YUV2BGR)[0], a_min=0, a_max=255)
+
+            # Same float -> uint8 conversion as embed(): truncation for transparent images, else cv2.imwrite rounding
+            strip[..., :3] = embed_strip if transparent else np.rint(embed_strip)
+            block_offset += block_num
+
+        return img if img.shape[2] == 3 or transparent else np.ascontiguousarray(img[..., :3])
+
+    def extract_bits_tiled(self, img, wm_size, tile_rows=512):
+        """
+        Extract the averaged (soft) watermark bits strip by strip, with bounded memory.
+        Gives the same result as extract_bits.
+        :param img: Decoded image array (BGR).
+        :param wm_size: Length of the watermark bit string (len_wm).
+        :param tile_rows: Approximate strip height in pixels.
+        :return: Float array of wm_size encrypted bit estimates.
+        """
+        height, width = img.shape[:2]
+        self._check_capacity(wm_size, height, width)
+
+        next_shuffler = self._shuffler_source()
+        sums, counts = np.zeros(wm_size), np.zeros(wm_size)
+        block_offset = 0
+        for top in range(0, height, self._strip_step(tile_rows)):
+            cas, _ = self._decompose(img[np.newaxis, top:top + self._strip_step(tile_rows), :, :3])
+            block_num = self._block_num(cas[0].shape)
+            shuffler = next_shuffler(block_num)
+            if block_num:
+                block_bits = sum(self._extract_blocks(self._to_blocks(ca), shuffler) for ca in cas)
+                bit_index = (block_offset + np.arange(block_num)) % wm_size
+                sums += np.bincount(bit_index, weights=block_bits, minlength=wm_size)
+                counts += 3 * np.bincount(bit_index, minlength=wm_size)
+            block_offset += block_num
+        return sums / counts
+
+    def watermark_score(self, img, wm_size=WATERMARK_BITS, bands=4, band_rows=64):
+        """
+        Cheaply estimate whether an image carries a watermark of wm_size bits from this engine.
+        Only a few horizontal bands of the luma channel are transformed. Every watermark bit is
+        repeated in many blocks, so in a watermarked image the bits read from the copies of the
+        same bit agree, while in unwatermarked images they agree only by chance. Recompression
+        shifts the singular values away from their quantization levels, but as long as the
+        watermark is readable most copies still agree.
+        :param img: Decoded image array (BGR).
+        :param wm_size: Length of the watermark bit string (len_wm); by default that of the payload.
+        :param bands: Number of evenly spaced bands to probe.
+        :param band_rows: Approximate band height in pixels.
+        :return: Score around 1.0 for freshly watermarked images, above 0.3 after JPEG/WebP
+                 recompression down to quality 50, and around 0.0 for images without a watermark.
+                 Images too small to probe score 1.0, so full extraction decides.
+        """
+        height, width = img.shape[:2]
+        step = self._strip_step(band_rows)
+        blocks_per_band = (step // (2 * self.block_shape[0])) * (((width + 1) // 2) // self.block_shape[1])
+        band_count = height // step
+        if band_count == 0 or blocks_per_band == 0:
+            return 1.0
+
+        next_shuffler = self._shuffler_source()
+        bit_index, votes, position = [], [], 0
+        for band in sorted({int(b) for b in np.linspace(0, band_count - 1, bands)}):
+            shuffler = next_shuffler(blocks_per_band, skip=band * blocks_per_band - position)
+            position = (band + 1) * blocks_per_band
+            cas, _ = self._decompose(img[np.newaxis, band * step:(band + 1) * step, :, :3])
+            _, s, _ = svd(self._shuffle(_blockwise_dct(self._to_blocks(cas[0])), shuffler))
+            vote = 2.0 * (s[:, 0] % self.d1 > self.d1 / 2) - 1  # +1 for a 1 bit, -1 for a 0 bit
+            if self.d2:
+                vote += 2.0 * (s[:, 1] % self.d2 > self.d2 / 2) - 1
+            bit_index.append((band * blocks_per_band + np.arange(blocks_per_band)) % wm_size)
+            votes.append(vote)
+        bit_index, votes = np.concatenate(bit_index), np.concatenate(votes)
+
+        # Mean product of the votes of every pair of copies of the same bit, relative to the mean squared vote
+        sums = np.bincount(bit_index, weights=votes, minlength=wm_size)
+        squares = np.bincount(bit_index, weights=votes ** 2, minlength=wm_size)
+        counts = np.bincount(bit_index, minlength=wm_size)
+        pairs = (counts * (counts - 1)).sum()
+        if pairs == 0 or not squares.any():
+            return 1.0
+        return float((sums ** 2 - squares).sum() / pairs / (squares.sum() / votes.size))
+
+    def _strip_step(self, tile_rows):
+        """Round a strip height to a whole number of blocks in the DWT approximation band."""
+        unit = 2 * self.block_shape[0]
+        return max(unit, tile_rows // unit * unit)
+
+    def _check_capacity(self, wm_size, height, width):
+        block_num = self._block_num(((height + 1) // 2, (width + 1) // 2))
+        if wm_size >= block_num:
+            raise ValueError(f"Image too small: {wm_size} watermark bits need more than {block_num} blocks")
+
+    def _shuffler_source(self):
+        """
+        Return a function that yields the block shuffler in consecutive chunks, optionally
+        skipping blocks first. Drawing the
+        password-seeded random numbers chunk by chunk produces the same shuffler as
+        block_shuffler, without holding it for the whole image.
+        """
+        random_state = np.random.RandomState(self.password_img)
+        block_size = self.block_shape[0] * self.block_shape[1]
+
+        def next_shuffler(block_num, skip=0):
+            while skip > 0:  # Advance past blocks that are not needed, in bounded chunks
+                random_state.random(size=(min(skip, 65536), block_size))
+                skip -= 65536
+            return random_state.random(size=(block_num, block_size)).argsort(axis=1).astype(
+                np.min_scalar_type(block_size))
+        return next_shuffler
+
+    def _decompose(self, imgs):
+        """Convert a (N, H, W, 3) stack to YUV, pad it to even size and split every channel into DWT bands."""
+        with metrics.timer("transform.dwt"):
+            height, width = imgs.shape[1:3]
+            yuv = _convert_color_stack(imgs.astype(np.float32), cv2.COLOR_BGR2YUV)
+            yuv = np.pad(yuv, ((0, 0), (0, height % 2), (0, width % 2), (0, 0)))
+            cas, hvds = [], []
+            for channel in range(3):
+                ca, hvd = dwt2(yuv[..., channel], 'haar', axes=(-2, -1))
+                cas.append(ca.astype(np.float32))
+                hvds.append(hvd)
+            return cas, hvds
+
+    def _block_num(self, ca_shape):
+        return (ca_shape[-2] // self.block_shape[0]) * (ca_shape[-1] // self.block_shape[1])
+
+    def _to_blocks(self, ca):
+        """Cut a (N, h, w) approximation band into a (N * blocks, bh, bw) stack in row-major block order."""
+        bh, bw = self.block_shape
+        n, rows, cols = ca.shape[0], ca.shape[1] // bh, ca.shape[2] // bw
+        blocks = ca[:, :rows * bh, :cols * bw].reshape(n, rows, bh, cols, bw).transpose(0, 1, 3, 2, 4)
+        return np.ascontiguousarray(blocks).reshape(-1, bh, bw)
+
+    def _from_blocks(self, blocks, ca):
+        """Write a block stack produced by _to_blocks back into the approximation band, in place."""
+        bh, bw = self.block_shape
+        n, rows, cols = ca.shape[0], ca.shape[1] // bh, ca.shape[2] // bw
+        ca[:, :rows * bh, :cols * bw] = blocks.reshape(n, rows, cols, bh, bw).transpose(0, 1, 3, 2, 4).reshape(
+            n, rows * bh, cols * bw)
+
+    def _shuffle(self, coefficients, shuffler):
+        """Shuffle the flattened DCT coefficients of every block with the password-seeded block shuffler."""
+        shuffler = shuffler.astype(np.intp)
+        flat = coefficients.reshape(-1, *shuffler.shape)
+        return np.take_along_axis(flat, shuffler[np.newaxis], axis=2).reshape(coefficients.shape)
+
+    def _unshuffle(self, coefficients, shuffler):
+        shuffler = shuffler.astype(np.intp)
+        flat = coefficients.reshape(-1, *shuffler.shape)
+        restored = np.empty_like(flat)
+        np.put_along_axis(restored, shuffler[np.newaxis], flat, axis=2)
+        return restored.reshape(coefficients.shape)
+
+    def _embed_blocks(self, blocks, block_bits, shuffler):
+        """dct -> shuffle -> svd -> quantize singular values -> inverse svd -> unshuffle -> idct, for all blocks."""
+        coefficients = self._shuffle(_blockwise_dct(blocks), shuffler)
+        with metrics.timer("transform.svd"):
+            u, s, v = svd(coefficients)
+        s[:, 0] = (s[:, 0] // self.d1 + 1 / 4 + 1 / 2 * block_bits) * self.d1
+        if self.d2:
+            s[:, 1] = (s[:, 1] // self.d2 + 1 / 4 + 1 / 2 * block_bits) * self.d2
+        with metrics.timer("transform.svd"):
+            coefficients = np.matmul(u, s[..., np.newaxis] * v)
+        return _blockwise_dct(self._unshuffle(coefficients, shuffler), inverse=True)
+
+    def _extract_blocks(self, blocks, shuffler):
+        """dct -> shuffle -> svd -> read the bit from the quantized singular values, for all blocks."""
+        coefficients = self._shuffle(_blockwise_dct(blocks), shuffler)
+        with metrics.timer("transform.svd"):
+            _, s, _ = svd(coefficients)
+        wm = (s[:, 0] % self.d1 > self.d1 / 2) * 1
+        if self.d2:
+            wm = (wm * 3 + (s[:, 1] % self.d2 > self.d2 / 2) * 1) / 4
+        return wm
+
+
+def _convert_color_stack(imgs, code):
+    """Run cv2.cvtColor over a (N, H, W, 3) stack in a single call."""
+    n, height, width = imgs.shape[:3]
+    converted = cv2.cvtColor(np.ascontiguousarray(imgs).reshape(n * height, width, 3), code)
+    return converted.reshape(n, height, width, 3)
+
+def _blockwise_dct(blocks, inverse=False):
+    """
+    2-D DCT of every block in a (M, bh, bw) float32 stack. The rows and then the columns of
+    all blocks are transformed with single cv2.dct(DCT_ROWS) calls, which gives exactly the
+    same result as calling cv2.dct on every block.
+    """
+    with metrics.timer("transform.dct"):
+        flags = cv2.DCT_ROWS | (cv2.DCT_INVERSE if inverse else 0)
+        m, bh, bw = blocks.shape
+        rows = cv2.dct(np.ascontiguousarray(blocks).reshape(m * bh, bw), flags=flags).reshape(m, bh, bw)
+        columns = cv2.dct(np.ascontiguousarray(rows.transpose(0, 2, 1)).reshape(m * bw, bh), flags=flags)
+        return columns.reshape(m, bw, bh).transpose(0, 2, 1)
+
+
+_default_engine = None
+
+def get_default_engine():
+    """Return the engine used by embed_watermark and extract_watermark, creating it on first use."""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = WatermarkEngine(password_img=1, password_wm=1)
+    return _default_engine
+
+# Function to pay one-time start-up costs before the first real image arrives
+def warm_up():
+    """
+    Create the default engine and run a tiny embed and extraction through it, so the lazy
+    initialisation of OpenCV, NumPy's LAPACK and PyWavelets happens ahead of time.
+    Used as the initializer of long-lived worker processes.
+    """
+    engine = get_default_engine()
+    img = np.full((64, 64, 3), 128, dtype=np.uint8)
+    wm_bit = np.zeros(8, dtype=bool)
+    engine.extract_bits(np.clip(engine.embed(img, wm_bit), 0, 255).astype(np.uint8), wm_bit.size)
+    cv2.imencode('.png', img)
+
+# Functions to map between original image names and watermarked output paths
+def watermarked_image_path(watermarked_dir, image_name, ext=None):
+    """
+    Path of the watermarked copy of an original. Originals in subdirectories keep their
+    relative layout: 'a/b.jpg' is saved as '<watermarked_dir>/a/watermarked_b.jpg'.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :param image_name: Original image name, relative to the originals directory.
+    :param ext: Output format as a file extension, e.g. '.webp'; None keeps the extension of the original.
+    """
+    folder, file_name = os.path.split(image_name)
+    if not file_name.startswith("watermarked_"):
+        file_name = f"watermarked_{file_name}"
+    if ext is not None:
+        file_name = os.path.splitext(file_name)[0] + ext
+    return os.path.join(watermarked_dir, folder, file_name)
+
+def original_image_name(watermarked_name):
+    """Original image name (relative path) for a watermarked image name (relative path)."""
+    folder, file_name = os.path.split(watermarked_name)
+    return os.path.join(folder, file_name.replace("watermarked_", ""))
+
+# Embedding stage 1: read and decode the original image
+def read_original_image(image_name, originals_dir, watermarked_dir, encoding=None):
+    """
+    Read and decode an original image. This is the I/O-bound first stage of an embed.
+    :param image_name: Name of the original image file.
+    :param originals_dir: Path to the original images directory.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :param encoding: Optional EncodeOptions for the watermarked image.
+    :return: Job dictionary passed on to apply_watermark.
     """
     debug_logger.debug(f"Embedding watermark in {image_name}")
-    
+    encoding = encoding or EncodeOptions()
+
     # File paths
     original_image_path = os.path.join(originals_dir, image_name)
-    watermarked_image_path = os.path.join(watermarked_dir, f"watermarked_{image_name}")
+    output_path = watermarked_image_path(watermarked_dir, image_name, encoding.format)
 
     debug_logger.debug(f"Original image path: {original_image_path}")
-    debug_logger.debug(f"Watermarked image will be saved to: {watermarked_image_path}")
-    
-    # Capture the folder name where the originals came from
-    folder_name = os.path.basename(os.path.dirname(original_image_path))
+    debug_logger.debug(f"Watermarked image will be saved to: {output_path}")
+
+    # Read the original once; the same buffer is decoded here and hashed on a background thread
+    with metrics.timer("embed.read"):
+        image_bytes = read_image_bytes(original_image_path)
+    hash_future = _get_hash_executor().submit(hash_image_bytes, image_bytes, 'sha256')
+
+    with metrics.timer("embed.decode"):
+        img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), flags=cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise OSError(f"Image file '{original_image_path}' could not be read")
+    img = to_color_image(img, image_name)
+
+    return {
+        "image_name": image_name,
+        "original_image_path": original_image_path,
+        "watermarked_image_path": output_path,
+        "encoding": encoding,
+        "img": img,
+        "hash_future": hash_future,
+    }
+
+# Function to bring a decoded image into a layout the watermark can be embedded in
+def to_color_image(img, image_name):
+    """
+    Converts a grayscale image to BGR; the watermark is embedded in the colour channels.
+    :param img: Decoded image array (BGR, BGRA or grayscale).
+    :param image_name: Name of the image, for the error message.
+    :return: The image as BGR or BGRA.
+    :raises ValueError: If the image has any other layout.
+    """
+    if img.ndim == 2 or (img.ndim == 3 and img.shape[2] == 1):
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.ndim != 3 or img.shape[2] not in (3, 4):
+        raise ValueError(f"Image '{image_name}' has an unsupported shape {img.shape}; expected BGR, BGRA or grayscale")
+    return img
+
+# Build the watermark for a job: folder name, UUID and timestamp encoded into watermark bits
+def prepare_watermark(job):
+    """
+    Build the fixed-length watermark payload for a job, encode it into watermark bits and start its record.
+    :param job: Job dictionary returned by read_original_image.
+    :return: The job with "wm_bit" and "record" added.
+    """
+    image_name = job["image_name"]
+
+    # Capture the folder name where the originals came from (in-memory jobs carry it explicitly)
+    folder_name = job["folder"] if "folder" in job else os.path.basename(os.path.dirname(job["original_image_path"]))
 
     # Generate UUID and timestamp
     image_uuid = uuid.uuid1()  # Generate a unique UUID for the image
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Get the current timestamp
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")  # Get the current timestamp
 
-    # Log-like watermark text including folder name, UUID, and timestamp
-    watermark_text = (
-        f"[{timestamp}] [WATERMARK EMBED] UUID={image_uuid} Folder='{folder_name}' Message='Image was watermarked.'"
-    )
+    # Fixed-length binary payload with the UUID, the time and the folder id, protected by a CRC
+    payload = encode_payload(image_uuid, int(now.timestamp()), folder_name)
 
-    debug_logger.debug(f"Watermark text (log style): {watermark_text}")
+    debug_logger.debug(f"Watermark payload: UUID={image_uuid} Time={timestamp} "
+                       f"Folder='{folder_name}' (#{folder_id(folder_name):08x})")
 
-    # Initialize the WaterMark object
-    bwm1 = WaterMark(password_img=1, password_wm=1)
+    # Encode the payload, with error correction, with the shared, pre-configured engine
+    job["wm_bit"] = get_default_engine().encode_payload(payload)
 
-    # Read the original image and embed the watermark text
-    bwm1.read_img(original_image_path)
-    bwm1.read_wm(watermark_text, mode='str')  # Embed the watermark as a string
+    # Get the length of the watermark bit string (len_wm)
+    job["record"] = {
+        "image_name": image_name,
+        "uuid": image_uuid,
+        "folder": folder_name,
+        "timestamp": timestamp,
+        "len_wm": len(job["wm_bit"]),
+        "phash": perceptual_hash(job["img"]),  # Matches copies whose watermark no longer reads
+    }
+    return job
 
-    # Embed the watermark into the image and save the watermarked image
-    bwm1.embed(watermarked_image_path)
-    debug_logger.debug(f"Watermarked image saved at: {watermarked_image_path}")
+# Embedding stage 2: embed the watermark into the decoded image
+def apply_watermark(job):
+    """
+    Embed a watermark using the original folder name, UUID, and timestamp in a log format.
+    This is the CPU-bound second stage of an embed.
+    :param job: Job dictionary returned by read_original_image.
+    :return: The job with the decoded original replaced by the watermarked image array.
+    """
+    with metrics.timer("embed.transform"):
+        job = prepare_watermark(job)
+        img = job.pop("img")
+        if is_large_image(img):
+            # Embed very large images strip by strip to keep memory bounded
+            job["embed_img"] = get_default_engine().embed_tiled(img, job.pop("wm_bit"), tile_rows=TILE_ROWS)
+            debug_logger.debug(f"Tiled embed of {job['image_name']} ({img.shape[1]}x{img.shape[0]}), "
+                               f"peak RSS: {peak_rss_bytes()} bytes")
+        else:
+            job["embed_img"] = get_default_engine().embed(img, job.pop("wm_bit"))
+    return job
 
-    # Get the length of the watermark bit string (len_wm)
-    len_wm = len(bwm1.wm_bit)
+# Embedding stage 3: encode and save the watermarked image, then collect the hash of the original
+def save_watermarked_image(job):
+    """
+    Encode and save the watermarked image and collect the hash of the original, which was
+    computed from the buffer read in the first stage. This is the final, I/O-bound stage of an embed.
+    :param job: Job dictionary returned by apply_watermark.
+    :return: Dictionary with the keyword arguments expected by log_watermark.
+    """
+    output_path, encoding = job["watermarked_image_path"], job["encoding"]
+    encoded = encode_image(job["embed_img"], os.path.splitext(output_path)[1], encoding.quality, encoding.compression)
+    with metrics.timer("embed.write"):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)  # Mirror nested originals
+        with open(output_path, 'wb') as output_file:
+            output_file.write(encoded)
+    debug_logger.debug(f"Watermarked image saved at: {output_path} ({len(encoded)} bytes)")
+
+    # Collect and log the hash of the original image
+    record = job["record"]
+    with metrics.timer("embed.hash_wait"):  # Time the hash thread is still behind the encode
+        record["image_hash"] = job.pop("hash_future").result()
+    debug_logger.debug(f"Generated SHA-256 hash for {job['image_name']}: {record['image_hash']}")
+
+    return record
+
+# Utility function to embed a watermark into an image without logging the watermark record
+def embed_watermark_record(image_name, originals_dir, watermarked_dir, encoding=None):
+    """
+    Embed a watermark in an image and return the watermark record instead of logging it.
+    This is safe to run in a worker process; the caller is responsible for passing the
+    record to log_watermark so that the watermark log is only ever written by one process.
+    :param image_name: Name of the original image file.
+    :param originals_dir: Path to the original images directory.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :param encoding: Optional EncodeOptions (format, quality, PNG compression) of the watermarked image.
+    :return: Dictionary with the keyword arguments expected by log_watermark.
+    """
+    job = read_original_image(image_name, originals_dir, watermarked_dir, encoding)
+    return save_watermarked_image(apply_watermark(job))
+
+# Utility function to embed a watermark into an image held in memory without logging the watermark record
+def embed_watermark_buffer_record(image, image_name, folder, ext=None, quality=None, compression=None):
+    """
+    Embed a watermark into an image held in memory and return the watermarked image together
+    with its watermark record. Nothing is read from or written to disk, and the record is
+    returned instead of logged (as in embed_watermark_record), so this is safe to run in a worker process.
+    :param image: Encoded image data (bytes, bytearray or memoryview) or a decoded image array (BGR,
+                  BGRA or grayscale). Grayscale images are converted to BGR, which the watermark needs.
+    :param image_name: Name recorded for the image in the watermark log.
+    :param folder: Folder name written into the watermark.
+    :param ext: Output format as a file extension such as '.png'. Default: encoded input is encoded
+                again in the format of image_name's extension; an array input gives an array.
+    :param quality: JPEG/WebP quality (0-100) used when encoding.
+    :param compression: PNG compression level (0-9) used when encoding.
+    :return: Tuple of the watermarked image (encoded bytes, or a uint8 array) and the watermark record.
+    """
+    if isinstance(image, np.ndarray):
+        img = image
+        # The hash covers the raw pixel data, since there is no encoded file
+        hash_future = _get_hash_executor().submit(hash_image_bytes, np.ascontiguousarray(image), 'sha256')
+    else:
+        ext = ext or os.path.splitext(image_name)[1] or '.png'
+        hash_future = _get_hash_executor().submit(hash_image_bytes, image, 'sha256')
+        with metrics.timer("embed.decode"):
+            img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags=cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"Image data for '{image_name}' could not be decoded")
+
+    job = apply_watermark({"image_name": image_name, "folder": folder, "img": to_color_image(img, image_name)})
+    embed_img = job["embed_img"]
+    if ext is None:
+        output = embed_img if embed_img.dtype == np.uint8 else np.rint(embed_img).astype(np.uint8)
+    else:
+        output = encode_image(embed_img, ext, quality, compression)
+
+    record = job["record"]
+    record["image_hash"] = hash_future.result()
+    return output, record
+
+# Utility function to encode an image in memory
+def encode_image(img, ext, quality=None, compression=None):
+    """
+    Encode an image into the format given by a file extension. The encode time is recorded
+    under the 'embed.encode' stage and per format, e.g. 'embed.encode.webp'.
+    :param img: Image array; float images are rounded and clipped to uint8 first, as cv2.imwrite does.
+    :param ext: File extension of the format, e.g. '.jpg', '.png' or '.webp'.
+    :param quality: JPEG/WebP quality (0-100); ignored for PNG.
+    :param compression: PNG compression level (0-9); ignored for other formats.
+    :return: The encoded image as bytes.
+    """
+    ext = ext if ext.startswith('.') else f'.{ext}'
+    start = time.perf_counter()
+    if img.dtype.kind == 'f':  # OpenCV would convert (and warn about it) on every call
+        img = np.clip(np.rint(img), 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(ext, img, encode_params(ext, quality, compression))
+    seconds = time.perf_counter() - start
+    stage_format = ext.lower().lstrip('.')
+    metrics.observe("embed.encode", seconds)
+    metrics.observe(f"embed.encode.{'jpg' if stage_format == 'jpeg' else stage_format}", seconds)
+    if not ok:
+        raise ValueError(f"Watermarked image could not be encoded as '{ext}'")
+    return encoded.tobytes()
+
+# Function to translate encoder settings into OpenCV parameters
+def encode_params(ext, quality=None, compression=None):
+    """
+    Returns the cv2.imencode/imwrite parameters for a format; settings the format does not use are ignored.
+    :param ext: File extension of the format.
+    :param quality: JPEG/WebP quality (0-100).
+    :param compression: PNG compression level (0-9).
+    """
+    ext = ext.lower()
+    if quality is not None and ext in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if quality is not None and ext == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if compression is not None and ext == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+    return []
+
+# Output settings of watermarked images
+class EncodeOptions:
+    """
+    Format and encoder settings of watermarked images. The defaults keep the format of every
+    original with OpenCV's default settings. Picklable, so it can be passed to worker processes.
+    """
+
+    def __init__(self, format=None, quality=None, compression=None):
+        """
+        :param format: Output format as a file extension: '.jpg', '.png' or '.webp' (the dot is
+                       optional); None keeps the format of the original.
+        :param quality: JPEG/WebP quality (0-100); lower is smaller and faster, but weakens the watermark.
+        :param compression: PNG compression level (0-9); lower levels encode faster and give larger files.
+        """
+        if format is not None:
+            format = format.lower() if format.startswith('.') else f'.{format.lower()}'
+            format = '.jpg' if format == '.jpeg' else format
+            if format not in OUTPUT_FORMATS:
+                raise ValueError(f"Unsupported output format '{format}'; use one of {', '.join(OUTPUT_FORMATS)}")
+        if quality is not None and not 0 <= quality <= 100:
+            raise ValueError("Quality must be between 0 and 100")
+        if compression is not None and not 0 <= compression <= 9:
+            raise ValueError("PNG compression level must be between 0 and 9")
+        self.format = format
+        self.quality = quality
+        self.compression = compression
+
+    def __eq__(self, other):
+        return isinstance(other, EncodeOptions) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"EncodeOptions(format={self.format!r}, quality={self.quality!r}, compression={self.compression!r})"
+
+# Utility function to embed a watermark into an image held in memory
+def embed_watermark_buffer(image, image_name, folder="memory", ext=None, quality=None, compression=None):
+    """
+    Embed a watermark into encoded image data or a decoded array, without a disk round-trip, and
+    log the record like embed_watermark does (watermark log, registry and event store).
+    :param image: Encoded image data or a decoded image array (BGR or BGRA).
+    :param image_name: Name recorded for the image in the watermark log.
+    :param folder: Folder name written into the watermark.
+    :param ext: Output format, e.g. '.png' (see embed_watermark_buffer_record for the default).
+    :param quality: JPEG/WebP quality (0-100) used when encoding.
+    :param compression: PNG compression level (0-9) used when encoding.
+    :return: Tuple of the watermarked image (encoded bytes or array) and the watermark bit length (len_wm).
+    """
+    output, record = embed_watermark_buffer_record(image, image_name, folder, ext, quality, compression)
+    log_watermark(**record)
+    return output, record["len_wm"]
+
+# Utility function to embed watermarks into batches of same-size images
+def embed_watermark_batch_records(image_names, originals_dir, watermarked_dir, batch_size=16, encoding=None):
+    """
+    Embed watermarks into many images, transforming consecutive images of the same shape
+    together with WatermarkEngine.embed_batch. Every output is bit-identical to what
+    embed_watermark_record would write. Records are returned instead of logged, as in
+    embed_watermark_record.
+    :param image_names: Iterable of original image file names.
+    :param originals_dir: Path to the original images directory.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :param batch_size: Maximum number of images transformed together; bounds peak memory.
+    :param encoding: Optional EncodeOptions (format, quality, PNG compression) of the watermarked images.
+    :return: Generator of watermark records, in input order.
+    """
+    batch = []
+    for image_name in image_names:
+        job = read_original_image(image_name, originals_dir, watermarked_dir, encoding)
+        if batch and (job["img"].shape != batch[0]["img"].shape or len(batch) >= batch_size or is_large_image(job["img"])):
+            yield from _embed_batch(batch)
+            batch = []
+        if is_large_image(job["img"]):  # Never stack very large images; embed them in strips instead
+            yield save_watermarked_image(apply_watermark(job))
+        else:
+            batch.append(job)
+    if batch:
+        yield from _embed_batch(batch)
+
+def _embed_batch(jobs):
+    """Embed, save and return the records of a list of same-shape jobs."""
+    with metrics.timer("embed.transform_batch"):
+        jobs = [prepare_watermark(job) for job in jobs]
+        imgs = np.stack([job.pop("img") for job in jobs])
+        embed_imgs = get_default_engine().embed_batch(imgs, [job.pop("wm_bit") for job in jobs])
+        del imgs
+    for job, embed_img in zip(jobs, embed_imgs):
+        job["embed_img"] = embed_img
+        yield save_watermarked_image(job)
+
+# Utility function to embed watermarks into batches of same-size images and log them
+def embed_watermark_batch(image_names, originals_dir, watermarked_dir, batch_size=16, encoding=None):
+    """
+    Embed watermarks into many images with the vectorized batch transform and log every record.
+    :return: Dictionary mapping each image name to its watermark bit length (len_wm).
+    """
+    watermark_lengths = {}
+    for record in embed_watermark_batch_records(image_names, originals_dir, watermarked_dir, batch_size, encoding):
+        log_watermark(**record)
+        watermark_lengths[record["image_name"]] = record["len_wm"]
+    return watermark_lengths
+
+# Utility function to embed watermarks with overlapped read, transform and write stages
+def embed_watermark_pipeline(image_names, originals_dir, watermarked_dir, queue_depth=4, encoding=None):
+    """
+    Embed watermarks into many images with each stage on its own thread: a reader thread
+    decodes the next images while the current one is transformed, and a writer thread
+    encodes and saves finished images. Stages are connected by bounded queues, so at most
+    about 3 * queue_depth images are held in memory at once.
+    :param image_names: Iterable of original image file names.
+    :param originals_dir: Path to the original images directory.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :param queue_depth: Maximum number of images waiting between two stages.
+    :param encoding: Optional EncodeOptions; the encode runs on the writer thread.
+    :return: Generator of watermark records (as from embed_watermark_record), in input order.
+    """
+    decoded_queue = queue.Queue(maxsize=queue_depth)
+    watermarked_queue = queue.Queue(maxsize=queue_depth)
+    record_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+
+    jobs = (read_original_image(image_name, originals_dir, watermarked_dir, encoding) for image_name in image_names)
+    threads = [
+        threading.Thread(target=_run_pipeline_stage, args=(jobs, None, decoded_queue, stop), daemon=True),
+        threading.Thread(target=_run_pipeline_stage, args=(decoded_queue, apply_watermark, watermarked_queue, stop), daemon=True),
+        threading.Thread(target=_run_pipeline_stage, args=(watermarked_queue, save_watermarked_image, record_queue, stop), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while (item := record_queue.get()) is not _PIPELINE_END:
+            if isinstance(item, _PipelineError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()  # Unblock the stages if the caller stopped early or a stage failed
+        for thread in threads:
+            thread.join()
+
+# Marker passed down the pipeline after the last image
+_PIPELINE_END = object()
+
+class _PipelineError:
+    """Carries an exception raised in a pipeline stage to the consuming thread."""
+
+    def __init__(self, error):
+        self.error = error
+
+def _run_pipeline_stage(source, func, output_queue, stop):
+    """
+    Run one pipeline stage until the end marker or an error arrives.
+    :param source: Input queue, or an iterator of ready-made items for the first stage.
+    :param func: Function applied to every item, or None to forward items unchanged.
+    :param output_queue: Queue receiving the results.
+    :param stop: Event set when the pipeline is shut down.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get():
+        if not isinstance(source, queue.Queue):
+            return next(source, _PIPELINE_END)
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _PIPELINE_END
 
-    # Generate and log the hash of the original image
-    image_hash = generate_image_hash(original_image_path, 'sha256')
-    debug_logger.debug(f"Generated SHA-256 hash for {image_name}: {image_hash}")
+    while True:
+        try:
+            item = get()
+            if item is not _PIPELINE_END and not isinstance(item, _PipelineError) and func is not None:
+                item = func(item)
+        except Exception as e:
+            item = _PipelineError(e)
+        if not put(item) or item is _PIPELINE_END or isinstance(item, _PipelineError):
+            return
+
+# Utility function to embed a watermark into an image
+def embed_watermark(image_name, originals_dir, watermarked_dir, encoding=None):
+    """
+    Embed a watermark in an image using the original folder name, UUID, and timestamp in a log format.
+    Also generates and logs the hash of the original image.
+    :param encoding: Optional EncodeOptions (format, quality, PNG compression) of the watermarked image.
+    """
+    record = embed_watermark_record(image_name, originals_dir, watermarked_dir, encoding)
 
     # Log the watermarking event, including the watermark bit length and image hash
-    log_watermark(image_name, image_uuid, folder_name, timestamp, len_wm, image_hash)
+    log_watermark(**record)
+
+    return record["len_wm"]
 
-    return len_wm
+# Counters for the extraction screening stage
+class ScreeningStats:
+    """Counts screened images and times the screening and full extraction stages."""
+
+    def __init__(self, threshold=None):
+        """
+        :param threshold: Minimum watermark score for an image to go to full extraction (default: SCREEN_THRESHOLD).
+        """
+        self.threshold = SCREEN_THRESHOLD if threshold is None else threshold
+        self.screened = 0
+        self.passed = 0
+        self.screen_seconds = 0.0
+        self.extract_seconds = 0.0  # Full extractions of the images that passed
+
+    @property
+    def rejected(self):
+        return self.screened - self.passed
+
+    def time_saved(self):
+        """Estimate the time saved: skipped full extractions minus the time spent screening."""
+        if not self.passed:
+            return 0.0
+        return self.rejected * self.extract_seconds / self.passed - self.screen_seconds
+
+    def summary(self):
+        return (f"Screened {self.screened} images: {self.passed} passed, {self.rejected} rejected; "
+                f"screening took {self.screen_seconds:.2f}s, estimated time saved {self.time_saved():.2f}s")
 
 # Utility function to extract a watermark from a watermarked image
-def extract_watermark(image_name, wm_shape, watermarked_dir):
+def extract_watermark(image_name, wm_shape, watermarked_dir, log_cache=None, screening=None):
     """
     Extract the watermark from a watermarked image and return it in a log format.
     :param image_name: Name of the watermarked image file.
-    :param wm_shape: Length of the watermark bit string (wm_bit) to aid extraction.
+    :param wm_shape: None to read the fixed-length payload, which needs no lookup. Images watermarked
+                     with a text watermark before the payload existed are then extracted with the
+                     len_wm of their record. Pass a len_wm to read a text watermark directly.
     :param watermarked_dir: Path to the watermarked images directory.
+    :param log_cache: Optional WatermarkLogCache used for validation instead of the watermark records on disk.
+    :param screening: Optional ScreeningStats; when given, images without detectable watermark
+                      energy are rejected by a cheap probe before full extraction.
     """
     debug_logger.debug(f"Extracting watermark from {image_name}")
 
-    # Check if the image name is already prefixed with "watermarked_"
-    if not image_name.startswith("watermarked_"):
-        watermarked_image_name = f"watermarked_{image_name}"
-    else:
-        watermarked_image_name = image_name
+    # File path of the watermarked image (the name may already be prefixed with "watermarked_")
+    watermarked_path = watermarked_image_path(watermarked_dir, image_name)
 
-    # File path of the watermarked image
-    watermarked_image_path = os.path.join(watermarked_dir, watermarked_image_name)
-    
-    debug_logger.debug(f"Watermarked image path: {watermarked_image_path}")
+    debug_logger.debug(f"Watermarked image path: {watermarked_path}")
     
-    # Initialize the WaterMark object for extraction
-    bwm1 = WaterMark(password_img=1, password_wm=1)
-
-    # Extract the watermark from the watermarked image
+    # Extract the watermark from the watermarked image with the shared engine
     try:
-        wm_extract = bwm1.extract(watermarked_image_path, wm_shape=wm_shape, mode='str')
+        with metrics.timer("extract.decode"):
+            embed_img = cv2.imread(watermarked_path, flags=cv2.IMREAD_COLOR)
+        if embed_img is None:
+            raise OSError(f"Image file '{watermarked_path}' could not be read")
+        engine = get_default_engine()
+
+        def legacy_len_wm():
+            return log_cache.get_len_wm(image_name) if log_cache is not None else get_len_wm_from_log(image_name)
+
+        if screening is not None:
+            start = time.perf_counter()
+            score = engine.watermark_score(embed_img, wm_shape or WATERMARK_BITS)
+            if score < screening.threshold and wm_shape is None:
+                # Images watermarked with a text watermark repeat their bits every len_wm blocks
+                len_wm = legacy_len_wm()
+                if len_wm:
+                    score = max(score, engine.watermark_score(embed_img, len_wm))
+            screening.screened += 1
+            screening.screen_seconds += time.perf_counter() - start
+            metrics.observe("extract.screen", time.perf_counter() - start)
+            if score < screening.threshold:
+                debug_logger.debug(f"Screening rejected {image_name} (watermark score {score:.3f})")
+                return None, False
+            screening.passed += 1
+            start = time.perf_counter()
+
+        wm_extract = _extract_text(embed_img, wm_shape, legacy_len_wm)
+        if is_large_image(embed_img):
+            debug_logger.debug(f"Tiled extraction from {image_name}, peak RSS: {peak_rss_bytes()} bytes")
+        if screening is not None:
+            screening.extract_seconds += time.perf_counter() - start
     except Exception as e:
         debug_logger.error(f"Error during extraction: {str(e)}")
         return None, False
 
+    return record_extraction(image_name, wm_extract, log_cache)
+
+# Utility function to log and validate an extracted watermark
+def record_extraction(image_name, wm_extract, log_cache=None):
+    """
+    Log an extracted watermark and validate its UUID against the watermark records. Called in the
+    process that owns the logs, e.g. with text extracted by extract_watermark_text in a worker process.
+    :param image_name: Name of the watermarked image.
+    :param wm_extract: The extracted watermark text.
+    :param log_cache: Optional WatermarkLogCache used for validation instead of the watermark records on disk.
+    :return: Tuple of the log-formatted extracted watermark and the validation status.
+    """
     # Adjust extracted watermark to follow log format
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Timestamp for extraction log
     extracted_log = f"[{timestamp}] [WATERMARK EXTRACT] Extracted Watermark: {wm_extract}"
@@ -116,7 +1105,10 @@ def extract_watermark(image_name, wm_shape, watermarked_dir):
     extracted_uuid = extract_data_from_watermark(wm_extract, "UUID")
 
     # Validate against log records using only the UUID
-    validation_status = validate_watermark(extracted_uuid)
+    if log_cache is not None:
+        validation_status = log_cache.validate(extracted_uuid)
+    else:
+        validation_status = validate_watermark(extracted_uuid)
 
     if validation_status:
         debug_logger.debug(f"Validation successful for UUID: {extracted_uuid}")
@@ -124,6 +1116,131 @@ def extract_watermark(image_name, wm_shape, watermarked_dir):
         debug_logger.debug(f"Validation failed for UUID: {extracted_uuid}")
 
     return extracted_log, validation_status  # Return the log-formatted extracted watermark and validation status
+
+# Utility function to extract the watermark text from an image held in memory
+def extract_watermark_text_buffer(image, wm_shape=None, legacy_len_wm=None):
+    """
+    Extract the watermark text from encoded image data or a decoded array, without logging or
+    validation, so this is safe to run in a worker process.
+    :param image: Encoded watermarked image data or a decoded image array (BGR).
+    :param wm_shape: None for the fixed-length payload, or the len_wm of a text watermark.
+    :param legacy_len_wm: Recorded len_wm of the image, tried when it holds no valid payload.
+    :return: The extracted watermark text.
+    """
+    if isinstance(image, np.ndarray):
+        embed_img = image
+    else:
+        with metrics.timer("extract.decode"):
+            embed_img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags=cv2.IMREAD_COLOR)
+        if embed_img is None:
+            raise ValueError("Image data could not be decoded")
+    return _extract_text(embed_img, wm_shape, legacy_len_wm=lambda: legacy_len_wm)
+
+def _extract_text(embed_img, wm_shape=None, legacy_len_wm=None):
+    """
+    Extract the watermark of a decoded image as text: the fixed-length payload rendered by
+    payload.format_payload when wm_shape is None (or WATERMARK_BITS), else a text watermark of wm_shape bits.
+    :param legacy_len_wm: Optional function returning the len_wm of an older watermark; it is only
+                          called, and that watermark extracted, when no valid payload is found.
+    """
+    engine = get_default_engine()
+    tiled = is_large_image(embed_img)
+    with metrics.timer("extract.transform"):
+        if wm_shape is not None and wm_shape != WATERMARK_BITS:
+            return _extract_legacy_text(engine, embed_img, wm_shape, tiled)
+        try:
+            return format_payload(engine.extract_payload(embed_img, tiled=tiled, tile_rows=TILE_ROWS))
+        except PayloadError:
+            len_wm = legacy_len_wm() if legacy_len_wm is not None else None
+            if not len_wm or len_wm == WATERMARK_BITS:
+                raise
+            return _extract_legacy_text(engine, embed_img, len_wm, tiled)
+
+def _extract_legacy_text(engine, embed_img, wm_shape, tiled):
+    """
+    Extract an older watermark of wm_shape bits: a version 1 payload (PAYLOAD_BITS, without error
+    correction) or a log-style text watermark (embedded before the fixed-length payload).
+    """
+    if wm_shape == PAYLOAD_BITS:
+        return format_payload(engine.extract_payload(embed_img, tiled=tiled, tile_rows=TILE_ROWS, coded=False))
+    if tiled:
+        return engine.decode_text(one_dim_kmeans(engine.extract_bits_tiled(embed_img, wm_shape, TILE_ROWS)))
+    return engine.extract_text(embed_img, wm_shape)
+
+# Utility function to extract the watermark text from a watermarked image without logging it
+def extract_watermark_text(image_name, wm_shape, watermarked_dir):
+    """
+    Extract the watermark text from a watermarked image file without logging or validation, so
+    this is safe to run in a worker process; the caller passes the text to record_extraction.
+    :param image_name: Name of the watermarked image file.
+    :param wm_shape: None for the fixed-length payload, or the len_wm of a text watermark.
+    :param watermarked_dir: Path to the watermarked images directory.
+    :return: The extracted watermark text.
+    """
+    watermarked_path = watermarked_image_path(watermarked_dir, image_name)
+    with metrics.timer("extract.read"):
+        image_bytes = read_image_bytes(watermarked_path)
+    return extract_watermark_text_buffer(image_bytes, wm_shape)
+
+# Utility function to extract the watermark of one file of a bulk verification
+def verify_watermark_file(path, legacy_len_wm=None):
+    """
+    Extract the watermark text of an image file and time it, without logging or validation, so
+    this is safe to run in a worker process. Errors are returned instead of raised, so one
+    unreadable file does not stop a bulk verification.
+    :param path: Path of the image file.
+    :param legacy_len_wm: Recorded len_wm of the image, tried when it holds no valid payload.
+    :return: Dictionary with the extracted "text" (None on failure), the "error" message (None on
+             success) and the "seconds" the extraction took.
+    """
+    start = time.perf_counter()
+    try:
+        with metrics.timer("extract.read"):
+            image_bytes = read_image_bytes(path)
+        text, error = extract_watermark_text_buffer(image_bytes, legacy_len_wm=legacy_len_wm), None
+    except Exception as e:
+        text, error = None, str(e) or type(e).__name__
+    return {"text": text, "error": error, "seconds": time.perf_counter() - start}
+
+# Utility function to extract a watermark from an image held in memory
+def extract_watermark_buffer(image, wm_shape=None, image_name="<memory>", log_cache=None):
+    """
+    Extract and validate the watermark of encoded image data or a decoded array, without a disk
+    round-trip, with the same logging and validation as extract_watermark.
+    :param image: Encoded watermarked image data or a decoded image array (BGR).
+    :param wm_shape: None for the fixed-length payload, or the len_wm of a text watermark.
+    :param image_name: Name recorded for the image in the extraction log.
+    :param log_cache: Optional WatermarkLogCache used for validation instead of the watermark records on disk.
+    :return: Tuple of the log-formatted extracted watermark and the validation status.
+    """
+    debug_logger.debug(f"Extracting watermark from {image_name} (in memory)")
+    try:
+        wm_extract = extract_watermark_text_buffer(image, wm_shape)
+    except Exception as e:
+        debug_logger.error(f"Error during extraction: {str(e)}")
+        return None, False
+    return record_extraction(image_name, wm_extract, log_cache)
+
+# Utility function to find the originals a suspect image was made from
+def find_original(image, max_distance=MATCH_DISTANCE, limit=10):
+    """
+    Match an image against the originals in the registry by perceptual hash. Unlike the watermark,
+    this still works for copies that were recompressed, resized or edited until the watermark broke.
+    :param image: Path of an image file, encoded image data or a decoded image array.
+    :param max_distance: Maximum Hamming distance of the perceptual hashes.
+    :param limit: Maximum number of records returned.
+    :return: List of watermark record dictionaries with a "distance" key, closest first.
+    """
+    if isinstance(image, str):
+        image = read_image_bytes(image)
+    if not isinstance(image, np.ndarray):
+        image = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags=cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Image data could not be decoded")
+    with metrics.timer("match.lookup"):
+        wait_for_records()
+        return get_registry().find_similar(perceptual_hash(image), max_distance, limit)
+
 # Helper function to extract specific data from the watermark text (e.g., UUID, folder, time)
 def extract_data_from_watermark(watermark_text, data_type):
     """
@@ -0,0 +1,245 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from discovery import IMAGE_EXTENSIONS, iter_images, matches_any
+from logger import debug_logger
+
+# inotify event flags (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Events that can make a new or changed image appear; IN_CREATE is also needed to see new directories
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+
+# Header of a struct inotify_event: wd, mask, cookie, len (the name follows)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+# Function to load the inotify calls from libc
+def _load_inotify():
+    """Returns libc if it provides inotify (Linux), else None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class InotifyWatcher:
+    """Reports images that are created, written or moved into a directory tree, using inotify through ctypes."""
+
+    def __init__(self, root, include=(), exclude=()):
+        """
+        Watches root and all its subdirectories.
+        :param root: Directory to watch.
+        :param include: Glob patterns; only matching images are reported.
+        :param exclude: Glob patterns of images or directories to ignore.
+        """
+        self.root = root
+        self.include, self.exclude = include, exclude
+        self._libc = _load_inotify()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}  # watch descriptor -> directory relative to root
+        self._pending = set()  # Images found while adding watches for new directories
+        self._watch_tree('', report_existing=False)
+
+    def _watch_tree(self, relative_dir, report_existing=True):
+        """
+        Adds watches for a directory and its subdirectories.
+        :param report_existing: Report the images already in them (for directories created or moved in while watching).
+        """
+        pending = [relative_dir]
+        while pending:
+            relative_dir = pending.pop()
+            path = os.path.join(self.root, relative_dir)
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                debug_logger.warning(f"Cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._dirs[wd] = relative_dir
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        relative_path = os.path.join(relative_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if not (matches_any(relative_path, self.exclude)
+                                    or matches_any(relative_path + os.sep, self.exclude)):
+                                pending.append(relative_path)
+                        elif report_existing and self._accepts(relative_path):
+                            # Files written into a new directory before its watch existed
+                            self._pending.add(relative_path)
+            except OSError:
+                continue
+
+    def _accepts(self, relative_path):
+        if not relative_path.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        if self.include and not matches_any(relative_path, self.include):
+            return False
+        return not matches_any(relative_path, self.exclude)
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds for changes.
+        :return: Set of image paths (relative to root) that were created or changed.
+        """
+        changed, self._pending = self._pending, set()
+        if changed:
+            timeout = 0
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_length].rstrip(b'\0'))
+            offset += INOTIFY_EVENT.size + name_length
+
+            if mask & IN_Q_OVERFLOW:  # Events were lost; fall back to a full scan
+                debug_logger.warning("inotify queue overflowed, rescanning the watched tree")
+                changed.update(iter_images(self.root, self.include, self.exclude))
+                continue
+            if mask & IN_IGNORED:  # The directory was removed
+                self._dirs.pop(wd, None)
+                continue
+            if wd not in self._dirs or not name:
+                continue
+            relative_path = os.path.join(self._dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(relative_path)
+                    changed.update(self._pending)
+                    self._pending.clear()
+            elif self._accepts(relative_path):
+                changed.add(relative_path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports new or changed images by rescanning a directory tree at a fixed interval."""
+
+    def __init__(self, root, include=(), exclude=(), interval=2.0):
+        """
+        :param root: Directory to watch.
+        :param include: Glob patterns; only matching images are reported.
+        :param exclude: Glob patterns of images or directories to ignore.
+        :param interval: Seconds between two scans.
+        """
+        self.root = root
+        self.include, self.exclude = include, exclude
+        self.interval = interval
+        self._next_scan = time.monotonic() + interval
+        self._seen = self._scan()  # relative path -> (size, mtime_ns) at the last scan
+
+    def _scan(self):
+        signatures = {}
+        for relative_path in iter_images(self.root, self.include, self.exclude):
+            try:
+                stat = os.stat(os.path.join(self.root, relative_path))
+            except OSError:
+                continue
+            signatures[relative_path] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds and rescans the tree when the interval has passed.
+        :return: Set of image paths (relative to root) that were created or changed.
+        """
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(delay, 0))
+        self._next_scan = time.monotonic() + self.interval
+        signatures = self._scan()
+        changed = {path for path, signature in signatures.items() if self._seen.get(path) != signature}
+        self._seen = signatures
+        return changed
+
+    def close(self):
+        pass
+
+
+# Function to pick the best available watcher
+def create_watcher(root, include=(), exclude=(), polling=False, interval=2.0):
+    """
+    Returns an InotifyWatcher where inotify is available, else (or when polling is requested) a PollingWatcher.
+    Neither reports the images that already exist when it starts.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(root, include, exclude)
+        except OSError as e:
+            debug_logger.warning(f"Falling back to polling: {e}")
+    return PollingWatcher(root, include, exclude, interval)
+
+
+class Debouncer:
+    """
+    Holds back changed files until they have stopped changing, so files that are still being
+    copied or written are never processed half-written.
+    """
+
+    def __init__(self, root, quiet_seconds=1.0):
+        """
+        :param root: Directory the file paths are relative to.
+        :param quiet_seconds: How long size and modification time must stay unchanged.
+        """
+        self.root = root
+        self.quiet_seconds = quiet_seconds
+        self._pending = {}  # relative path -> ((size, mtime_ns), time the signature was first seen)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, relative_paths):
+        """Starts (or restarts) the quiet period of the given files."""
+        now = time.monotonic()
+        for relative_path in relative_paths:
+            self._pending[relative_path] = (None, now)
+
+    def ready(self):
+        """
+        Returns the files whose size and modification time have been stable for the quiet period
+        and stops tracking them. Files that disappeared are dropped.
+        """
+        now, ready = time.monotonic(), []
+        for relative_path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.root, relative_path))
+            except OSError:
+                del self._pending[relative_path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[relative_path] = (current, now)
+            elif now - since >= self.quiet_seconds:
+                ready.append(relative_path)
+                del self._pending[relative_path]
+        return ready